@@ -0,0 +1,260 @@
+"""
+測定の流れ(MeasurementManager → FileManager → PlotAgency)全体の速度を測るベンチマーク
+
+実際の機器やダイアログを使わずに, 指定した列数のデータを
+指定した速さで保存・プロットする合成マクロを動かして次の値を出力する
+    rows/s        : 1秒あたりに処理できた行数 (最初のupdateから最後のupdateまで)
+    startup       : 測定開始から最初のupdateまでの時間
+    latency       : 1行の保存・プロットにかかった時間の分位点(p50, p95, p99, max)
+    peak_rss      : プロセスの最大メモリ使用量
+シナリオは save(保存のみ), plot(プロットのみ), both(両方) の3つ
+
+使い方
+------
+python benchmarks/bench_measurement.py                     # 実行して結果を表示
+python benchmarks/bench_measurement.py --save-baseline     # 結果をbaseline.jsonに保存
+python benchmarks/bench_measurement.py --compare           # baseline.jsonと比較して遅くなっていたら終了コード1
+python benchmarks/bench_measurement.py --rows 5000 --columns 20 --rate 200
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+SCRIPTS_DIR = BENCHMARK_DIR.parent / "scripts"
+BASELINE_PATH = BENCHMARK_DIR / "baseline.json"
+SCENARIOS = ("save", "plot", "both")
+
+
+def _peak_rss_mb() -> float:
+    """プロセスの最大メモリ使用量[MB] (取得できないときは-1)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+
+            return psutil.Process().memory_info().peak_wset / 1024**2
+        except Exception:
+            return -1.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxでは[KB], macOSでは[B]
+    return rss / 1024**2 if sys.platform == "darwin" else rss / 1024
+
+
+def run_scenario(scenario: str, rows: int, columns: int, rate: float) -> dict:
+    """1つのシナリオを実行して結果を返す(ベンチマーク用の子プロセスで呼ばれる)"""
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+    import numpy as np
+
+    import measurement_manager as mm
+    from basedata import BaseData
+    from variables import USER_VARIABLES
+
+    def no_dialog(*args, **kwargs):
+        raise RuntimeError("ベンチマーク中にダイアログを出そうとしました")
+
+    mm.ask_save_filename = no_dialog
+    mm._copy_to_clipboard = lambda text: None
+
+    datadir = Path(tempfile.mkdtemp(prefix="ssr_bench_"))
+    USER_VARIABLES.set_DATADIR(datadir)
+
+    Data = type(
+        "Data",
+        (BaseData,),
+        {"__annotations__": {f"column{i}": "[a.u.]" for i in range(columns)}},
+    )
+    names = list(Data.__annotations__.keys())
+    latencies = np.zeros(rows)
+    interval = 0.0 if rate <= 0 else 1.0 / rate
+    count = 0
+    next_time = 0.0
+    first_update = None
+
+    def start():
+        nonlocal next_time
+        if scenario == "save":
+            mm.no_plot()
+        else:
+            mm.set_plot_info(renew_interval=0.2)
+        if scenario == "plot":
+            mm.dont_make_file()
+        else:
+            mm.set_header(Data.get_names())
+        next_time = time.perf_counter()
+
+    def update():
+        nonlocal count, next_time, first_update
+        if first_update is None:
+            first_update = time.perf_counter()
+        if count >= rows:
+            return False
+        if interval > 0:
+            wait = next_time - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            next_time += interval
+
+        t0 = time.perf_counter()
+        data = Data(**{name: count * 0.1 + i for i, name in enumerate(names)})
+        if scenario != "plot":
+            mm.save(data)
+        if scenario != "save":
+            mm.plot(data.column0, data.column1 if columns > 1 else count)
+        latencies[count] = time.perf_counter() - t0
+        count += 1
+
+    macro = types.ModuleType("benchmark_macro")
+    macro.start = start
+    macro.update = update
+    macro.end = None
+    macro.on_command = None
+    macro.split = None
+    macro.after = None
+
+    class BenchmarkManager(mm.MeasurementManager):
+        def end(self):
+            # コンソールの入力待ちをせずにプロットウィンドウを閉じる
+            self.plot_agency.close()
+
+    manager = BenchmarkManager(macro)
+    mm._measurement_manager = manager
+    begin = time.perf_counter()
+    manager.measure_start()
+    elapsed = time.perf_counter() - first_update
+
+    latencies = latencies[:count] * 1e6
+    return {
+        "scenario": scenario,
+        "rows": count,
+        "columns": columns,
+        "rate": rate,
+        "rows_per_s": count / elapsed,
+        "startup_ms": (first_update - begin) * 1e3,
+        "latency_us": {
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+            "max": float(latencies.max()),
+        },
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_all(rows: int, columns: int, rate: float, scenarios) -> dict:
+    """シナリオごとに子プロセスを立てて実行する (最大メモリ使用量をシナリオごとに測るため)"""
+    results = {}
+    for scenario in scenarios:
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / "result.json"
+            subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--run-one",
+                    scenario,
+                    "--rows",
+                    str(rows),
+                    "--columns",
+                    str(columns),
+                    "--rate",
+                    str(rate),
+                    "--output-json",
+                    str(output),
+                ],
+                check=True,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+            )
+            results[scenario] = json.loads(output.read_text(encoding="utf-8"))
+    return {
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> bool:
+    """基準と比べて遅くなっていないか調べる. 遅くなっていればFalse"""
+    ok = True
+    for scenario, result in current["results"].items():
+        base = baseline["results"].get(scenario)
+        if base is None:
+            continue
+        checks = [
+            ("rows/s", base["rows_per_s"], result["rows_per_s"], True),
+            ("p95[us]", base["latency_us"]["p95"], result["latency_us"]["p95"], False),
+        ]
+        for name, before, after, higher_is_better in checks:
+            change = (after - before) / before
+            regressed = -change > tolerance if higher_is_better else change > tolerance
+            print(
+                f"{scenario:5s} {name:8s} {before:12.1f} -> {after:12.1f} ({change:+.1%})"
+                + ("  REGRESSION" if regressed else "")
+            )
+            ok = ok and not regressed
+    return ok
+
+
+def print_results(results: dict) -> None:
+    print(
+        f"{'scenario':8s} {'rows/s':>10s} {'p50[us]':>9s} {'p95[us]':>9s} {'p99[us]':>9s} "
+        f"{'max[us]':>9s} {'start[ms]':>9s} {'RSS[MB]':>8s}"
+    )
+    for r in results["results"].values():
+        lat = r["latency_us"]
+        print(
+            f"{r['scenario']:8s} {r['rows_per_s']:10.1f} {lat['p50']:9.1f} {lat['p95']:9.1f} "
+            f"{lat['p99']:9.1f} {lat['max']:9.1f} {r.get('startup_ms', -1):9.1f} {r['peak_rss_mb']:8.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SSR measurement pipeline benchmark")
+    parser.add_argument("--rows", type=int, default=2000, help="測定する行数")
+    parser.add_argument("--columns", type=int, default=9, help="1行の列数")
+    parser.add_argument("--rate", type=float, default=0, help="1秒あたりの行数 (0なら全速)")
+    parser.add_argument("--scenario", choices=SCENARIOS, nargs="*", default=list(SCENARIOS))
+    parser.add_argument("--save-baseline", action="store_true", help="結果を基準として保存")
+    parser.add_argument("--compare", action="store_true", help="基準と比較する")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="許容する性能低下の割合")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--run-one", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--output-json", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        result = run_scenario(args.run_one, args.rows, args.columns, args.rate)
+        args.output_json.write_text(json.dumps(result), encoding="utf-8")
+        return
+
+    results = run_all(args.rows, args.columns, args.rate, args.scenario)
+    results["parameters"] = {"rows": args.rows, "columns": args.columns, "rate": args.rate}
+    print_results(results)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"baseline saved: {args.baseline}")
+
+    if args.compare:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline.get("parameters") != results["parameters"]:
+            print("warning: baseline was measured with different parameters")
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
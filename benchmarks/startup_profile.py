@@ -0,0 +1,77 @@
+"""
+起動時のimportにかかる時間を調べる
+
+python -X importtime で MAIN.py(など)をimportしたときのログを集計して,
+時間のかかっているモジュールを表示する
+
+使い方
+------
+python benchmarks/startup_profile.py                      # MAINのimportを調べる
+python benchmarks/startup_profile.py --module measurement_manager --top 30
+python benchmarks/startup_profile.py --max-ms 300         # 300msを超えたら終了コード1
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+SCRIPTS_DIR = BENCHMARK_DIR.parent / "scripts"
+
+# 起動時に読み込まれてはいけない重いモジュール (tests/test_startup.pyでも使う)
+HEAVY_MODULES = ("matplotlib", "scipy", "chardet", "tkinter", "pyperclip", "pandas")
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile(module: str = "MAIN") -> list:
+    """moduleをimportしたときの(モジュール名, 自身の時間[us], 累積時間[us], 深さ)のリストを返す"""
+    env = dict(os.environ, PYTHONPATH=str(SCRIPTS_DIR))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SCRIPTS_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    records = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        records.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return records
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SSR startup import profile")
+    parser.add_argument("--module", default="MAIN", help="importするモジュール")
+    parser.add_argument("--top", type=int, default=20, help="表示するモジュールの数")
+    parser.add_argument("--max-ms", type=float, help="importにかかる時間の上限[ms]")
+    args = parser.parse_args()
+
+    records = profile(args.module)
+    total = next(c for name, _, c, _ in records if name == args.module)
+
+    print(f"{'cumulative[ms]':>14s} {'self[ms]':>9s}  module")
+    for name, self_us, cumulative_us, depth in sorted(
+        records, key=lambda r: r[2], reverse=True
+    )[: args.top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {'  ' * depth}{name}")
+    print(f"total: {total / 1000:.1f} ms")
+
+    names = {name for name, _, _, _ in records}
+    heavy = [m for m in HEAVY_MODULES if m in names]
+    if heavy:
+        print("heavy modules loaded at startup: " + ", ".join(heavy))
+
+    if args.max_ms is not None and (total / 1000 > args.max_ms or heavy):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
-import time
 from functools import cache
 
+from ExternalControl.Discovery.Discovery import InstrumentDiscovery
 from ExternalControl.GPIB.GPIB import GPIBError, get_instrument
 from measurement_manager import (
     dont_make_file,
@@ -20,10 +20,11 @@ def start():
 
 def update():
     print("今からコマンドのテストを始めます...")
-    time.sleep(1)
+    print("つながっている機器を探しています...")
+    for instrument in InstrumentDiscovery.scan(include_serial=False):
+        print(f"{instrument.address} : {instrument.identity}")
     num = input("接続している機器のGPIB番号を入力してください >>")
     print("接続しています...")
-    time.sleep(2)
     try:
         inst = get_instrument(int(num))
     except GPIBError as e:
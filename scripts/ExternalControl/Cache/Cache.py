@@ -0,0 +1,351 @@
+"""
+機器との通信の内容を覚えておいて, 結果の変わらない通信を減らす
+
+WriteStateCacheは設定コマンドごとに最後に送った値を覚えておき, 設定が変わらない書き込みを送らない.
+QueryCacheは変わらないクエリの答え(*IDN?など)を覚えておき, 2回目からは機器に問い合わせない.
+どちらも機器のパネルから設定を変えた場合などは分からないので, そういうときはreset()する
+
+使用例
+------
+LCR = GPIBController()
+LCR.connect(13)
+LCR.enable_write_cache()
+LCR.write("FREQ 1000")  # 送る(True)
+LCR.write("FREQ 1000")  # 設定が変わらないので送らない(False)
+
+LCR.cache_query("VOLT?", QueryRule.until_write("VOLT"))
+LCR.query("VOLT?")  # 機器に問い合わせる
+LCR.query("VOLT?")  # 覚えた答えを返す
+LCR.write("VOLT 2")  # VOLTを書き込んだので次のVOLT?は問い合わせる
+"""
+from __future__ import annotations
+
+import threading
+import time
+from enum import Enum
+from logging import getLogger
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = getLogger(f"SSR.{__name__}")
+
+# 機器の設定を全て変えてしまうSCPIのコマンド
+SCPI_RESET_COMMANDS = ("*RST", "*RCL", "SYST:PRES", "SYSTEM:PRESET")
+
+
+def scpi_setting_key(command: str) -> Optional[str]:
+    """SCPIの設定コマンドのヘッダー(例 "FREQ 1000"なら"FREQ")を返す
+
+    クエリ(?を含むもの)と引数のないコマンド(*CLS, INITなど)は設定ではないのでNone
+    """
+    command = command.strip()
+    if "?" in command:
+        return None
+    header, _, value = command.partition(" ")
+    if value.strip() == "":
+        return None
+    return header.lstrip(":").upper()
+
+
+def split_scpi_message(message: str) -> List[str]:
+    """";"でつないだメッセージをコマンドごとに分ける"""
+    return [command.strip() for command in message.split(";") if command.strip() != ""]
+
+
+def _split_header(header: str) -> Tuple[Tuple[str, str], ...]:
+    """SCPIのヘッダーをノードごとに(名前, 数字の添え字)に分ける ("SOUR:VOLT2"なら(("SOUR", ""), ("VOLT", "2")))"""
+    nodes = []
+    for node in header.strip().strip(":").upper().split(":"):
+        name = node.rstrip("0123456789")
+        if name != "":
+            nodes.append((name, node[len(name) :]))
+    return tuple(nodes)
+
+
+def _nodes_match(a: Tuple[str, str], b: Tuple[str, str]) -> bool:
+    """短い形(VOLT)と長い形(VOLTAGE)を同じノードとみなす. 添え字を省略したノードはどの添え字とも同じとみなす"""
+    (name_a, suffix_a), (name_b, suffix_b) = a, b
+    if not (name_a.startswith(name_b) or name_b.startswith(name_a)):
+        return False
+    return suffix_a == suffix_b or suffix_a == "" or suffix_b == ""
+
+
+def scpi_headers_overlap(a: str, b: str) -> bool:
+    """2つのSCPIのヘッダーが同じ設定(かその下の階層の設定)を指しているかもしれないか
+
+    長い形と短い形(VOLTageとVOLT), 下の階層(VOLT:LEV), 省略できる上の階層をつけたもの(SOUR:VOLT)は
+    同じ設定とみなす. 見分けがつかないときは同じとみなす(覚えた答えを捨てる方に倒す)
+    """
+    nodes_a, nodes_b = _split_header(a), _split_header(b)
+    for x, y in ((nodes_a, nodes_b), (nodes_b, nodes_a)):
+        for start in range(len(x)):
+            if all(_nodes_match(p, q) for p, q in zip(x[start:], y)):
+                return True
+    return False
+
+
+def _is_reset(command: str, reset_commands: Tuple[str, ...]) -> bool:
+    """commandが全ての設定を変えてしまうコマンドか"""
+    header = command.strip().partition(" ")[0].lstrip(":").upper()
+    return header in reset_commands
+
+
+class WriteStateCache:
+    """設定コマンドごとに最後に送ったコマンドを覚えて, 同じコマンドの書き込みを飛ばすクラス
+
+    keyがコマンドから設定の名前を返し(設定でないコマンドはNone),
+    同じ名前の設定に前回と同じコマンドを送ろうとしたときは送らない.
+    設定でないコマンド(測定の開始など)はいつも送る
+
+    Attributes
+    ----------
+    sent: int
+        送ったコマンドの数
+    skipped: int
+        設定が変わらないので送らなかったコマンドの数
+    """
+
+    def __init__(
+        self,
+        key: Callable[[str], Optional[str]] = scpi_setting_key,
+        reset_commands: Iterable[str] = SCPI_RESET_COMMANDS,
+        dependents: Optional[Dict[str, Sequence[str]]] = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        key: Callable[[str], Optional[str]]
+            コマンドから設定の名前を返す関数
+        reset_commands: Iterable[str]
+            送ると全ての設定が変わるコマンドのヘッダー(*RSTなど). 送ったら覚えた値を全て捨てる
+        dependents: Dict[str, Sequence[str]]
+            {設定の名前: その設定を変えると変わってしまう設定の名前}
+        """
+        self.key = key
+        self.reset_commands = tuple(c.upper() for c in reset_commands)
+        self.dependents = dependents or {}
+        self.sent = 0
+        self.skipped = 0
+        self._values: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _apply(self, values: Dict[str, str], command: str) -> bool:
+        """commandを送ったあとの設定をvaluesに反映する. 設定が変わらないコマンドならFalse"""
+        if _is_reset(command, self.reset_commands):
+            values.clear()
+            return True
+        key = self.key(command)
+        if key is None:
+            return True
+        command = command.strip()
+        if values.get(key) == command:
+            return False
+        values[key] = command
+        for dependent in self.dependents.get(key, ()):
+            values.pop(dependent, None)
+        return True
+
+    def filter(self, commands: Sequence[str]) -> List[str]:
+        """commandsのうち送る必要のあるものを返す(順番はそのまま)"""
+        with self._lock:
+            values = dict(self._values)
+            pending = [c for c in commands if self._apply(values, c)]
+            self.skipped += len(commands) - len(pending)
+            return pending
+
+    def record(self, commands: Sequence[str]) -> None:
+        """commandsを送ったことを記録する"""
+        with self._lock:
+            for command in commands:
+                self._apply(self._values, command)
+            self.sent += len(commands)
+
+    def forget(self, commands: Sequence[str]) -> None:
+        """commandsで変わる設定を忘れる(送るのに失敗して機器の状態が分からないとき)"""
+        with self._lock:
+            for command in commands:
+                if _is_reset(command, self.reset_commands):
+                    self._values.clear()
+                    continue
+                key = self.key(command)
+                if key is not None:
+                    self._values.pop(key, None)
+                    for dependent in self.dependents.get(key, ()):
+                        self._values.pop(dependent, None)
+
+    def reset(self) -> None:
+        """覚えた設定を全て捨てる(再接続したときや機器のパネルを操作したとき)"""
+        with self._lock:
+            self._values.clear()
+
+    def write(self, commands: Sequence[str], send: Callable[[List[str]], None]) -> bool:
+        """commandsのうち送る必要のあるものがあればsend(送るコマンドのリスト)で送る
+
+        Returns
+        -------
+        sent: bool
+            送ったらTrue. 全て送る必要がなければFalse
+        """
+        pending = self.filter(commands)
+        if len(pending) == 0:
+            return False
+        try:
+            send(pending)
+        except BaseException:
+            self.forget(pending)
+            raise
+        self.record(pending)
+        return True
+
+
+class CachePolicy(Enum):
+    """クエリの答えをいつまで使い回すか"""
+
+    STATIC = "static"  # 接続している間は変わらない (*IDN?など)
+    UNTIL_WRITE = "until_write"  # 設定を書き込むまで変わらない (VOLT?など)
+    TTL = "ttl"  # 決めた時間だけ使い回す
+
+
+class QueryRule(NamedTuple):
+    """クエリの答えを覚えておくルール
+
+    Attributes
+    ----------
+    policy: CachePolicy
+        いつまで使い回すか
+    ttl: Optional[float]
+        答えを使い回す時間[s]. Noneなら時間では捨てない
+    invalidated_by: Tuple[str, ...]
+        UNTIL_WRITEのとき, この設定を書き込んだら答えを捨てる. 空なら何を書き込んでも捨てる
+        (SCPIのヘッダーの長い形や下の階層を書き込んだときも捨てる. scpi_headers_overlapを参照)
+    """
+
+    policy: CachePolicy
+    ttl: Optional[float] = None
+    invalidated_by: Tuple[str, ...] = ()
+
+    @classmethod
+    def static(cls) -> QueryRule:
+        """接続している間は変わらない答え"""
+        return cls(CachePolicy.STATIC)
+
+    @classmethod
+    def until_write(cls, *settings: str, ttl: Optional[float] = None) -> QueryRule:
+        """settingsの設定(例 "VOLT")を書き込むまで変わらない答え. settingsを省略すると何か書き込むまで"""
+        return cls(CachePolicy.UNTIL_WRITE, ttl, tuple(s.lstrip(":").upper() for s in settings))
+
+    @classmethod
+    def for_seconds(cls, ttl: float) -> QueryRule:
+        """ttl秒の間は使い回す答え"""
+        return cls(CachePolicy.TTL, ttl)
+
+
+class QueryCache:
+    """ルールが決められたクエリの答えを覚えて, 2回目からは機器に問い合わせずに返すクラス
+
+    ルールのないクエリはいつも機器に問い合わせる
+
+    Attributes
+    ----------
+    rules: Dict[str, QueryRule]
+        {クエリ: ルール}
+    hits: int
+        覚えた答えを返した回数
+    misses: int
+        ルールがあるのに機器に問い合わせた回数
+    """
+
+    def __init__(
+        self,
+        rules: Optional[Dict[str, QueryRule]] = None,
+        key: Callable[[str], Optional[str]] = scpi_setting_key,
+        reset_commands: Iterable[str] = SCPI_RESET_COMMANDS,
+        match: Callable[[str, str], bool] = scpi_headers_overlap,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        rules: Dict[str, QueryRule]
+            {クエリ: ルール}
+        key: Callable[[str], Optional[str]]
+            書き込んだコマンドから設定の名前を返す関数 (QueryRule.until_writeの設定と比べる)
+        reset_commands: Iterable[str]
+            送ると全ての設定が変わるコマンドのヘッダー(*RSTなど). 送ったらSTATIC以外の答えを捨てる
+        match: Callable[[str, str], bool]
+            (書き込んだ設定の名前, QueryRule.until_writeの設定)を受け取って, 答えを捨てるならTrueを返す関数
+        """
+        self.key = key
+        self.match = match
+        self.reset_commands = tuple(c.upper() for c in reset_commands)
+        self.rules: Dict[str, QueryRule] = {}
+        self.hits = 0
+        self.misses = 0
+        self._values: Dict[str, Tuple[Any, float]] = {}  # {クエリ: (答え, 問い合わせた時刻)}
+        self._lock = threading.Lock()
+        for command, rule in (rules or {}).items():
+            self.add_rule(command, rule)
+
+    @staticmethod
+    def _normalize(command: str) -> str:
+        return " ".join(command.strip().lstrip(":").split()).upper()
+
+    def add_rule(self, command: str, rule: Optional[QueryRule]) -> None:
+        """commandの答えを覚えるルールを決める. ruleがNoneならルールを消す"""
+        command = self._normalize(command)
+        with self._lock:
+            self._values.pop(command, None)
+            if rule is None:
+                self.rules.pop(command, None)
+            else:
+                self.rules[command] = rule
+
+    def query(self, command: str, fetch: Callable[[], Any]) -> Any:
+        """覚えた答えがあれば返し, なければfetch()で問い合わせて覚える"""
+        command = self._normalize(command)
+        rule = self.rules.get(command)
+        if rule is None:
+            return fetch()
+
+        with self._lock:
+            entry = self._values.get(command)
+            if entry is not None and (rule.ttl is None or time.monotonic() - entry[1] <= rule.ttl):
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        value = fetch()
+        with self._lock:
+            if command in self.rules:
+                self._values[command] = (value, time.monotonic())
+        return value
+
+    def put(self, command: str, value: Any) -> None:
+        """答えが分かっているときに覚えさせる(ルールのないクエリは覚えない)"""
+        command = self._normalize(command)
+        with self._lock:
+            if command in self.rules:
+                self._values[command] = (value, time.monotonic())
+
+    def invalidate(self, commands: Sequence[str]) -> None:
+        """commandsを書き込んだので変わったかもしれない答えを捨てる(クエリは書き込みとして扱わない)"""
+        with self._lock:
+            for command in commands:
+                if "?" in command:
+                    continue
+                if _is_reset(command, self.reset_commands):
+                    for query in list(self._values):
+                        if self.rules[query].policy is not CachePolicy.STATIC:
+                            del self._values[query]
+                    continue
+                setting = self.key(command)
+                for query in list(self._values):
+                    rule = self.rules[query]
+                    if rule.policy is CachePolicy.UNTIL_WRITE and (
+                        len(rule.invalidated_by) == 0
+                        or (setting is not None and any(self.match(setting, s) for s in rule.invalidated_by))
+                    ):
+                        del self._values[query]
+
+    def reset(self) -> None:
+        """覚えた答えを全て捨てる(再接続したときや機器のパネルを操作したとき)"""
+        with self._lock:
+            self._values.clear()
@@ -0,0 +1,345 @@
+"""
+つながっている機器を自動で探して, 機器の名前からアドレスを調べられるようにする
+
+VISAのリソース(GPIB/USB)には*IDN?を, シリアルポートにはLinkamT95のTコマンドとMAX-303のS?コマンドを送って,
+応答した機器の名前とアドレスの対応表を作る. アドレスごとに別のスレッドで同時に問い合わせるので,
+機器の数が増えても探す時間はほとんど変わらない
+
+対応表は共有設定フォルダ(shared_settings)に保存して次回の起動から使い回す.
+保存されたアドレスで接続できなかったときだけ探し直す
+
+使用例
+------
+LCR = GPIBController()
+LCR.connect_by_name("E4980A")  # *IDN?の返答にE4980Aを含む機器に接続する
+
+T95 = LinkamT95ManualController()
+T95.connect_by_name()  # LinkamT95がつながっているCOMポートに接続する
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+import serial.tools.list_ports
+from utility import MyException, get_date_text
+from variables import SHARED_VARIABLES
+
+from ExternalControl.LinkamT95.IO import LinkamT95Error, LinkamT95SerialIO
+from ExternalControl.MAX303.MAX303IO import MAX303Error, MAX303SerialIO
+from ExternalControl.Serial.Serial import SerialTransport
+from ExternalControl.VISA.VISA import VISAResourcePool
+
+logger = getLogger(f"SSR.{__name__}")
+
+CACHE_NAME = "instrument_addresses.json"
+
+
+class DiscoveryError(MyException):
+    """機器の自動検出関係のエラー"""
+
+
+class DiscoveredInstrument(NamedTuple):
+    """見つかった機器
+
+    Attributes
+    ----------
+    identity: str
+        機器の名前 (VISAの機器は*IDN?の返答, シリアル通信の機器は"LinkamT95"か"MAX-303")
+    address: str
+        VISAアドレスかCOMポート
+    interface: str
+        "VISA"か"Serial"
+    """
+
+    identity: str
+    address: str
+    interface: str
+
+
+def _probe_linkam(port: str) -> bool:
+    """portにLinkamT95がつながっているか (Tコマンドに状態が返ってくるか)"""
+    io = LinkamT95SerialIO()
+    try:
+        io.connect(port)
+        return True
+    except LinkamT95Error:
+        return False
+    finally:
+        io.close()
+
+
+def _probe_max303(port: str) -> bool:
+    """portにMAX-303がつながっているか (S?コマンドに応答するか)"""
+    io = MAX303SerialIO()
+    try:
+        io.connect(port)
+        return True
+    except MAX303Error:
+        return False
+    finally:
+        io.close()
+
+
+def list_comports() -> List[str]:
+    """PCにあるシリアルポート(COM1, COM2...)を返す"""
+    return sorted(p.device for p in serial.tools.list_ports.comports())
+
+
+def get_discovery_cache_path() -> Optional[Path]:
+    """対応表を保存するファイル. 共有設定フォルダが決まっていなければNone"""
+    try:
+        return SHARED_VARIABLES.SETTINGDIR / CACHE_NAME
+    except ValueError:
+        return None
+
+
+class InstrumentDiscovery:
+    """機器を探して名前とアドレスの対応表を持つクラス
+
+    インスタンスは作らずにクラスメソッドから使う
+
+    Attributes
+    ----------
+    serial_probes: List[Tuple[str, Callable[[str], bool]]]
+        シリアルポートに送る問い合わせ(機器の名前, 機器がつながっていればTrueを返す関数). 上から順番に試す
+    list_serial_ports: Callable[[], List[str]]
+        探すシリアルポートを返す関数 (シミュレーションのときは差し替える)
+    persistent: bool
+        対応表をファイルに保存するかどうか (シミュレーションのときはFalse)
+    max_workers: int
+        同時に問い合わせるアドレスの数
+    """
+
+    serial_probes: List[Tuple[str, Callable[[str], bool]]] = [
+        ("LinkamT95", _probe_linkam),
+        ("MAX-303", _probe_max303),
+    ]
+    list_serial_ports: Callable[[], List[str]] = staticmethod(list_comports)
+    persistent = True
+    max_workers = 16
+
+    _instruments: Optional[List[DiscoveredInstrument]] = None
+    _lock = threading.RLock()
+
+    @classmethod
+    def scan(cls, include_visa: bool = True, include_serial: bool = True) -> List[DiscoveredInstrument]:
+        """全てのVISAリソースとシリアルポートに同時に問い合わせて対応表を作り直す
+
+        他の接続が使っているシリアルポートには問い合わせず, 前回の対応表の結果をそのまま使う
+
+        Parameters
+        ----------
+        include_visa: bool
+            VISAのリソースを探すかどうか
+        include_serial: bool
+            シリアルポートを探すかどうか
+        """
+        with cls._lock:
+            previous = cls._instruments or []
+            tasks: List[Tuple[Callable, str]] = []
+            kept: List[DiscoveredInstrument] = []
+
+            if include_visa:
+                for address in cls._list_visa_resources():
+                    tasks.append((cls._probe_visa, address))
+            if include_serial:
+                for port in cls.list_serial_ports():
+                    if SerialTransport.get(port) is not None:
+                        kept += [i for i in previous if i.interface == "Serial" and i.address == port]
+                    else:
+                        tasks.append((cls._probe_serial, port))
+
+            instruments = list(kept)
+            if len(tasks) > 0:
+                with ThreadPoolExecutor(
+                    max_workers=min(cls.max_workers, len(tasks)), thread_name_prefix="InstrumentDiscovery"
+                ) as executor:
+                    futures = [executor.submit(probe, address) for probe, address in tasks]
+                    for future in futures:
+                        instrument = future.result()
+                        if instrument is not None:
+                            instruments.append(instrument)
+
+            instruments.sort(key=lambda i: (i.interface, i.address))
+            cls._instruments = instruments
+            for instrument in instruments:
+                logger.info(f"found {instrument.identity} at {instrument.address}")
+            cls.save()
+            return list(instruments)
+
+    @classmethod
+    def _list_visa_resources(cls) -> Tuple[str, ...]:
+        """問い合わせるVISAのリソース
+
+        シリアルポート(ASRL)はシリアル通信の機器として別に探すので除く
+        """
+        try:
+            resources = VISAResourcePool.list_resources()
+        except Exception as e:  # VISAがインストールされていないなど
+            logger.info(f"skip VISA resources: {e}")
+            return ()
+        return tuple(r for r in resources if not r.upper().startswith("ASRL"))
+
+    @staticmethod
+    def _probe_visa(address: str) -> Optional[DiscoveredInstrument]:
+        try:
+            idn = VISAResourcePool.query_idn(address)
+        except Exception:
+            logger.debug(f"{address} does not respond to *IDN?")
+            return None
+        return DiscoveredInstrument(idn.strip(), address, "VISA")
+
+    @classmethod
+    def _probe_serial(cls, port: str) -> Optional[DiscoveredInstrument]:
+        for identity, probe in cls.serial_probes:
+            try:
+                if probe(port):
+                    return DiscoveredInstrument(identity, port, "Serial")
+            except Exception:
+                logger.debug(f"failed to probe {identity} at {port}")
+        return None
+
+    @classmethod
+    def get_instruments(cls) -> List[DiscoveredInstrument]:
+        """対応表を返す. まだなければ保存された対応表を読み込み, それもなければ探す"""
+        with cls._lock:
+            if cls._instruments is None:
+                cls.load()
+            if cls._instruments is None:
+                cls.scan()
+            return list(cls._instruments)
+
+    @classmethod
+    def find(
+        cls, name: str, interface: Optional[str] = None, refresh: bool = False
+    ) -> DiscoveredInstrument:
+        """名前にnameを含む機器を返す(大文字と小文字は区別しない)
+
+        対応表に見つからなければ探し直す
+
+        Parameters
+        ----------
+        name: str
+            機器の名前の一部 (例 "E4980A", "LinkamT95")
+        interface: Optional[str]
+            "VISA"か"Serial". Noneなら両方から探す
+        refresh: bool
+            Trueなら対応表を使わずに探し直す
+        """
+        with cls._lock:
+            scanned = refresh
+            if refresh:
+                cls.scan()
+            elif cls._instruments is None:
+                cls.load()
+                if cls._instruments is None:
+                    cls.scan()
+                    scanned = True
+            matches = cls._match(cls._instruments, name, interface)
+            if len(matches) == 0 and not scanned:
+                matches = cls._match(cls.scan(), name, interface)
+
+        if len(matches) == 0:
+            raise DiscoveryError(f"{name}という名前の機器が見つかりません。機器の電源とケーブルを確認してください")
+        if len(matches) >= 2:
+            raise DiscoveryError(
+                f"{name}という名前の機器が複数見つかりました。アドレスで指定してください\n"
+                + "\n".join(f"{i.address}: {i.identity}" for i in matches)
+            )
+        return matches[0]
+
+    @staticmethod
+    def _match(
+        instruments: List[DiscoveredInstrument], name: str, interface: Optional[str]
+    ) -> List[DiscoveredInstrument]:
+        return [
+            i
+            for i in instruments
+            if name.lower() in i.identity.lower() and (interface is None or i.interface == interface)
+        ]
+
+    @classmethod
+    def connect(
+        cls, name: str, connect: Callable[[str], None], interface: Optional[str] = None
+    ) -> DiscoveredInstrument:
+        """名前にnameを含む機器を探してconnect(アドレス)で接続する
+
+        対応表のアドレスで接続できなかったときや, VISAの機器の*IDN?の返答にnameが含まれないとき
+        (機器をつなぎ替えたときなど)は探し直してもう一度だけ接続する
+
+        Parameters
+        ----------
+        name: str
+            機器の名前の一部
+        connect: Callable[[str], None]
+            アドレスを受け取って接続する関数 (GPIBController.connectなど)
+        interface: Optional[str]
+            "VISA"か"Serial". Noneなら両方から探す
+        """
+        instrument = cls.find(name, interface)
+        try:
+            connect(instrument.address)
+            cls._check_identity(instrument, name)
+        except MyException:
+            logger.info(f"failed to connect {instrument.identity} at {instrument.address}. search again")
+            instrument = cls.find(name, interface, refresh=True)
+            connect(instrument.address)
+            cls._check_identity(instrument, name)
+        return instrument
+
+    @staticmethod
+    def _check_identity(instrument: DiscoveredInstrument, name: str) -> None:
+        """VISAの機器なら接続したアドレスの*IDN?の返答にnameが含まれるか確かめる"""
+        if instrument.interface != "VISA":
+            return
+        try:
+            idn = VISAResourcePool.query_idn(instrument.address)  # 接続したときに問い合わせた返答を使う
+        except Exception as e:
+            raise DiscoveryError(f"{instrument.address}の機器が*IDN?に応答しません") from e
+        if name.lower() not in idn.lower():
+            raise DiscoveryError(f"{instrument.address}につながっている機器は{name}ではありません: {idn.strip()}")
+
+    @classmethod
+    def load(cls) -> None:
+        """保存された対応表を読み込む. 読み込めなければ何もしない"""
+        path = get_discovery_cache_path() if cls.persistent else None
+        if path is None:
+            return
+        try:
+            records = json.loads(path.read_text(encoding="utf-8"))["instruments"]
+            instruments = [DiscoveredInstrument(**record) for record in records]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        with cls._lock:
+            cls._instruments = instruments
+
+    @classmethod
+    def save(cls) -> None:
+        """対応表を共有設定フォルダに保存する"""
+        path = get_discovery_cache_path() if cls.persistent else None
+        if path is None or cls._instruments is None:
+            return
+        text = json.dumps(
+            {"date": get_date_text(), "instruments": [i._asdict() for i in cls._instruments]},
+            indent=1,
+            ensure_ascii=False,
+        )
+        # 他のPCのSSRと同時に書き込んでも壊れないように一時ファイルから置き換える
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            tmp.write_text(text, encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError:
+            logger.warning(f"failed to save {path}")
+
+    @classmethod
+    def clear(cls) -> None:
+        """メモリ上の対応表を捨てる(保存したファイルは消さない)"""
+        with cls._lock:
+            cls._instruments = None
@@ -1,10 +1,16 @@
 """GPIB周りの処理"""
 from logging import getLogger
-from typing import Union
+from typing import Dict, List, Optional, Sequence, Union
 
+import numpy as np
 import pyvisa
 from utility import MyException
 
+from ExternalControl.Cache.Cache import QueryCache, QueryRule, WriteStateCache, split_scpi_message
+from ExternalControl.Discovery.Discovery import InstrumentDiscovery
+from ExternalControl.Trace.Trace import traced
+from ExternalControl.VISA.VISA import VISAResourcePool
+
 logger = getLogger(f"SSR.{__name__}")
 
 
@@ -20,9 +26,29 @@ def get_instrument(address: Union[int, str]) -> pyvisa.resources.Resource:
 
 
 class GPIBController:
-    """GPIB機器に接続するクラス,USBにも接続できる"""
+    """GPIB機器に接続するクラス,USBにも接続できる
+
+    query_cache_rulesに答えを使い回すクエリを書いておくと, 2回目からは機器に問い合わせずに答えを返す.
+    機器ごとのルールはサブクラスで決める
+
+    class E4980A(GPIBController):
+        query_cache_rules = {
+            **GPIBController.query_cache_rules,
+            "VOLT?": QueryRule.until_write("VOLT"),  # VOLTを書き込むまで変わらない
+            "FREQ?": QueryRule.until_write("FREQ"),
+        }
+    """
 
     _instrument = None
+    _trace_address = None  # IOTracerで記録するときのアドレス
+    _write_cache: Optional[WriteStateCache] = None
+    _query_cache: Optional[QueryCache] = None
+
+    # {クエリ: 答えを使い回すルール}
+    query_cache_rules: Dict[str, QueryRule] = {
+        "*IDN?": QueryRule.static(),
+        "*OPT?": QueryRule.static(),
+    }
 
     def connect(self, address: Union[int, str]):
         """指定されたGPIBアドレスに接続(種類は調べない. 何かつながっていればOK)
@@ -45,8 +71,9 @@ class GPIBController:
         elif type(address) is not str:
             raise GPIBError("GPIBController.connectの引数はintかstrでなければなりません")
 
+        # ResourceManagerと開いたリソースはプロセス全体で共有する(2回目以降の接続は速い)
         try:
-            resource_manager = pyvisa.ResourceManager()
+            VISAResourcePool.get_resource_manager()
         except ValueError as e:
             raise GPIBError("VISAがPCにインストールされていない可能性があります。 NIVISAをインストールしてください") from e
         except Exception as e:  # エラーの種類に応じて場合分け
@@ -54,7 +81,7 @@ class GPIBController:
 
         try:
             # 機器にアクセス. GPIBがつながってないとここでエラーが出る
-            inst = resource_manager.open_resource(address)
+            inst = VISAResourcePool.open_resource(address)
         except pyvisa.errors.VisaIOError as e:  # エラーが出たらここを実行
             raise GPIBError("GPIBケーブルが抜けている可能性があります") from e
         except Exception as e:  # エラーの種類に応じて場合分け
@@ -62,7 +89,8 @@ class GPIBController:
 
         try:
             # IDNコマンドで機器と通信. GPIB番号に機器がないとここでエラー
-            inst.query("*IDN?")
+            # 一度応答したアドレスには再送しない
+            idn = VISAResourcePool.query_idn(address)
         except pyvisa.errors.VisaIOError as e:
             raise GPIBError(
                 address + "が'IDN?'コマンドに応答しません. 設定されているGPIBの番号が間違っている可能性があります"
@@ -72,17 +100,91 @@ class GPIBController:
 
         # 問題が無ければinstrumentにいれる
         self._instrument = inst
+        self._trace_address = address
+        if self._write_cache is not None:
+            self._write_cache.reset()  # 別の機器かもしれないので設定は覚え直す
+        self.query_cache.reset()
+        self.query_cache.put("*IDN?", idn)  # 接続するときに問い合わせた答えを使い回す
+
+    def connect_by_name(self, name: str):
+        """*IDN?の返答にnameを含む機器を自動で探して接続
+
+        前回見つけたアドレスを共有設定フォルダに保存しておき, そのアドレスで接続できなければ探し直す
+
+        Parameters
+        ----------
+
+        name: str
+            機器の名前の一部 (例 "E4980A", "MODEL 2000")
+        """
+        InstrumentDiscovery.connect(name, self.connect, interface="VISA")
+
+    def enable_write_cache(self, enabled: bool = True) -> None:
+        """設定コマンド(FREQ 1000など)ごとに最後に送った値を覚えて, 設定が変わらない書き込みを送らないようにする
 
-    def write(self, command):
-        """機器に書き込み"""
+        *RSTを送ったとき, 接続し直したとき, reset_write_cache()を呼んだときは覚えた値を捨てる.
+        機器のパネルから設定を変えたときなどは分からないので, reset_write_cache()を呼んでください
+        """
+        self._write_cache = WriteStateCache() if enabled else None
+
+    def reset_write_cache(self) -> None:
+        """覚えている設定を捨てて, 次の書き込みは必ず送るようにする"""
+        if self._write_cache is not None:
+            self._write_cache.reset()
+
+    def write(self, command) -> bool:
+        """機器に書き込み
+
+        Returns
+        -------
+        sent: bool
+            送ったらTrue. enable_write_cache()していて設定が変わらないので送らなかったときはFalse
+            (Falseなら設定を変えたあとの待ち時間も要らない)
+        """
         if self._instrument is None:
             raise GPIBError("write()を呼ぶより前に機器に接続してください")
+        if self._write_cache is None:
+            self._write_raw(command)
+            return True
+
+        commands = split_scpi_message(command)
+        if any(not c.startswith((":", "*")) for c in commands[1:]):
+            # ";"の後ろのコマンドが直前のコマンドと同じ階層として解釈されるときは設定の名前が決まらないので覚え直す
+            self._write_cache.reset()
+            self._write_raw(command)
+            return True
+        return self._write_cache.write(commands, lambda pending: self._write_raw(self._join_commands(pending)))
+
+    @traced()
+    def _write_raw(self, command: str) -> None:
         self._instrument.write(command)
+        self.query_cache.invalidate(split_scpi_message(command))
+
+    @property
+    def query_cache(self) -> QueryCache:
+        """クエリの答えのキャッシュ (hits, missesで使い回した回数と問い合わせた回数が分かる)"""
+        if self._query_cache is None:
+            self._query_cache = QueryCache(self.query_cache_rules)
+        return self._query_cache
+
+    def cache_query(self, command: str, rule: Optional[QueryRule]) -> None:
+        """このインスタンスだけでcommandの答えを使い回すルールを決める. ruleがNoneなら使い回さない
+
+        Parameters
+        ----------
+        command: str
+            クエリ (例 "VOLT?")
+        rule: QueryRule
+            QueryRule.static(), QueryRule.until_write("VOLT"), QueryRule.for_seconds(10) など
+        """
+        self.query_cache.add_rule(command, rule)
 
     def query(self, command, remove_return=True):
         """
         機器に書き込みして読み取り
 
+        query_cache_rulesやcache_queryでルールを決めたクエリは, 覚えた答えがあれば機器に問い合わせずに返す
+
         Parameters
         -------------
         command: str
@@ -92,8 +194,254 @@ class GPIBController:
         """
         if self._instrument is None:
             raise GPIBError("query()を呼ぶより前に機器に接続してください")
-        return (
-            self._instrument.query(command)
-            if not remove_return
-            else self._instrument.query(command).replace("\n", "")
+        self._forget_written(command)
+        ans = self.query_cache.query(command, lambda: self._query_raw(command))
+        return ans if not remove_return else ans.replace("\n", "")
+
+    @traced()
+    def _query_raw(self, command: str) -> str:
+        return self._instrument.query(command)
+
+    def _forget_written(self, message: str) -> None:
+        """クエリに含まれる書き込み("FREQ 2000;*OPC?"や"*RST;*OPC?"など)で変わる設定とクエリの答えを忘れる"""
+        commands = split_scpi_message(message)
+        if self._write_cache is not None:
+            if any(not c.startswith((":", "*")) for c in commands[1:]):
+                self._write_cache.reset()  # 同じ階層として解釈されるコマンドは設定の名前が決まらない
+            else:
+                self._write_cache.forget(commands)
+        self.query_cache.invalidate(commands)
+
+    @traced()
+    def query_ascii_values(self, command: str, converter="f", separator=",") -> np.ndarray:
+        """機器に書き込みしてテキストで返ってくる複数の値をNumPy配列で読み取る
+
+        Parameters
+        -------------
+        command: str
+            機器に送信するコマンド
+        converter: str
+            値の変換方法 ("f":float, "d":int, "s":文字列 など. pyvisaの書式に従う)
+        separator: str
+            値の区切り文字
+        """
+        if self._instrument is None:
+            raise GPIBError("query_ascii_values()を呼ぶより前に機器に接続してください")
+        self._forget_written(command)
+        return self._instrument.query_ascii_values(
+            command, converter=converter, separator=separator, container=np.array
         )
+
+    @traced()
+    def query_binary_values(
+        self,
+        command: str,
+        datatype="f",
+        is_big_endian=False,
+        header_fmt="ieee",
+        expect_termination=True,
+    ) -> np.ndarray:
+        """機器に書き込みしてバイナリで返ってくる値をNumPy配列で読み取る
+
+        文字列への変換とfloatへの変換を挟まないので, 波形などの大量のデータを速く正確に読み取れる
+        (機器側でFORM REALなどのバイナリ出力の設定をしておく必要がある)
+
+        Parameters
+        -------------
+        command: str
+            機器に送信するコマンド
+        datatype: str
+            1つの値の型 (structモジュールの書式. "f":float32, "d":float64, "h":int16 など)
+        is_big_endian: bool
+            ビッグエンディアンならTrue
+        header_fmt: str
+            データの前につくヘッダーの形式
+            "ieee"ならIEEE488.2の確定長ブロック(#<桁数><バイト数><データ>), ヘッダーがなければ"empty"
+        expect_termination: bool
+            データの後ろに終端文字が付いてくるかどうか
+        """
+        if self._instrument is None:
+            raise GPIBError("query_binary_values()を呼ぶより前に機器に接続してください")
+        self._forget_written(command)
+        return self._instrument.query_binary_values(
+            command,
+            datatype=datatype,
+            is_big_endian=is_big_endian,
+            header_fmt=header_fmt,
+            expect_termination=expect_termination,
+            container=np.array,
+        )
+
+    def write_batch(self, commands: Sequence[str]) -> bool:
+        """複数のコマンドを";"でつないで1回の書き込みで送る
+
+        enable_write_cache()しているときは設定が変わらないコマンドは除いて送る
+
+        Parameters
+        ----------
+        commands: Sequence[str]
+            送信するコマンドのリスト (例 ["FREQ 1000", "VOLT 1"])
+
+        Returns
+        -------
+        sent: bool
+            送ったらTrue. 全てのコマンドを送る必要がなかったときはFalse
+        """
+        if self._instrument is None:
+            raise GPIBError("write_batch()を呼ぶより前に機器に接続してください")
+        message = self._join_commands(commands)
+        if self._write_cache is None:
+            self._write_raw(message)
+            return True
+        return self._write_cache.write(commands, lambda pending: self._write_raw(self._join_commands(pending)))
+
+    def query_batch(self, commands: Sequence[str], remove_return=True) -> List[str]:
+        """複数のコマンドを";"でつないで1回で送信し, 返答をまとめて読み取る
+
+        IEEE488.2では複数のクエリへの返答は";"で区切られて1つのメッセージで返ってくるので,
+        それを分割してクエリごとの返答のリストにする
+        (クエリ以外のコマンドには返答がないので, リストの長さはクエリの数になる)
+        enable_write_cache()しているときは設定が変わらないコマンドは除いて送る
+
+        Parameters
+        ----------
+        commands: Sequence[str]
+            送信するコマンドのリスト (例 ["FREQ 1000", "FETC?"])
+        remove_return : bool
+            帰ってきた文字列から改行記号を抜くかどうか
+
+        Returns
+        -------
+        answers: List[str]
+            クエリごとの返答
+        """
+        if self._instrument is None:
+            raise GPIBError("query_batch()を呼ぶより前に機器に接続してください")
+        message = self._join_commands(commands)
+        self.query_cache.invalidate(commands)
+        if self._write_cache is None:
+            ans = self._query_raw(message)
+        else:
+            # 設定が変わらないコマンドは除いて送る(クエリは設定ではないので必ず送られる)
+            answer = []
+            self._write_cache.write(
+                commands,
+                lambda pending: answer.append(self._query_raw(self._join_commands(pending))),
+            )
+            if len(answer) == 0:  # クエリがなく, 送る必要のあるコマンドもなかった
+                return []
+            ans = answer[0]
+        if remove_return:
+            ans = ans.replace("\n", "")
+        return ans.split(";")
+
+    @staticmethod
+    def _join_commands(commands: Sequence[str]) -> str:
+        """コマンドを1つのメッセージにつなぐ
+
+        SCPIでは";"の後ろのコマンドは直前のコマンドと同じ階層として解釈されるので,
+        共通コマンド(*から始まるもの)以外は先頭に":"をつけてルートから指定し直す
+        """
+        if len(commands) == 0:
+            raise GPIBError("コマンドが1つもありません")
+        message = commands[0]
+        for command in commands[1:]:
+            command = command.strip()
+            if command.startswith("*") or command.startswith(":"):
+                message += ";" + command
+            else:
+                message += ";:" + command
+        return message
+
+
+class PreparedSweep:
+    """設定値を順番に変えながら測定するスイープを準備しておくクラス
+
+    通常は1点ごとに 設定コマンド → (待機コマンド) → 読み取りコマンド を1回の通信で送る.
+    list_commandを指定した場合は機器のリストスイープ機能を使い, 全点を1回の通信で読み取る.
+
+    使用例
+    ------
+    sweep = PreparedSweep(LCR, values=[1000, 2000], set_command="FREQ {}", fetch_command="FETC?")
+    capacitance, tan_delta, _ = sweep.measure(0)
+    """
+
+    def __init__(
+        self,
+        controller: GPIBController,
+        values: Sequence,
+        set_command: str,
+        fetch_command: str,
+        settle_command: Optional[str] = None,
+        list_command: Optional[str] = None,
+        trigger_command: Optional[str] = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        controller: GPIBController
+            接続済みのGPIBController
+        values: Sequence
+            スイープする値のリスト
+        set_command: str
+            値を設定するコマンド. {}の部分に値が入る (例 "FREQ {}")
+        fetch_command: str
+            測定値を読み取るクエリ (例 "FETC?")
+        settle_command: str
+            設定と読み取りの間に送るコマンド (例 "*WAI")
+        list_command: str
+            リストスイープの設定コマンド. {}の部分にコンマ区切りの値が入る (例 "LIST:FREQ {}")
+        trigger_command: str
+            リストスイープを開始するコマンド (例 "TRIG:IMM")
+        """
+        if len(values) == 0:
+            raise GPIBError("PreparedSweepのvaluesには1つ以上の値が必要です")
+        self.controller = controller
+        self.values = list(values)
+        self.set_command = set_command
+        self.fetch_command = fetch_command
+        self.settle_command = settle_command
+        self.list_command = list_command
+        self.trigger_command = trigger_command
+
+    def prepare(self) -> None:
+        """リストスイープを使う場合は機器に値のリストを送っておく"""
+        if self.list_command is not None:
+            self.controller.write(
+                self.list_command.format(",".join(map(str, self.values)))
+            )
+
+    def measure(self, index: int) -> List[str]:
+        """index番目の値に設定して測定値を読み取る(1回の通信)
+
+        Returns
+        -------
+        answer: List[str]
+            コンマで区切った測定値
+        """
+        commands = [self.set_command.format(self.values[index])]
+        if self.settle_command is not None:
+            commands.append(self.settle_command)
+        commands.append(self.fetch_command)
+        return self.controller.query_batch(commands)[-1].split(",")
+
+    def measure_all(self) -> List[List[str]]:
+        """全ての値について測定値を読み取る
+
+        リストスイープを使う場合は1回の通信で全点の測定値を読み取り, 点の数で等分する
+        """
+        if self.list_command is None:
+            return [self.measure(i) for i in range(len(self.values))]
+
+        commands = []
+        if self.trigger_command is not None:
+            commands.append(self.trigger_command)
+        commands.append(self.fetch_command)
+        answer = self.controller.query_batch(commands)[-1].split(",")
+
+        if len(answer) % len(self.values) != 0:
+            raise GPIBError(
+                f"リストスイープの返答の数{len(answer)}が点の数{len(self.values)}で割り切れません"
+            )
+        n = len(answer) // len(self.values)
+        return [answer[i * n : (i + 1) * n] for i in range(len(self.values))]
@@ -5,12 +5,15 @@ LinkamT95をマクロから動かすコントローラー
 from __future__ import annotations
 
 import dataclasses
+import queue
 import threading
 import time
+from enum import Enum
 from logging import getLogger
-from typing import List, Tuple
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
-from ExternalControl.LinkamT95.IO import LinkamT95IO
+from ExternalControl.Discovery.Discovery import InstrumentDiscovery
+from ExternalControl.LinkamT95.IO import LinkamT95IO, LinkamT95StatusSampler
 from measurement_manager import MeasurementManager, MeasurementState
 from utility import MyException
 
@@ -41,6 +44,13 @@ class LinkamT95ManualController:
         """
         self._T95.connect(COMPORT)
 
+    def connect_by_name(self, name: str = "LinkamT95") -> None:
+        """LinkamT95がつながっているシリアルポートを自動で探して接続
+
+        前回見つけたポートを共有設定フォルダに保存しておき, そのポートで接続できなければ探し直す
+        """
+        InstrumentDiscovery.connect(name, self.connect, interface="Serial")
+
     def run_program(self, temperature: int, temp_per_min: int, lnp_speed: int) -> None:
         """温度スイーププログラムを実行
 
@@ -68,7 +78,7 @@ class LinkamT95ManualController:
             has_reached_target_temperature : 目的温度に到達したらTrue
             temperature: 温度(この温度はステージ下部の温度なので測定にそのまま使えるものではない)
         """
-        state, temperature, pump_speed = self._T95.read_status()
+        state, temperature, pump_speed = self._T95.get_status()  # バックグラウンドで読み取っていればすぐに返る
         if (
             (state == LinkamT95IO.State.Cooling)
             or (state == LinkamT95IO.State.Heating)
@@ -91,6 +101,34 @@ class LinkamT95ManualController:
         """
         self._T95.stop()
 
+    def start_sampling(self, interval: float = 0.5) -> LinkamT95StatusSampler:
+        """バックグラウンドで状態を読み取り始める
+
+        get_statusがシリアル通信を待たずにすぐに返るようになる.
+        返り値のsamplerから温度の履歴(history)や温度変化の速さ(get_rate)も取れる
+
+        Parameters
+        ----------
+        interval: float
+            読み取る間隔[s]
+        """
+        return self._T95.start_sampling(interval)
+
+    def stop_sampling(self) -> None:
+        """バックグラウンドでの読み取りを止める"""
+        self._T95.stop_sampling()
+
+    def enable_write_cache(self, enabled: bool = True) -> None:
+        """目的温度・速度・窒素ガス速度が前回と同じときは送らないようにする
+
+        LinkamT95のパネルを操作したときはreset_write_cache()を呼んでください
+        """
+        self._T95.enable_write_cache(enabled)
+
+    def reset_write_cache(self) -> None:
+        """覚えている設定を捨てて, 次の設定は必ず送るようにする"""
+        self._T95.reset_write_cache()
+
 
 # LinkamT95AutoController用の温度シーケンス
 @dataclasses.dataclass
@@ -101,6 +139,35 @@ class Sequence:
     lnp_speed: int
 
 
+class LinkamT95Event(Enum):
+    """LinkamT95AutoControllerが出すイベント"""
+
+    REACHED_TARGET = 1  # 目的温度に到達した
+    HOLD_DONE = 2  # 目的温度で保持時間が経過した
+    SEQUENCE_DONE = 3  # 全ての温度シーケンスが終わった
+
+
+class LinkamT95EventRecord(NamedTuple):
+    """起きたイベントの記録
+
+    Attributes
+    ----------
+    event: LinkamT95Event
+        イベントの種類
+    sequence: Sequence
+        イベントが起きたときに実行していた温度シーケンス
+    temperature: Optional[float]
+        イベントが起きたときの温度
+    timestamp: float
+        イベントが起きた時刻(time.time())
+    """
+
+    event: LinkamT95Event
+    sequence: Sequence
+    temperature: Optional[float]
+    timestamp: float
+
+
 class LinkamT95AutoController:
     """LinkamT95の制御を自動で行うためのクラス
 
@@ -127,11 +194,18 @@ class LinkamT95AutoController:
         def is_completed(self) -> bool:
             return time.time() - self.__time__start >= self.__hold__time * 60
 
+        def remaining(self) -> float:
+            """保持時間が終わるまでの時間[s]"""
+            if self.__time__start is None:
+                return 0.0
+            return max(0.0, self.__time__start + self.__hold__time * 60 - time.time())
+
     class SequenceList:
         """設定シーケンスを保持するリスト"""
 
-        __index = 0
-        __sequence_list: List[Sequence] = []
+        def __init__(self) -> None:
+            self.__index = 0
+            self.__sequence_list: List[Sequence] = []
 
         def add_sequence(self, sequence: Sequence):
             self.__sequence_list.append(sequence)
@@ -149,6 +223,18 @@ class LinkamT95AutoController:
     __sequence_list = SequenceList()
     __now_sequence: Sequence = None
     __timer: Timer = None
+    __last_temperature: Optional[float] = None
+
+    POLL_INTERVAL_MIN = 0.2  # 状態を読む間隔の最小値[s]
+    POLL_INTERVAL_MAX = 3.0  # 状態を読む間隔の最大値[s]
+
+    def __init__(self) -> None:
+        self.__events: queue.Queue = queue.Queue()
+        self.__subscribers: Dict[LinkamT95Event, List[Callable[[LinkamT95EventRecord], None]]] = {
+            event: [] for event in LinkamT95Event
+        }
+        self.__stop_event = threading.Event()
+        self.__sequence_list = self.SequenceList()
 
     def connect(self, COMPORT: str):
         """LinkamT95への接続
@@ -160,6 +246,14 @@ class LinkamT95AutoController:
         """
         self.__controller.connect(COMPORT)
 
+    def connect_by_name(self, name: str = "LinkamT95"):
+        """LinkamT95がつながっているシリアルポートを自動で探して接続"""
+        self.__controller.connect_by_name(name)
+
+    def enable_write_cache(self, enabled: bool = True):
+        """シーケンスの間で変わらない設定(速度や窒素ガス速度)は送らないようにする"""
+        self.__controller.enable_write_cache(enabled)
+
     def add_sequence(self, T: int, hold: int, rate: int, lnp: int):
         """温度シーケンスの追加
 
@@ -185,24 +279,79 @@ class LinkamT95AutoController:
         measurement_state = (
             MeasurementManager.get_measurement_state()
         )  # 測定が強制終了されたときにこっちも終了できるように測定Stateを取得しておく
+        # 中断した後にもう一度始められるように毎回新しいEventを使う(前のスレッドは前のEventで止まる)
+        self.__stop_event = threading.Event()
         measure_thread = threading.Thread(
             target=LinkamT95AutoController._controller_thread,
             args=(
                 self,
                 measurement_state,
+                self.__stop_event,
             ),
         )
         measure_thread.setDaemon(True)  # デーモンスレッド化
         measure_thread.start()
 
     @staticmethod
-    def _controller_thread(autoController: LinkamT95AutoController, measurement_state):
+    def _controller_thread(
+        autoController: LinkamT95AutoController, measurement_state, stop_event: threading.Event
+    ):
         # 別スレッドでLinkamを動かし続ける
-        while True:
-            time.sleep(3)
-            if autoController.__update(measurement_state):  # 測定が終了したときにはFalseが返ってくる
-                autoController.stop()
+        # 目的温度や保持時間の終わりが近づくほど短い間隔で状態を読む
+        while not stop_event.is_set():
+            if not autoController.__update(measurement_state):  # 測定が終了したときにはFalseが返ってくる
+                autoController.__controller.stop()
                 break
+            stop_event.wait(autoController.get_poll_interval())
+
+    def predict_arrival(self) -> Optional[float]:
+        """目的温度に到達するまでの時間[s]を設定した温度変化の速さから予測する. 分からなければNone"""
+        sequence = self.__now_sequence
+        temperature = self.__last_temperature
+        if sequence is None or temperature is None or sequence.temp_per_min <= 0:
+            return None
+        return abs(sequence.temperature - temperature) / sequence.temp_per_min * 60
+
+    def get_poll_interval(self) -> float:
+        """次に状態を読むまでの時間[s]
+
+        目的温度に向かっているときは到達予測時間の半分, 保持しているときは保持時間が終わるまでの時間
+        (POLL_INTERVAL_MIN~POLL_INTERVAL_MAXの範囲)
+        """
+        if self.__timer is not None:
+            wait = self.__timer.remaining()
+        else:
+            arrival = self.predict_arrival()
+            wait = self.POLL_INTERVAL_MAX if arrival is None else arrival / 2
+        return min(max(wait, self.POLL_INTERVAL_MIN), self.POLL_INTERVAL_MAX)
+
+    def subscribe(self, event: LinkamT95Event, callback: Callable[[LinkamT95EventRecord], None]) -> None:
+        """イベントが起きたときに呼ぶ関数を登録する
+
+        callbackはLinkamT95AutoControllerのスレッドで呼ばれるので, 時間のかかる処理はしないこと
+        (update関数で処理したいときはget_eventsを使う)
+        """
+        self.__subscribers[event].append(callback)
+
+    def get_events(self) -> List[LinkamT95EventRecord]:
+        """前に呼んだときから起きたイベントを返す (update関数から呼ぶ用)"""
+        events = []
+        while True:
+            try:
+                events.append(self.__events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def __emit(self, event: LinkamT95Event) -> None:
+        """イベントを記録して登録された関数を呼ぶ"""
+        record = LinkamT95EventRecord(event, self.__now_sequence, self.__last_temperature, time.time())
+        logger.info(f"{event.name}: {self.__now_sequence}")
+        self.__events.put(record)
+        for callback in self.__subscribers[event]:
+            try:
+                callback(record)
+            except Exception:
+                logger.exception(f"{event.name}のイベントで呼んだ関数でエラーが発生しました")
 
     def __update(self, measurement_state: MeasurementState):
         """次の処理を判断する"""
@@ -217,6 +366,7 @@ class LinkamT95AutoController:
         # 二回目以降はこっちが呼ばれる
         if self.__timer is not None:  # self.__timerは目的温度に到達してからホールド時間になるまでを測るタイマー
             if self.__timer.is_completed():  # ホールド時間になったら次の温度シーケンスへ
+                self.__emit(LinkamT95Event.HOLD_DONE)
                 next_sequence = self.__sequence_list.get_next_sequence()
                 if next_sequence is not None:
                     self.__controller.run_program(
@@ -228,15 +378,17 @@ class LinkamT95AutoController:
                     self.__timer = None
                 else:  # 次の温度シーケンスがなければ終了(Falseを返す)
                     logger.info("temperature sequence completed ...")
+                    self.__emit(LinkamT95Event.SEQUENCE_DONE)
                     return False
         else:  # 目的温度に達するまではタイマーがNoneなのでこっちが呼ばれる
             (
                 has_reached_target_temperature,
-                _,
+                self.__last_temperature,
             ) = self.__controller.get_status()  # 今の状態を取得
             if has_reached_target_temperature:  # 目的温度に達したらタイマーを生成する
                 self.__timer = self.Timer()
                 self.__timer.start(self.__now_sequence.hold_time_min)
+                self.__emit(LinkamT95Event.REACHED_TARGET)
 
         if measurement_state.has_finished_measurement():  # 測定が強制終了するような場合にはここが呼ばれる
             logger.info("temperature sequence stopped ...")
@@ -245,6 +397,9 @@ class LinkamT95AutoController:
 
     def cancel_sequence(self):
         """中断"""
+        self.__stop_event.set()
         self.__controller.stop()
+        # 次にstart_sequenceしたときに最初のシーケンスから始める
         self.__sequence_list = self.SequenceList()
-        self.__timer = self.Timer()
+        self.__now_sequence = None
+        self.__timer = None
@@ -2,15 +2,22 @@
 LinkamT95と直接通信するクラスや入力値の検証を行うクラスが入っている
 """
 import math
+import threading
+import time
+from collections import deque
 from enum import Enum
 from logging import getLogger
-from typing import Tuple
+from typing import List, NamedTuple, Optional, Tuple
 
 import serial
 
 # from serial import Serial
 from utility import MyException
 
+from ExternalControl.Cache.Cache import WriteStateCache
+from ExternalControl.Serial.Serial import SerialTransport, SerialTransportError
+from ExternalControl.Trace.Trace import traced
+
 logger = getLogger(f"SSR.{__name__}")
 
 
@@ -18,15 +25,39 @@ class LinkamT95Error(MyException):
     """LinkamT95関係のエラー"""
 
 
+def _linkam_setting_key(command: str) -> Optional[str]:
+    """LinkamT95の設定コマンドの名前 (目的温度L1, 速度R1, 窒素ガスのモードPmode, 窒素ガス速度P)"""
+    if command.startswith(("L1", "R1")):
+        return command[:2]
+    if command in ("Pa0", "Pm0"):
+        return "Pmode"
+    if len(command) == 2 and command.startswith("P"):
+        return "P"
+    return None
+
+
 class LinkamT95SerialIO:
     """LinkamT95と直接通信を担当するクラス
 
+    実際の読み書きはポートごとに1つのSerialTransportが行う.
+    同じポートにconnectしたインスタンスは同じSerialTransportを使うので,
+    マクロとLinkamT95AutoControllerのスレッドから同時に通信しても応答は混ざらない.
+    Tコマンド(状態の読み取り)は同時に送られたものをまとめる
+
     Attributes
     ----------
     ser:
         serialモジュールにあるシリアル通信用のインスタンス
+    serial_class:
+        シリアルポートを開くクラス (シミュレーションのときは差し替える)
     """
 
+    serial_class = serial.Serial
+    TERMINATOR = b"\r"
+
+    _transport: Optional[SerialTransport] = None
+    _write_cache: Optional[WriteStateCache] = None
+
     def connect(self, COMPORT: str) -> None:
         """シリアル接続
 
@@ -36,9 +67,10 @@ class LinkamT95SerialIO:
             シリアルポートのポート番号 (COM1 or COM2 or COM3 or ...)
             デバイスマネージャーやNIMAXから確認できる
         """
-        try:
+
+        def open_serial():
             # シリアルポートに接続(COMPORT以外の設定はマニュアル参照)
-            self.ser = serial.Serial(
+            return self.serial_class(
                 port=COMPORT,
                 baudrate=19200,
                 bytesize=serial.EIGHTBITS,
@@ -46,32 +78,76 @@ class LinkamT95SerialIO:
                 parity=serial.PARITY_NONE,
                 timeout=0.5,
             )
+
+        try:
+            self._transport = SerialTransport.open(
+                COMPORT, open_serial, terminator=self.TERMINATOR, timeout=0.5, coalesce=["T"]
+            )
         except Exception as e:
             raise LinkamT95Error(
                 f"{COMPORT}に繋がりません。\nデバイスマネージャーなどを調べてLinkamの正しいCOMポート番号を'COM(数字)'の形式でLinkamT95ManualContollerに入力してください"
             )
-
-        _ = self.ser.read_all()  # 溜まっているコマンドを掃除
+        self.ser = self._transport.ser
+        self._trace_address = COMPORT
+        self.reset_write_cache()
 
         # Tコマンドを送ってなにか返ってきたらOK
-        ans = self.query("T")
+        try:
+            ans = self.query("T")
+        except LinkamT95Error:
+            ans = b""
         if len(ans) < 10:
             raise LinkamT95Error(
                 f"{COMPORT}にTコマンドを行った結果'{ans}'が返されました。LinkamT95以外の機器である可能性があります"
             )
 
-    def write(self, command: str) -> None:
+    def _get_transport(self) -> SerialTransport:
+        if self._transport is None:
+            raise LinkamT95Error("LinkamT95に接続されていません. 先にconnectしてください")
+        return self._transport
+
+    def enable_write_cache(self, enabled: bool = True) -> None:
+        """目的温度・速度・窒素ガス速度の設定を覚えて, 設定が変わらない書き込みを送らないようにする
+
+        接続し直したときとreset_write_cache()を呼んだときは覚えた値を捨てる.
+        同じポートに別のインスタンスから書き込むときやパネルを操作するときは使わないでください
+        """
+        if enabled:
+            # 窒素ガスのモードを変えると速度も変わるかもしれない
+            self._write_cache = WriteStateCache(_linkam_setting_key, reset_commands=(), dependents={"Pmode": ("P",)})
+        else:
+            self._write_cache = None
+
+    def reset_write_cache(self) -> None:
+        """覚えている設定を捨てて, 次の書き込みは必ず送るようにする"""
+        if self._write_cache is not None:
+            self._write_cache.reset()
+
+    def write(self, command: str) -> bool:
         """シリアル通信で書き込み
 
+        空の応答が返ってくるのは待たない(応答は読み取り用のスレッドが捨てる)
+
         Parameters
         ----------
         command:str
             コマンド
+
+        Returns
+        -------
+        sent: bool
+            送ったらTrue. enable_write_cache()していて設定が変わらないので送らなかったときはFalse
         """
-        command = command + "\r"  # Carriage Returnを追加
-        self.ser.write(command.encode("utf-8"))  # バイト列に変換して送信
-        _ = self.ser.read_until(b"\r")  # 空の応答が返ってくるので捨てる
+        if self._write_cache is None:
+            self._write_raw(command)
+            return True
+        return self._write_cache.write([command], lambda pending: self._write_raw(pending[0]))
+
+    @traced()
+    def _write_raw(self, command: str) -> None:
+        self._get_transport().write(command, frames=1)
 
+    @traced()
     def query(self, command: str) -> bytes:
         """シリアル通信で書き込み&読み取り
 
@@ -83,11 +159,189 @@ class LinkamT95SerialIO:
         Returns
         -------
         ans : bytes
-            機器からの返答をバイト列で返す
+            機器からの返答をバイト列で返す(最後尾に\rを含む)
+        """
+        try:
+            # 空の応答の後に返答が返ってくる
+            _, ans = self._get_transport().query(command, frames=2)
+        except SerialTransportError as e:
+            raise LinkamT95Error(e.message) from e
+        return ans + self.TERMINATOR
+
+    def close(self) -> None:
+        """シリアルポートを閉じる(同じポートを使っている他のインスタンスも使えなくなる)"""
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        self.reset_write_cache()
+
+
+class LinkamT95Status(NamedTuple):
+    """LinkamT95の状態
+
+    Attributes
+    ----------
+    state: LinkamT95IO.State
+        実行状態
+    temperature: float
+        温度[℃]
+    pump_speed: int
+        窒素ガス速度(0~100)
+    timestamp: float
+        読み取った時刻(time.time())
+    """
+
+    state: "LinkamT95IO.State"
+    temperature: float
+    pump_speed: int
+    timestamp: float
+
+
+class LinkamT95StatusSampler:
+    """バックグラウンドのスレッドで一定間隔でLinkamT95の状態を読み取っておく
+
+    最新の状態(latest)はスレッドが丸ごと置き換えるだけなので, 読む側はロックなしですぐに取り出せる
+    読み取った状態は履歴(リングバッファー)にも残るので, 温度変化の速さの見積もりや
+    測定データの時刻の温度を調べるのに使える
+
+    Attributes
+    ----------
+    interval: float
+        読み取る間隔[s]
+    latest: Optional[LinkamT95Status]
+        最新の状態. まだ読み取っていなければNone
+    """
+
+    def __init__(self, io: "LinkamT95IO", interval: float = 0.5, history_size: int = 7200) -> None:
+        """
+        Parameters
+        ----------
+        io: LinkamT95IO
+            状態を読み取る機器
+        interval: float
+            読み取る間隔[s]
+        history_size: int
+            履歴に残す数 (0.5秒間隔なら7200で1時間分)
+        """
+        if interval <= 0:
+            raise LinkamT95Error("状態を読み取る間隔は0より大きくしてください")
+        self.io = io
+        self.interval = interval
+        self.latest: Optional[LinkamT95Status] = None
+        self._history: deque = deque(maxlen=history_size)
+        self._invalidated_at = time.monotonic()
+        self._stop = threading.Event()
+        self._updated = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """読み取りを始める"""
+        if self.is_running():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="LinkamT95StatusSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """読み取りを止める"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self) -> None:
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:  # 一時的な通信エラーでは止めない
+                logger.warning(f"LinkamT95の状態を読み取れませんでした: {e}")
+            next_time += self.interval
+            delay = next_time - time.monotonic()
+            if delay < 0:  # 通信が間隔より遅いときは詰めて読まない
+                next_time = time.monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+    def sample(self) -> LinkamT95Status:
+        """今の状態を読み取って最新の状態と履歴を更新する"""
+        started = time.monotonic()
+        state, temperature, pump_speed = self.io.read_status()
+        status = LinkamT95Status(state, temperature, pump_speed, time.time())
+        self._history.append(status)
+        with self._updated:
+            if started > self._invalidated_at:  # 設定を書き込む前に読み始めた状態は最新にしない
+                self.latest = status
+            self._updated.notify_all()
+        return status
+
+    def invalidate(self) -> None:
+        """設定を書き込んだので, それまでに読み取った状態を最新の状態として使わないようにする"""
+        with self._updated:
+            self._invalidated_at = time.monotonic()
+            self.latest = None
+
+    def wait_next(self, timeout: Optional[float] = None) -> Optional[LinkamT95Status]:
+        """次に状態を読み取るまで待つ. タイムアウトしたらNone"""
+        with self._updated:
+            latest = self.latest
+            self._updated.wait_for(lambda: self.latest not in (latest, None), timeout)
+            return None if self.latest in (latest, None) else self.latest
+
+    def history(self, seconds: Optional[float] = None) -> List[LinkamT95Status]:
+        """履歴を古い順に返す
+
+        Parameters
+        ----------
+        seconds: Optional[float]
+            最新からさかのぼる時間[s]. Noneなら全て
+        """
+        history = list(self._history)
+        if seconds is None or len(history) == 0:
+            return history
+        since = history[-1].timestamp - seconds
+        return [s for s in history if s.timestamp >= since]
+
+    def get_rate(self, seconds: float = 60.0) -> Optional[float]:
+        """最近seconds秒の温度変化の速さ[℃/min]を最小二乗法で見積もる. 2点以上なければNone"""
+        history = self.history(seconds)
+        if len(history) < 2:
+            return None
+        t0 = history[0].timestamp
+        ts = [s.timestamp - t0 for s in history]
+        temps = [s.temperature for s in history]
+        t_mean = sum(ts) / len(ts)
+        temp_mean = sum(temps) / len(temps)
+        var = sum((t - t_mean) ** 2 for t in ts)
+        if var == 0:
+            return None
+        cov = sum((t - t_mean) * (temp - temp_mean) for t, temp in zip(ts, temps))
+        return cov / var * 60
+
+    def temperature_at(self, timestamp: float) -> Optional[float]:
+        """時刻timestamp(time.time())の温度を履歴から線形補間で求める. 履歴の範囲外ならNone
+
+        測定データに時刻を記録しておけば, 後から各データのときのステージの温度が分かる
         """
-        self.write(command)
-        ans = self.ser.read_until(b"\r")  # \rを最後尾に含む応答が返ってくるまで待つ
-        return ans
+        history = list(self._history)
+        if len(history) == 0 or not history[0].timestamp <= timestamp <= history[-1].timestamp:
+            return None
+        # 履歴は時刻順に並んでいるので二分探索
+        lo, hi = 0, len(history) - 1
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if history[mid].timestamp <= timestamp:
+                lo = mid
+            else:
+                hi = mid
+        a, b = history[lo], history[hi]
+        if b.timestamp == a.timestamp:
+            return a.temperature
+        ratio = (timestamp - a.timestamp) / (b.timestamp - a.timestamp)
+        return a.temperature + ratio * (b.temperature - a.temperature)
 
 
 class LinkamT95IO:
@@ -122,6 +376,61 @@ class LinkamT95IO:
         """
         self.T95serial.connect(COMPORT)
 
+    def enable_write_cache(self, enabled: bool = True) -> None:
+        """目的温度・速度・窒素ガス速度が前回と同じときは送らないようにする (LinkamT95SerialIO.enable_write_cache)"""
+        self.T95serial.enable_write_cache(enabled)
+
+    def reset_write_cache(self) -> None:
+        """覚えている設定を捨てて, 次の設定は必ず送るようにする"""
+        self.T95serial.reset_write_cache()
+
+    sampler: Optional[LinkamT95StatusSampler] = None
+
+    def start_sampling(self, interval: float = 0.5, history_size: int = 7200) -> LinkamT95StatusSampler:
+        """バックグラウンドで状態を読み取り始める. 以降のget_statusはすぐに返る
+
+        Parameters
+        ----------
+        interval: float
+            読み取る間隔[s]
+        history_size: int
+            履歴に残す数
+        """
+        self.stop_sampling()
+        self.sampler = LinkamT95StatusSampler(self, interval, history_size)
+        self.sampler.start()
+        return self.sampler
+
+    def stop_sampling(self) -> None:
+        """バックグラウンドでの読み取りを止める"""
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+
+    def get_status(self, max_age: Optional[float] = None) -> Tuple[State, float, int]:
+        """状態を返す. バックグラウンドで読み取っていれば最新の状態をすぐに返す
+
+        Parameters
+        ----------
+        max_age: Optional[float]
+            最新の状態がこれ[s]より古ければ読み取り直す. Noneなら読み取る間隔の3倍
+        """
+        sampler = self.sampler
+        if sampler is not None and sampler.is_running():
+            latest = sampler.latest
+            if max_age is None:
+                max_age = 3 * sampler.interval
+            if latest is not None and time.time() - latest.timestamp <= max_age:
+                return latest.state, latest.temperature, latest.pump_speed
+        return self.read_status()
+
+    def _write(self, command: str) -> None:
+        """コマンドを送り, バックグラウンドで読み取った書き込み前の状態をget_statusで返さないようにする"""
+        self.T95serial.write(command)
+        sampler = self.sampler
+        if sampler is not None:
+            sampler.invalidate()
+
     def set_limit_temperature(self, T: int) -> None:
         """目的温度設定
 
@@ -132,7 +441,7 @@ class LinkamT95IO:
         """
         T = int(T)
         if T >= -196 and T <= 600:
-            self.T95serial.write(f"L1{T}0")
+            self._write(f"L1{T}0")
         else:
             raise LinkamT95Error("設定温度は-196~600℃にしてください")
 
@@ -146,7 +455,7 @@ class LinkamT95IO:
         """
         temp_per_min = int(temp_per_min)
         if temp_per_min >= 0 and temp_per_min <= 150:
-            self.T95serial.write(f"R1{temp_per_min}00")
+            self._write(f"R1{temp_per_min}00")
         else:
             raise LinkamT95Error("昇温・降温速度は0~150℃にしてください")
 
@@ -162,36 +471,36 @@ class LinkamT95IO:
         """
         lnp_speed = int(lnp_speed)
         if lnp_speed < 0:
-            self.T95serial.write("Pa0")
+            self._write("Pa0")
         elif lnp_speed <= 100:
-            self.T95serial.write("Pm0")
+            self._write("Pm0")
             # T95のLNP入力が0～30 の31段階になっていて、
             # 入力するには{"0"の文字コード+LNP入力}の文字コードを入力する必要がある(0,1,2,...,9,A,B,...M,N)
             lnp_speed = math.ceil((lnp_speed / 100.0 * 30))
             lnp_char = chr(lnp_speed + ord("0"))  # 数字を文字コードとして文字へ変換
-            self.T95serial.write(f"P{lnp_char}")
+            self._write(f"P{lnp_char}")
         else:
             raise LinkamT95Error("lnp_speedにわたす値は100以下である必要があります")
 
     def start(self) -> None:
         """温度変化スタート"""
-        self.T95serial.write("S")
+        self._write("S")
 
     def stop(self) -> None:
         """停止"""
-        self.T95serial.write("E")
+        self._write("E")
 
     def heat(self) -> None:
         """昇温"""
-        self.T95serial.write("H")
+        self._write("H")
 
     def cool(self) -> None:
         """降温"""
-        self.T95serial.write("C")
+        self._write("C")
 
     def hold(self) -> None:
         """温度キープ"""
-        self.T95serial.write("H")
+        self._write("H")
 
     def read_status(self) -> Tuple[State, float, int]:
         """LinkamT95に信号を送信し、返り値として測定状態の情報を受け取る
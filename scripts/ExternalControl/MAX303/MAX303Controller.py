@@ -5,6 +5,7 @@ from typing import Tuple
 
 from utility import MyException
 
+from ExternalControl.Discovery.Discovery import InstrumentDiscovery
 from ExternalControl.MAX303.MAX303IO import MAX303SerialIO
 
 
@@ -15,6 +16,14 @@ class MAX303Controller:
     def connect(self, comport: str):
         self.io.connect(COMPORT=comport)
 
+    def connect_by_name(self, name: str = "MAX-303"):
+        """MAX-303がつながっているシリアルポートを自動で探して接続"""
+        InstrumentDiscovery.connect(name, self.connect, interface="Serial")
+
+    def enable_write_cache(self, enabled: bool = True):
+        """シャッターとランプが既にその状態のときはコマンドを送らないようにする"""
+        self.io.enable_write_cache(enabled)
+
     def lamp_on(self):
         self.io.write("PW1")
 
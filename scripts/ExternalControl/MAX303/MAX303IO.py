@@ -4,11 +4,15 @@ MAX-303と直接通信するクラスや入力値の検証を行うクラスが
 import math
 from enum import Enum
 from logging import getLogger
-from typing import Tuple
+from typing import Optional, Tuple
 
 import serial
 from utility import MyException
 
+from ExternalControl.Cache.Cache import WriteStateCache
+from ExternalControl.Serial.Serial import SerialTransport, SerialTransportError
+from ExternalControl.Trace.Trace import traced
+
 logger = getLogger(f"SSR.{__name__}")
 
 
@@ -16,15 +20,34 @@ class MAX303Error(MyException):
     """MAX-303関係のエラー"""
 
 
+def _max303_setting_key(command: str) -> Optional[str]:
+    """MAX-303の設定コマンドの名前 (シャッターS, ランプPW)"""
+    if command in ("S0", "S1"):
+        return "S"
+    if command in ("PW0", "PW1"):
+        return "PW"
+    return None
+
+
 class MAX303SerialIO:
     """MAX-303と直接通信を担当するクラス
 
+    実際の読み書きはポートごとに1つのSerialTransportが行う
+
     Attributes
     ----------
     serial:
         serialモジュールにあるシリアル通信用のインスタンス
+    serial_class:
+        シリアルポートを開くクラス (シミュレーションのときは差し替える)
     """
 
+    serial_class = serial.Serial
+    TERMINATOR = b"\r\n"  # "\r"がCarriage Return, "\n"がLine Feed
+
+    _transport: Optional[SerialTransport] = None
+    _write_cache: Optional[WriteStateCache] = None
+
     def connect(self, COMPORT: str) -> None:
         """シリアル接続
 
@@ -34,20 +57,25 @@ class MAX303SerialIO:
             シリアルポートのポート番号 (COM1 or COM2 or COM3 or ...)
             デバイスマネージャーやNIMAXから確認できる
         """
-        try:
+
+        def open_serial():
             # シリアルポートに接続(COMPORT以外の設定はマニュアル参照)
-            self.ser = serial.Serial(
+            return self.serial_class(
                 port=COMPORT,
                 baudrate=9600,
                 parity=serial.PARITY_NONE,
                 timeout=0.5,
             )
+
+        try:
+            self._transport = SerialTransport.open(COMPORT, open_serial, terminator=self.TERMINATOR, timeout=0.5)
         except Exception as e:
             raise MAX303Error(
                 f"{COMPORT}に繋がりません。\nデバイスマネージャーなどを調べてMAX-303の正しいCOMポート番号を'COM(数字)'の形式でMAX-303ManualContollerに入力してください"
             )
-
-        _ = self.ser.read_all()  # 溜まっているコマンドを掃除
+        self.ser = self._transport.ser
+        self._trace_address = COMPORT
+        self.reset_write_cache()
 
         # Sコマンドを送ってなにか返ってきたらOK
         try:
@@ -55,18 +83,48 @@ class MAX303SerialIO:
         except Exception as e:
             raise MAX303Error(f"{COMPORT}にSコマンドを送ろうとして失敗しました。MAX-303以外の機器である可能性があります")
 
-    def write(self, command: str) -> None:
+    def _get_transport(self) -> SerialTransport:
+        if self._transport is None:
+            raise MAX303Error("MAX-303に接続されていません. 先にconnectしてください")
+        return self._transport
+
+    def enable_write_cache(self, enabled: bool = True) -> None:
+        """シャッターとランプの状態を覚えて, 状態が変わらない書き込みを送らないようにする
+
+        接続し直したときとreset_write_cache()を呼んだときは覚えた値を捨てる
+        """
+        self._write_cache = WriteStateCache(_max303_setting_key, reset_commands=()) if enabled else None
+
+    def reset_write_cache(self) -> None:
+        """覚えている状態を捨てて, 次の書き込みは必ず送るようにする"""
+        if self._write_cache is not None:
+            self._write_cache.reset()
+
+    def write(self, command: str) -> bool:
         """シリアル通信で書き込み
 
+        空の応答が返ってくるのは待たない(応答は読み取り用のスレッドが捨てる)
+
         Parameters
         ----------
         command:str
             コマンド
+
+        Returns
+        -------
+        sent: bool
+            送ったらTrue. enable_write_cache()していて状態が変わらないので送らなかったときはFalse
         """
-        command = command + "\r\n"  # "\r"がCarriage Return, "\n"がLine Feedを追加
-        self.ser.write(command.encode("utf-8"))  # バイト列に変換して送信
-        _ = self.ser.read_until(b"\r\n")  # 空の応答が返ってくるので捨てる
+        if self._write_cache is None:
+            self._write_raw(command)
+            return True
+        return self._write_cache.write([command], lambda pending: self._write_raw(pending[0]))
 
+    @traced()
+    def _write_raw(self, command: str) -> None:
+        self._get_transport().write(command, frames=1)
+
+    @traced()
     def query(self, command: str) -> bytes:
         """シリアル通信で書き込み&読み取り
 
@@ -78,11 +136,17 @@ class MAX303SerialIO:
         Returns
         -------
         ans : bytes
-            機器からの返答をバイト列で返す
+            機器からの返答をバイト列で返す(最後尾に\r\nを含む)
         """
-        self.write(command)
-        ans = self.ser.read_until(b"\r\n")  # \r\nを最後尾に含む応答が返ってくるまで待つ
-        return ans
+        try:
+            # 空の応答の後に返答が返ってくる
+            _, ans = self._get_transport().query(command, frames=2)
+        except SerialTransportError as e:
+            raise MAX303Error(e.message) from e
+        return ans + self.TERMINATOR
 
     def close(self):
-        self.ser.close()
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        self.reset_write_cache()
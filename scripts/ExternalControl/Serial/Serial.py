@@ -1,4 +1,335 @@
 """
-シリアル通信のやり方はLInkamT95/IO.pyに書いてあるので各々の機器ごとにControllerを作るのがよさそう
-(一般化しにくいため)
+シリアル通信の機器に共通する通信の処理
+
+コマンドも応答も終端文字(\rなど)で区切られる機器を想定している.
+機器ごとの違い(終端文字, コマンドに対して返ってくる応答の数など)は各機器のIOクラス
+(LinkamT95/IO.py, MAX303/MAX303IO.pyなど)で指定する
+
+使用例
+------
+transport = SerialTransport.open("COM3", lambda: serial.Serial(port="COM3", baudrate=19200), terminator=b"\r")
+transport.write("S")                      # 応答(空の応答)を待たずに返る
+answers = transport.query("T", frames=2)  # 空の応答と返答の2つを待つ
 """
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from logging import getLogger
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from utility import MyException
+
+logger = getLogger(f"SSR.{__name__}")
+
+
+class SerialTransportError(MyException):
+    """シリアル通信関係のエラー"""
+
+
+class SerialTimeoutError(SerialTransportError, TimeoutError):
+    """応答が時間内に返ってこなかった"""
+
+
+class _Request:
+    """送ったコマンドと, それに対する応答"""
+
+    __slots__ = ("command", "frames", "timeout", "future", "deadline", "answers", "expired")
+
+    def __init__(self, command: str, frames: int, timeout: float) -> None:
+        self.command = command
+        self.frames = frames  # 待つ応答の数
+        self.timeout = timeout
+        self.future: Future = Future()
+        self.deadline: Optional[float] = None  # 応答待ちの先頭になったときに決まる
+        self.answers: List[bytes] = []
+        self.expired = False  # タイムアウトした後, 遅れて届く応答を捨てるために先頭に残っている
+
+
+class SerialTransport:
+    """1つのシリアルポートでの通信を担当する
+
+    コマンドはすぐに送って応答待ちの列(FIFO)に入れ, 読み取り用のスレッドが受け取った応答を
+    終端文字で区切って列の先頭から順番に割り当てる. 前のコマンドの応答を待たずに次のコマンドを送れる.
+    応答待ちの先頭になってからtimeout秒以内に応答がそろわなければSerialTimeoutErrorになる.
+    タイムアウトしたコマンドはもう1度timeout秒だけ先頭に残して遅れて届いた応答を捨て, その間は次のコマンドを送らない.
+    それでも応答が来なければ, 次のコマンドを送る前に受信済みの入力を捨てて応答の対応を取り直す
+
+    ポートごとに1つだけ作り(openを使う), 複数のスレッドから同時に使ってよい
+
+    Attributes
+    ----------
+    port: str
+        ポート番号
+    terminator: bytes
+        終端文字
+    timeout: float
+        応答を待つ時間[s]の既定値
+    """
+
+    READ_INTERVAL = 0.05  # 読み取り用のスレッドがタイムアウトを確かめる間隔[s]
+
+    _transports: Dict[str, SerialTransport] = {}
+    _transports_lock = threading.Lock()
+
+    def __init__(
+        self,
+        ser: Any,
+        port: str,
+        terminator: bytes = b"\r",
+        timeout: float = 0.5,
+        max_outstanding: int = 8,
+        coalesce: Iterable[str] = (),
+        coalesce_window: float = 0.05,
+        encoding: str = "utf-8",
+    ) -> None:
+        """
+        Parameters
+        ----------
+        ser:
+            開いたシリアルポート(serial.Serialなど)
+        max_outstanding: int
+            応答を待っているコマンドの数の上限. これを超えると送る前に待つ
+        coalesce: Iterable[str]
+            まとめてよいコマンド(状態の読み取りなど).
+            同じコマンドが応答待ちかcoalesce_window[s]以内に送られていれば, 送らずにその応答を使う.
+            他のコマンドを送ったら使わない
+        """
+        self.ser = ser
+        self.port = port
+        self.terminator = terminator
+        self.timeout = timeout
+        self.max_outstanding = max_outstanding
+        self.coalesce = frozenset(coalesce)
+        self.coalesce_window = coalesce_window
+        self.encoding = encoding
+        self.is_open = True
+
+        self._pending: deque = deque()
+        self._condition = threading.Condition()  # _pendingと_coalescedを守る
+        self._coalesced: Dict[str, tuple] = {}  # {コマンド: (Future, 送った時刻)}
+        self._resync = False  # 次のコマンドを送る前に入力を捨てるかどうか
+        self._discard_requested = False  # 読み取り用のスレッドに入力を捨ててもらうのを待っている
+        self.ser.timeout = self.READ_INTERVAL
+        self._thread = threading.Thread(target=self._read_thread, name=f"SerialTransport({port})", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def open(cls, port: str, open_serial: Callable[[], Any], **kwargs) -> SerialTransport:
+        """portのSerialTransportを返す. まだなければopen_serialでポートを開いて作る
+
+        Parameters
+        ----------
+        port: str
+            ポート番号
+        open_serial: Callable[[], Any]
+            ポートを開く関数
+        kwargs:
+            SerialTransportの引数
+        """
+        with cls._transports_lock:
+            transport = cls._transports.get(port)
+            if transport is not None and transport.is_alive():
+                terminator = kwargs.get("terminator", b"\r")
+                if transport.terminator != terminator:
+                    raise SerialTransportError(f"{port}は別の種類の機器として既に開かれています")
+                return transport
+            ser = open_serial()
+            _ = ser.read_all()  # 溜まっているコマンドを掃除
+            transport = cls(ser, port, **kwargs)
+            cls._transports[port] = transport
+            return transport
+
+    @classmethod
+    def close_all(cls) -> None:
+        """全てのポートを閉じる"""
+        with cls._transports_lock:
+            transports = list(cls._transports.values())
+        for transport in transports:
+            transport.close()
+
+    @classmethod
+    def get(cls, port: str) -> Optional[SerialTransport]:
+        """portで動いているSerialTransportを返す. なければNone"""
+        with cls._transports_lock:
+            transport = cls._transports.get(port)
+        if transport is not None and transport.is_alive():
+            return transport
+        return None
+
+    def is_alive(self) -> bool:
+        return self.is_open and self._thread.is_alive()
+
+    def request(self, command: str, frames: int = 1, timeout: Optional[float] = None) -> Future:
+        """コマンドを送る. 応答(終端文字を除いたバイト列)frames個のリストがFutureに入る
+
+        Parameters
+        ----------
+        command: str
+            コマンド(終端文字はつけない)
+        frames: int
+            待つ応答の数
+        timeout: Optional[float]
+            応答を待つ時間[s]. Noneならself.timeout
+        """
+        if not self.is_alive():
+            raise SerialTransportError(f"{self.port}は閉じられています")
+        request = _Request(command, frames, self.timeout if timeout is None else timeout)
+        with self._condition:
+            if command in self.coalesce:
+                coalesced = self._coalesced.get(command)
+                if coalesced is not None:
+                    future, sent = coalesced
+                    if not future.done() or time.monotonic() - sent < self.coalesce_window:
+                        return future
+                self._coalesced[command] = (request.future, time.monotonic())
+            else:
+                self._coalesced.clear()  # 他のコマンドの後の応答は新しく読む
+
+            while self.is_open and (
+                len(self._pending) >= self.max_outstanding or (len(self._pending) > 0 and self._pending[0].expired)
+            ):
+                self._condition.wait()
+            if self._resync and len(self._pending) == 0:
+                # 読み取り中のバイト列と混ざらないように, 読み取り用のスレッドに捨ててもらう
+                self._discard_requested = True
+                while self._discard_requested and self.is_open:
+                    self._condition.wait()
+            self._pending.append(request)
+            if len(self._pending) == 1:
+                request.deadline = time.monotonic() + request.timeout
+            try:
+                self.ser.write(command.encode(self.encoding) + self.terminator)
+            except Exception as e:
+                self._pending.remove(request)
+                self._start_next()
+                request.future.set_exception(SerialTransportError(f"{self.port}に{command}を送れませんでした: {e}"))
+        return request.future
+
+    def write(self, command: str, frames: int = 1, wait: bool = False, timeout: Optional[float] = None) -> None:
+        """応答を待たずにコマンドを送る. 応答は読み取り用のスレッドが捨てる
+
+        Parameters
+        ----------
+        wait: bool
+            Trueなら応答が返ってくるまで待つ
+        """
+        future = self.request(command, frames, timeout)
+        if wait:
+            future.result()
+        else:
+            future.add_done_callback(self._log_error)
+
+    def query(self, command: str, frames: int = 1, timeout: Optional[float] = None) -> List[bytes]:
+        """コマンドを送って応答frames個を待つ"""
+        return self.request(command, frames, timeout).result()
+
+    def _log_error(self, future: Future) -> None:
+        """応答を待たないコマンドのエラーをログに出す"""
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is not None:
+            logger.warning(f"{self.port}: {e.message if isinstance(e, MyException) else e}")
+
+    def _start_next(self) -> None:
+        """次のコマンドを応答待ちの先頭にする(_conditionを持って呼ぶ)"""
+        if len(self._pending) > 0 and self._pending[0].deadline is None:
+            self._pending[0].deadline = time.monotonic() + self._pending[0].timeout
+        self._condition.notify_all()
+
+    def _discard_input(self, buffer: bytearray) -> None:
+        """受信済みの入力を捨てる(読み取り用のスレッドで_conditionを持って呼ぶ)"""
+        try:
+            if hasattr(self.ser, "reset_input_buffer"):
+                self.ser.reset_input_buffer()
+            else:
+                self.ser.read_all()
+        except Exception as e:
+            logger.debug(f"{self.port}: failed to discard input: {e}")
+        buffer.clear()
+        self._resync = False
+        self._discard_requested = False
+        self._condition.notify_all()
+
+    def _read_thread(self) -> None:
+        """受け取ったバイト列を終端文字で区切って応答待ちのコマンドに割り当てる"""
+        buffer = bytearray()
+        while self.is_open:
+            if self._discard_requested:
+                with self._condition:
+                    self._discard_input(buffer)
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except Exception as e:
+                if self.is_open:
+                    logger.error(f"{self.port}から読み取れませんでした: {e}")
+                    self._fail_all(SerialTransportError(f"{self.port}から読み取れませんでした: {e}"))
+                    self.is_open = False
+                break
+            buffer += data
+            completed = []
+            with self._condition:
+                while True:
+                    index = buffer.find(self.terminator)
+                    if index < 0:
+                        break
+                    frame = bytes(buffer[:index])
+                    del buffer[: index + len(self.terminator)]
+                    if len(self._pending) == 0:
+                        logger.debug(f"{self.port}: unexpected response {frame!r}")
+                        continue
+                    request = self._pending[0]
+                    request.answers.append(frame)
+                    if len(request.answers) >= request.frames:
+                        self._pending.popleft()
+                        self._start_next()
+                        if request.expired:
+                            logger.debug(f"{self.port}: discard late response to {request.command}")
+                        else:
+                            completed.append((request, request.answers, None))
+
+                now = time.monotonic()
+                while len(self._pending) > 0 and self._pending[0].deadline < now:
+                    request = self._pending[0]
+                    if request.expired:  # 遅れた応答も来なかったので入力を捨ててから次を送る
+                        self._pending.popleft()
+                        self._resync = True
+                        self._start_next()
+                        continue
+                    # 遅れて届く応答を次のコマンドの応答と取り違えないように, もう1度timeout秒だけ先頭に残す
+                    request.expired = True
+                    request.deadline = now + request.timeout
+                    error = SerialTimeoutError(
+                        f"{self.port}: {request.command}の応答が{request.timeout}秒以内に返ってきませんでした"
+                    )
+                    completed.append((request, None, error))
+            # Futureの結果はロックを外してから入れる(コールバックが呼ばれるため)
+            for request, answers, error in completed:
+                if error is None:
+                    request.future.set_result(answers)
+                else:
+                    request.future.set_exception(error)
+
+    def _fail_all(self, error: Exception) -> None:
+        """応答待ちのコマンドを全てエラーにする"""
+        with self._condition:
+            pending = list(self._pending)
+            self._pending.clear()
+            self._condition.notify_all()
+        for request in pending:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    def close(self) -> None:
+        """ポートを閉じる"""
+        with self._transports_lock:
+            if self._transports.get(self.port) is self:
+                del self._transports[self.port]
+        self.is_open = False
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._fail_all(SerialTransportError(f"{self.port}は閉じられました"))
+        self.ser.close()
@@ -0,0 +1,503 @@
+"""
+実際の機器がなくても測定マクロを動かせるようにするための機器のシミュレーション
+
+GPIB/USB(VISA)の機器はSimulatedResourceManagerを, シリアル通信の機器はSimulatedSerialを使う.
+どちらも応答の遅延(latency)とそのばらつき(jitter)を設定できるので, 測定ループの速度の見積もりにも使える
+
+使用例
+------
+enable_simulation(visa_devices=tmr_devices(latency=0.01), serial_devices={"COM3": LinkamT95Simulator()})
+LCR = GPIBController()
+LCR.connect(13)  # シミュレーションの機器につながる
+...
+disable_simulation()
+"""
+from __future__ import annotations
+
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from logging import getLogger
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import pyvisa
+import serial
+from pyvisa import util
+
+from ExternalControl.Discovery.Discovery import InstrumentDiscovery, list_comports
+from ExternalControl.LinkamT95.IO import LinkamT95SerialIO
+from ExternalControl.MAX303.MAX303IO import MAX303SerialIO
+from ExternalControl.Serial.Serial import SerialTransport
+from ExternalControl.VISA.VISA import VISAResourcePool
+
+logger = getLogger(f"SSR.{__name__}")
+
+Response = Union[None, str, bytes, Callable[[re.Match], Union[None, str, bytes]]]
+
+
+class SimulatedDevice:
+    """コマンドに対する応答を決める機器のモデル
+
+    応答はスクリプト(正規表現と応答の組)で決める. 応答には文字列かバイト列か関数を指定できる.
+    関数のときは正規表現のマッチを引数に呼ばれて, その返り値が応答になる.
+    Noneが応答のコマンドは返答のないコマンド(書き込みだけのコマンド)として扱う.
+
+    Attributes
+    ----------
+    latency: float
+        応答が返ってくるまでの時間[s]
+    jitter: float
+        応答時間のばらつき[s] (0~jitterの一様乱数をlatencyに足す)
+    commands: List[str]
+        受信したコマンドの記録
+    """
+
+    def __init__(
+        self,
+        script: Optional[Dict[str, Response]] = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        default: Response = None,
+        seed: Optional[int] = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        script: Dict[str, Response]
+            {コマンドの正規表現: 応答} 上から順番に探して最初にマッチしたものを使う
+        default: Response
+            どれにもマッチしなかったときの応答
+        seed:
+            jitterの乱数のシード
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.default = default
+        self.commands: List[str] = []
+        self._script: List[Tuple[re.Pattern, Response]] = []
+        self._random = random.Random(seed)
+        for pattern, response in (script or {}).items():
+            self.add(pattern, response)
+
+    def add(self, pattern: str, response: Response) -> SimulatedDevice:
+        """スクリプトに応答を追加"""
+        self._script.append((re.compile(pattern), response))
+        return self
+
+    def get_delay(self) -> float:
+        """応答までの時間[s]"""
+        if self.jitter > 0:
+            return self.latency + self._random.uniform(0, self.jitter)
+        return self.latency
+
+    def handle(self, command: str) -> Union[None, str, bytes]:
+        """コマンドを受け取って応答を返す"""
+        self.commands.append(command)
+        for pattern, response in self._script:
+            match = pattern.fullmatch(command)
+            if match is not None:
+                return response(match) if callable(response) else response
+        if callable(self.default):
+            return self.default(re.fullmatch(".*", command, re.DOTALL))
+        return self.default
+
+
+class SimulatedInstrument:
+    """pyvisaのMessageBasedResourceの代わりになるクラス"""
+
+    def __init__(self, address: str, device: SimulatedDevice) -> None:
+        self.resource_name = address
+        self.device = device
+        self.timeout = 2000  # [ms]
+        self._responses: deque = deque()
+
+    def write(self, message: str) -> None:
+        # ";"でつないだコマンドは1つずつ処理して, 返答は";"でつないで1つのメッセージにする
+        answers = []
+        for command in message.split(";"):
+            command = command.strip().lstrip(":")
+            if command == "":
+                continue
+            answer = self.device.handle(command)
+            if answer is not None:
+                answers.append(answer)
+        if len(answers) > 0:
+            if all(isinstance(a, str) for a in answers):
+                answer = ";".join(answers)
+            else:
+                answer = b";".join(
+                    a if isinstance(a, bytes) else a.encode("ascii") for a in answers
+                )
+            self._responses.append(answer)
+
+    def _read(self) -> Union[str, bytes]:
+        delay = self.device.get_delay()
+        if delay > 0:
+            time.sleep(delay)
+        if len(self._responses) == 0:
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+        return self._responses.popleft()
+
+    def read(self) -> str:
+        answer = self._read()
+        return answer.decode("ascii") if isinstance(answer, bytes) else answer
+
+    def read_raw(self) -> bytes:
+        answer = self._read()
+        return answer if isinstance(answer, bytes) else answer.encode("ascii")
+
+    def query(self, message: str) -> str:
+        self.write(message)
+        return self.read()
+
+    def query_ascii_values(
+        self, message: str, converter="f", separator=",", container=list, delay=None
+    ):
+        self.write(message)
+        return util.from_ascii_block(
+            self.read(), converter=converter, separator=separator, container=container
+        )
+
+    def query_binary_values(
+        self,
+        message: str,
+        datatype="f",
+        is_big_endian=False,
+        container=list,
+        delay=None,
+        header_fmt="ieee",
+        expect_termination=True,
+        **kwargs,
+    ):
+        self.write(message)
+        raw = self.read_raw().rstrip(b"\n") if expect_termination else self.read_raw()
+        if header_fmt == "ieee":
+            return util.from_ieee_block(
+                raw, datatype=datatype, is_big_endian=is_big_endian, container=container
+            )
+        return util.from_binary_block(
+            raw, datatype=datatype, is_big_endian=is_big_endian, container=container
+        )
+
+    def close(self) -> None:
+        pass
+
+
+class SimulatedResourceManager:
+    """pyvisa.ResourceManagerの代わりになるクラス"""
+
+    def __init__(self, devices: Dict[str, SimulatedDevice]) -> None:
+        self.devices = devices
+
+    def list_resources(self, query: str = "?*::INSTR") -> Tuple[str, ...]:
+        return tuple(self.devices.keys())
+
+    def open_resource(self, address: str, **kwargs) -> SimulatedInstrument:
+        if address not in self.devices:
+            raise pyvisa.errors.VisaIOError(
+                pyvisa.constants.StatusCode.error_resource_not_found
+            )
+        return SimulatedInstrument(address, self.devices[address])
+
+    def close(self) -> None:
+        pass
+
+
+class SimulatedSerial:
+    """serial.Serialの代わりになるクラス
+
+    ポート名ごとにSimulatedDeviceを登録しておくと, そのポートを開いたときにその機器とつながる.
+    受信したバイト列を機器の終端文字で区切ってコマンドにし, 応答は遅延時間が経過してから読めるようになる.
+    """
+
+    ports: Dict[str, SimulatedDevice] = {}
+
+    def __init__(self, port: Optional[str] = None, timeout: Optional[float] = None, **kwargs) -> None:
+        if port not in self.ports:
+            raise serial.SerialException(f"could not open port {port}")
+        self.port = port
+        self.timeout = timeout
+        self.device = self.ports[port]
+        self.terminator: bytes = getattr(self.device, "terminator", b"\r")
+        self.is_open = True
+        self._received = bytearray()
+        self._pending: deque = deque()  # (読めるようになる時刻, 応答)
+        self._output = bytearray()
+        self._condition = threading.Condition()
+
+    @classmethod
+    def register(cls, port: str, device: SimulatedDevice) -> None:
+        """ポートに機器を登録する"""
+        cls.ports[port] = device
+
+    def write(self, data: bytes) -> int:
+        with self._condition:
+            self._received += data
+            while True:
+                index = self._received.find(self.terminator)
+                if index < 0:
+                    break
+                command = self._received[:index].decode("utf-8")
+                del self._received[: index + len(self.terminator)]
+                answer = self.device.handle(command)
+                if answer is None:
+                    continue
+                if isinstance(answer, str):
+                    answer = answer.encode("utf-8")
+                ready = max(
+                    time.monotonic() + self.device.get_delay(),
+                    self._pending[-1][0] if self._pending else 0.0,
+                )
+                self._pending.append((ready, answer + self.terminator))
+            self._condition.notify_all()
+        return len(data)
+
+    def _move_ready(self) -> Optional[float]:
+        """読めるようになった応答を出力に移す. まだ読めない応答があればその時刻を返す"""
+        now = time.monotonic()
+        while self._pending and self._pending[0][0] <= now:
+            self._output += self._pending.popleft()[1]
+        return self._pending[0][0] if self._pending else None
+
+    def _wait(self, is_satisfied: Callable[[], bool], timeout: Optional[float]) -> None:
+        """is_satisfiedがTrueになるかタイムアウトするまで待つ"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            next_ready = self._move_ready()
+            if is_satisfied() or not self.is_open:
+                return
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return
+            wait = None if deadline is None else deadline - now
+            if next_ready is not None:
+                wait = next_ready - now if wait is None else min(wait, next_ready - now)
+            self._condition.wait(wait)
+
+    def read(self, size: int = 1) -> bytes:
+        with self._condition:
+            self._wait(lambda: len(self._output) >= size, self.timeout)
+            data = bytes(self._output[:size])
+            del self._output[:size]
+            return data
+
+    def read_until(self, expected: bytes = b"\n", size: Optional[int] = None) -> bytes:
+        with self._condition:
+
+            def is_satisfied():
+                if size is not None and len(self._output) >= size:
+                    return True
+                return self._output.find(expected) >= 0
+
+            self._wait(is_satisfied, self.timeout)
+            index = self._output.find(expected)
+            end = len(self._output) if index < 0 else index + len(expected)
+            if size is not None:
+                end = min(end, size)
+            data = bytes(self._output[:end])
+            del self._output[:end]
+            return data
+
+    def read_all(self) -> bytes:
+        with self._condition:
+            self._move_ready()
+            data = bytes(self._output)
+            self._output.clear()
+            return data
+
+    @property
+    def in_waiting(self) -> int:
+        with self._condition:
+            self._move_ready()
+            return len(self._output)
+
+    def reset_input_buffer(self) -> None:
+        self.read_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self.is_open = False
+            self._condition.notify_all()
+
+
+class LinkamT95Simulator(SimulatedDevice):
+    """LinkamT95のシミュレーション
+
+    設定した速度で目的温度まで温度が変化する.
+    全てのコマンドに空の応答を返し, Tコマンドにはさらに状態を表すバイト列を返す
+
+    Attributes
+    ----------
+    time_scale: float
+        時間の進み方の倍率 (60にすると1秒で1分分の温度変化をする)
+    """
+
+    terminator = b"\r"
+
+    def __init__(
+        self,
+        temperature: float = 25.0,
+        time_scale: float = 1.0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        super().__init__(latency=latency, jitter=jitter, seed=seed)
+        self.time_scale = time_scale
+        self.temperature = temperature
+        self.limit = temperature
+        self.rate = 0.0  # [℃/min]
+        self.lnp_speed = 0  # 0~30
+        self.is_running = False
+        self._time = time.monotonic()
+
+    def _update_temperature(self) -> None:
+        now = time.monotonic()
+        elapsed = (now - self._time) * self.time_scale
+        self._time = now
+        if not self.is_running:
+            return
+        step = self.rate / 60 * elapsed
+        if abs(self.limit - self.temperature) <= step:
+            self.temperature = self.limit
+        else:
+            self.temperature += math.copysign(step, self.limit - self.temperature)
+
+    def handle(self, command: str) -> Union[str, bytes]:
+        self.commands.append(command)
+        self._update_temperature()
+        if command.startswith("L1"):
+            self.limit = int(command[2:]) / 10
+        elif command.startswith("R1"):
+            self.rate = int(command[2:]) / 100
+        elif command == "S":
+            self.is_running = True
+        elif command == "E":
+            self.is_running = False
+        elif command in ("Pa0", "Pm0"):
+            pass
+        elif command.startswith("P"):
+            self.lnp_speed = ord(command[1]) - ord("0")
+        elif command == "T":
+            return self._status()
+        return ""
+
+    def _status(self) -> bytes:
+        if not self.is_running:
+            state = 0x01
+        elif self.temperature == self.limit:
+            state = 0x30
+        elif self.temperature < self.limit:
+            state = 0x10
+        else:
+            state = 0x20
+        # Tコマンドの返答の後ろには空の応答が続く(LinkamT95SerialIO.queryは空の応答を読み飛ばしてから返答を読む)
+        return (
+            b"\r"
+            + bytes([state, 0x80, 0x80 + self.lnp_speed, 0, 0, 0])
+            + int(round(self.temperature * 10)).to_bytes(4, "big", signed=True)
+        )
+
+
+class MAX303Simulator(SimulatedDevice):
+    """MAX-303のシミュレーション. 全てのコマンドに空の応答を返し, S?にはシャッターの状態を返す"""
+
+    terminator = b"\r\n"
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed: Optional[int] = None) -> None:
+        super().__init__(latency=latency, jitter=jitter, seed=seed)
+        self.shutter = 0
+        self.lamp = 0
+
+    def handle(self, command: str) -> str:
+        self.commands.append(command)
+        if command == "S?":
+            return f"\r\nS{self.shutter}"
+        if command in ("S0", "S1"):
+            self.shutter = int(command[1])
+        elif command in ("PW0", "PW1"):
+            self.lamp = int(command[2])
+        return ""
+
+
+def tmr_devices(
+    latency: float = 0.0, jitter: float = 0.0, seed: Optional[int] = None
+) -> Dict[str, SimulatedDevice]:
+    """TMR誘電測定のサンプルマクロで使うLCRメーター(GPIB13)とKeithley2000(GPIB11)のシミュレーション"""
+    rand = random.Random(seed)
+    state = {"frequency": 1000.0}
+
+    def set_frequency(match: re.Match) -> None:
+        state["frequency"] = float(match.group(1))
+
+    def fetch_lcr(match: re.Match) -> str:
+        capacitance = 1e-12 * (10 + 1 / math.log10(state["frequency"] + 10))
+        tan_delta = 0.01 + 0.001 * rand.random()
+        return f"{capacitance:+.5E},{tan_delta:+.5E},+0"
+
+    def fetch_keithley(match: re.Match) -> str:
+        return f"{100 + 10 * rand.random():+.6E}"
+
+    lcr = SimulatedDevice(
+        {
+            r"\*IDN\?": "Agilent Technologies,E4980A,SIM,A.00.00",
+            r"FREQ (.+)": set_frequency,
+            r"FREQ\?": lambda m: f"{state['frequency']:+.6E}",
+            r"FETC\?": fetch_lcr,
+            r"VOLT\?": "+1.000000E+00",
+        },
+        latency=latency,
+        jitter=jitter,
+        seed=seed,
+    )
+    keithley = SimulatedDevice(
+        {
+            r"\*IDN\?": "KEITHLEY INSTRUMENTS INC.,MODEL 2000,SIM,A00",
+            r"FETCH?\?": fetch_keithley,
+        },
+        latency=latency,
+        jitter=jitter,
+        seed=seed,
+    )
+    return {"GPIB0::13::INSTR": lcr, "GPIB0::11::INSTR": keithley}
+
+
+def enable_simulation(
+    visa_devices: Optional[Dict[str, SimulatedDevice]] = None,
+    serial_devices: Optional[Dict[str, SimulatedDevice]] = None,
+) -> None:
+    """GPIB/USB/シリアル通信の接続先をシミュレーションに切り替える
+
+    Parameters
+    ----------
+    visa_devices: Dict[str, SimulatedDevice]
+        {VISAアドレス(GPIB0::13::INSTRなど): 機器}
+    serial_devices: Dict[str, SimulatedDevice]
+        {シリアルポート名(COM3など): 機器}
+    """
+    VISAResourcePool.set_resource_manager(SimulatedResourceManager(visa_devices or {}))
+    SerialTransport.close_all()  # 実際の機器につないでいたポートは閉じる
+    for port, device in (serial_devices or {}).items():
+        SimulatedSerial.register(port, device)
+    LinkamT95SerialIO.serial_class = SimulatedSerial
+    MAX303SerialIO.serial_class = SimulatedSerial
+    # 自動検出はシミュレーションの機器だけを探し, 実際の機器の対応表は読み書きしない
+    InstrumentDiscovery.list_serial_ports = lambda: sorted(SimulatedSerial.ports)
+    InstrumentDiscovery.persistent = False
+    InstrumentDiscovery.clear()
+    logger.info("instrument simulation is enabled")
+
+
+def disable_simulation() -> None:
+    """シミュレーションをやめて実際の機器につなぐ"""
+    VISAResourcePool.set_resource_manager(None)
+    SerialTransport.close_all()
+    SimulatedSerial.ports = {}
+    LinkamT95SerialIO.serial_class = serial.Serial
+    MAX303SerialIO.serial_class = serial.Serial
+    InstrumentDiscovery.list_serial_ports = staticmethod(list_comports)
+    InstrumentDiscovery.persistent = True
+    InstrumentDiscovery.clear()
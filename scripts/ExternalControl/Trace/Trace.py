@@ -0,0 +1,358 @@
+"""
+機器との通信を記録して, どの機器の通信が遅いのかを調べるためのもの
+
+記録するのは コマンド・所要時間・送受信したバイト数・タイムアウトしたかどうか
+記録はバイト列のリングバッファーに詰めるので, 長時間の測定でもメモリは一定
+
+使用例
+------
+IOTracer.enable()
+... 測定 ...
+print(IOTracer.summary())
+IOTracer.export_chrome_trace("trace.json")  # chrome://tracing や Perfetto で開ける
+"""
+import functools
+import json
+import struct
+import threading
+import time
+from collections import namedtuple
+from logging import getLogger
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+logger = getLogger(f"SSR.{__name__}")
+
+TraceRecord = namedtuple(
+    "TraceRecord",
+    ["address", "command", "start", "duration", "bytes_out", "bytes_in", "timeout"],
+)
+
+VI_ERROR_TMO = -1073807339  # pyvisaのタイムアウトのエラーコード
+
+
+class IOTracer:
+    """通信の記録を保持するクラス. インスタンスは作らずにクラスメソッドから使う
+
+    1回の通信は_RECORDの形式(27バイト)でリングバッファーに書き込む
+    アドレスとコマンドの文字列は番号に置き換えて別に保持する
+
+    Attributes
+    ----------
+    enabled: bool
+        記録するかどうか (Falseのときはtracedをつけた関数のオーバーヘッドはほぼない)
+    """
+
+    # 開始時刻[s], 所要時間[us], アドレス番号, コマンド番号, 送信バイト数, 受信バイト数, フラグ
+    _RECORD = struct.Struct("<dIHIIIB")
+    _FLAG_TIMEOUT = 0b00000001
+    HISTOGRAM_BINS = 32  # ヒストグラムのビンの数. i番目のビンは2**(i-1)~2**i [us]
+    # そのまま保持するコマンドの文字列の数. これを超えたら引数を省いたヘッダー("FREQ …"など)で保持する
+    MAX_COMMANDS = 4096
+    MAX_HEADERS = 256  # ヘッダーも増え続けるときは全て"…"にまとめる
+
+    enabled: bool = False
+    _lock = threading.Lock()
+    _buffer: bytearray = bytearray()
+    _capacity: int = 0
+    _count: int = 0  # これまでに記録した数(リングバッファーの書き込み位置の計算に使う)
+    _origin: float = 0.0
+    _addresses: List[str] = []
+    _address_ids: Dict[str, int] = {}
+    _commands: List[str] = []
+    _command_ids: Dict[str, int] = {}
+    _histograms: Dict[int, List[int]] = {}
+
+    @classmethod
+    def enable(cls, capacity: int = 100000) -> None:
+        """記録を開始する. 今までの記録は消える
+
+        Parameters
+        ----------
+        capacity: int
+            保持する通信の数. これを超えると古いものから上書きされる
+        """
+        with cls._lock:
+            cls._capacity = capacity
+            cls._buffer = bytearray(cls._RECORD.size * capacity)
+            cls._count = 0
+            cls._origin = time.perf_counter()
+            cls._addresses = []
+            cls._address_ids = {}
+            cls._commands = []
+            cls._command_ids = {}
+            cls._histograms = {}
+            cls.enabled = True
+
+    @classmethod
+    def disable(cls) -> None:
+        """記録を止める(記録は残る)"""
+        cls.enabled = False
+
+    @classmethod
+    def record(
+        cls,
+        address: str,
+        command: str,
+        start: float,
+        duration: float,
+        bytes_out: int,
+        bytes_in: int,
+        timeout: bool,
+    ) -> None:
+        """1回の通信を記録する
+
+        Parameters
+        ----------
+        start: float
+            time.perf_counter()で測った開始時刻
+        duration: float
+            所要時間[s]
+        """
+        duration_us = min(int(duration * 1e6), 0xFFFFFFFF)
+        with cls._lock:
+            if not cls.enabled:
+                return
+            address_id = cls._get_id(address, cls._addresses, cls._address_ids)
+            command_id = cls._get_command_id(command)
+            cls._RECORD.pack_into(
+                cls._buffer,
+                (cls._count % cls._capacity) * cls._RECORD.size,
+                start - cls._origin,
+                duration_us,
+                address_id,
+                command_id,
+                min(bytes_out, 0xFFFFFFFF),
+                min(bytes_in, 0xFFFFFFFF),
+                cls._FLAG_TIMEOUT if timeout else 0,
+            )
+            cls._count += 1
+
+            histogram = cls._histograms.get(address_id)
+            if histogram is None:
+                histogram = [0] * cls.HISTOGRAM_BINS
+                cls._histograms[address_id] = histogram
+            histogram[min(duration_us.bit_length(), cls.HISTOGRAM_BINS - 1)] += 1
+
+    @staticmethod
+    def _get_id(text: str, table: List[str], ids: Dict[str, int]) -> int:
+        """文字列を番号に置き換える"""
+        i = ids.get(text)
+        if i is None:
+            i = len(table)
+            table.append(text)
+            ids[text] = i
+        return i
+
+    @classmethod
+    def _get_command_id(cls, command: str) -> int:
+        """コマンドを番号に置き換える
+
+        FREQ 1000, FREQ 1001, ...のようにコマンドの種類が増え続けてもメモリが一定になるように,
+        保持する文字列の数に上限を設ける
+        """
+        i = cls._command_ids.get(command)
+        if i is not None:
+            return i
+        if len(cls._commands) < cls.MAX_COMMANDS:
+            return cls._get_id(command, cls._commands, cls._command_ids)
+        header = command.partition(" ")[0] + " …"
+        if header in cls._command_ids or len(cls._commands) < cls.MAX_COMMANDS + cls.MAX_HEADERS:
+            return cls._get_id(header, cls._commands, cls._command_ids)
+        return cls._get_id("…", cls._commands, cls._command_ids)
+
+    @classmethod
+    def get_records(cls) -> List[TraceRecord]:
+        """保持している記録を古い順に返す"""
+        with cls._lock:
+            n = min(cls._count, cls._capacity)
+            first = cls._count - n
+            records = []
+            for i in range(first, cls._count):
+                (
+                    start,
+                    duration_us,
+                    address_id,
+                    command_id,
+                    bytes_out,
+                    bytes_in,
+                    flags,
+                ) = cls._RECORD.unpack_from(
+                    cls._buffer, (i % cls._capacity) * cls._RECORD.size
+                )
+                records.append(
+                    TraceRecord(
+                        address=cls._addresses[address_id],
+                        command=cls._commands[command_id],
+                        start=start,
+                        duration=duration_us / 1e6,
+                        bytes_out=bytes_out,
+                        bytes_in=bytes_in,
+                        timeout=bool(flags & cls._FLAG_TIMEOUT),
+                    )
+                )
+            return records
+
+    @classmethod
+    def get_histogram(cls, address: str) -> Dict[int, int]:
+        """アドレスごとの所要時間のヒストグラムを返す
+
+        リングバッファーで上書きされた古い記録も含めて数える
+
+        Returns
+        -------
+        histogram: Dict[int, int]
+            {ビンの上限[us]: 回数} (回数が0のビンは含まない)
+        """
+        with cls._lock:
+            address_id = cls._address_ids.get(address)
+            if address_id is None:
+                return {}
+            return {
+                2**i: count
+                for i, count in enumerate(cls._histograms[address_id])
+                if count > 0
+            }
+
+    @classmethod
+    def summary(cls) -> Dict[str, dict]:
+        """保持している記録からアドレスごとの回数・タイムアウト数・平均/最大所要時間[s]を返す"""
+        summary: Dict[str, dict] = {}
+        for r in cls.get_records():
+            s = summary.setdefault(
+                r.address, {"count": 0, "timeout": 0, "total": 0.0, "max": 0.0}
+            )
+            s["count"] += 1
+            s["timeout"] += int(r.timeout)
+            s["total"] += r.duration
+            s["max"] = max(s["max"], r.duration)
+        for s in summary.values():
+            s["mean"] = s.pop("total") / s["count"]
+        return summary
+
+    @classmethod
+    def export_chrome_trace(cls, path: Union[str, Path]) -> None:
+        """Chromeのトレース形式(JSON)で書き出す. アドレスごとに1つのスレッドとして表示される"""
+        records = cls.get_records()
+        events = []
+        for address_id, address in enumerate(list(cls._addresses)):
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": address_id,
+                    "args": {"name": address},
+                }
+            )
+        for r in records:
+            events.append(
+                {
+                    "name": r.command,
+                    "cat": "timeout" if r.timeout else "io",
+                    "ph": "X",
+                    "pid": 1,
+                    "tid": cls._address_ids[r.address],
+                    "ts": r.start * 1e6,
+                    "dur": r.duration * 1e6,
+                    "args": {
+                        "bytes_out": r.bytes_out,
+                        "bytes_in": r.bytes_in,
+                        "timeout": r.timeout,
+                    },
+                }
+            )
+        with Path(path).open(mode="w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events}, f)
+        logger.info("export I/O trace: %s", str(path))
+
+
+_local = threading.local()
+
+
+def traced(terminator: Optional[bytes] = None) -> Callable:
+    """通信を行うメソッドにつけるデコレーター. IOTracer.enabledのときだけ記録する
+
+    第1引数(selfの次)をコマンドとして記録する(引数がなければメソッド名).
+    アドレスはインスタンスの_trace_addressから取る.
+    tracedをつけたメソッドの中で呼ばれたtracedのメソッドは記録しない(query内のwriteなど)
+
+    Parameters
+    ----------
+    terminator: bytes
+        返答の終端文字. 返答がこれで終わっていなければタイムアウトとして記録する(シリアル通信用)
+    """
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not IOTracer.enabled or getattr(_local, "depth", 0) > 0:
+                return method(self, *args, **kwargs)
+
+            # read()のようにコマンドのないメソッドはメソッド名を記録する
+            command = args[0] if len(args) > 0 else kwargs.get("command", method.__name__ + "()")
+            _local.depth = 1
+            result = None
+            timeout = False
+            start = time.perf_counter()
+            try:
+                result = method(self, *args, **kwargs)
+                return result
+            except Exception as e:
+                timeout = _is_timeout(e)
+                raise
+            finally:
+                duration = time.perf_counter() - start
+                _local.depth = 0
+                if (
+                    terminator is not None
+                    and isinstance(result, bytes)
+                    and not result.endswith(terminator)
+                ):
+                    timeout = True
+                IOTracer.record(
+                    address=str(
+                        getattr(self, "_trace_address", None) or type(self).__name__
+                    ),
+                    command=str(command),
+                    start=start,
+                    duration=duration,
+                    bytes_out=_size(command) if len(args) > 0 or "command" in kwargs else 0,
+                    bytes_in=_size(result),
+                    timeout=timeout,
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def _size(value) -> int:
+    """送受信したデータのおおよそのバイト数"""
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if hasattr(value, "nbytes"):  # NumPy配列
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sum(_size(v) for v in value)
+    return 0
+
+
+def _is_timeout(e: Optional[BaseException]) -> bool:
+    """例外がタイムアウトによるものかどうか
+
+    機器ごとのエラー(LinkamT95Errorなど)に包まれたタイムアウトも__cause__をたどって調べる
+    """
+    seen = set()
+    while e is not None and id(e) not in seen:
+        if isinstance(e, TimeoutError) or type(e).__name__ == "SerialTimeoutException":
+            return True
+        if getattr(e, "error_code", None) == VI_ERROR_TMO:
+            return True
+        seen.add(id(e))
+        e = e.__cause__
+    return False
@@ -5,9 +5,14 @@ USB通信周りの処理はGPIBと同じ書き方でできそうなので流用
 from logging import getLogger
 from typing import Union
 
+import numpy as np
 import pyvisa
 from utility import MyException
 
+from ExternalControl.Discovery.Discovery import InstrumentDiscovery
+from ExternalControl.Trace.Trace import traced
+from ExternalControl.VISA.VISA import VISAResourcePool
+
 logger = getLogger(f"SSR.{__name__}")
 
 
@@ -19,6 +24,7 @@ class USBController:
     """USB機器に接続するクラス"""
 
     _instrument = None
+    _trace_address = None  # IOTracerで記録するときのアドレス
 
     def connect(self, address: str):
         """指定されたUSBアドレスに接続(種類は調べない. 何かつながっていればOK)
@@ -39,8 +45,9 @@ class USBController:
         if type(address) is not str:
             raise USBError("USBController.connectの引数はstrでなければなりません")
 
+        # ResourceManagerと開いたリソースはプロセス全体で共有する(2回目以降の接続は速い)
         try:
-            resource_manager = pyvisa.ResourceManager()
+            VISAResourcePool.get_resource_manager()
         except ValueError as e:
             raise USBError("VISAがPCにインストールされていない可能性があります。 NIVISAをインストールしてください") from e
         except Exception as e:  # エラーの種類に応じて場合分け
@@ -48,7 +55,7 @@ class USBController:
 
         try:
             # 機器にアクセス. USBがつながってないとここでエラーが出る
-            inst = resource_manager.open_resource(address)
+            inst = VISAResourcePool.open_resource(address)
         except pyvisa.errors.VisaIOError as e:  # エラーが出たらここを実行
             raise USBError("USBケーブルが抜けている可能性があります") from e
         except Exception as e:  # エラーの種類に応じて場合分け
@@ -56,7 +63,8 @@ class USBController:
 
         try:
             # IDNコマンドで機器と通信. USB番号に機器がないとここでエラー
-            inst.query("*IDN?")
+            # 一度応答したアドレスには再送しない
+            VISAResourcePool.query_idn(address)
         except pyvisa.errors.VisaIOError as e:
             raise USBError(
                 address
@@ -67,21 +75,95 @@ class USBController:
 
         # 問題が無ければinstrumentにいれる
         self._instrument = inst
+        self._trace_address = address
+
+    def connect_by_name(self, name: str):
+        """*IDN?の返答にnameを含む機器を自動で探して接続
+
+        前回見つけたアドレスを共有設定フォルダに保存しておき, そのアドレスで接続できなければ探し直す
 
+        Parameters
+        ----------
+
+        name: str
+            機器の名前の一部 (例 "E4980A", "MODEL 2000")
+        """
+        InstrumentDiscovery.connect(name, self.connect, interface="VISA")
+
+    @traced()
     def write(self, command):
         """機器に書き込み"""
         if self._instrument is None:
             raise USBError("write()を呼ぶより前に機器に接続してください")
         self._instrument.write(command)
 
+    @traced()
     def read(self):
         """読み取り"""
         if self._instrument is None:
             raise USBError("read()を呼ぶより前に機器に接続してください")
-        self._instrument.read()
+        return self._instrument.read()
 
+    @traced()
     def query(self, command):
         """機器に書き込みして読み取り"""
         if self._instrument is None:
             raise USBError("query()を呼ぶより前に機器に接続してください")
         return self._instrument.query(command)
+
+    @traced()
+    def query_ascii_values(self, command: str, converter="f", separator=",") -> np.ndarray:
+        """機器に書き込みしてテキストで返ってくる複数の値をNumPy配列で読み取る
+
+        Parameters
+        -------------
+        command: str
+            機器に送信するコマンド
+        converter: str
+            値の変換方法 ("f":float, "d":int, "s":文字列 など. pyvisaの書式に従う)
+        separator: str
+            値の区切り文字
+        """
+        if self._instrument is None:
+            raise USBError("query_ascii_values()を呼ぶより前に機器に接続してください")
+        return self._instrument.query_ascii_values(
+            command, converter=converter, separator=separator, container=np.array
+        )
+
+    def query_binary_values(
+        self,
+        command: str,
+        datatype="f",
+        is_big_endian=False,
+        header_fmt="ieee",
+        expect_termination=True,
+    ) -> np.ndarray:
+        """機器に書き込みしてバイナリで返ってくる値をNumPy配列で読み取る
+
+        文字列への変換とfloatへの変換を挟まないので, 波形などの大量のデータを速く正確に読み取れる
+        (機器側でFORM REALなどのバイナリ出力の設定をしておく必要がある)
+
+        Parameters
+        -------------
+        command: str
+            機器に送信するコマンド
+        datatype: str
+            1つの値の型 (structモジュールの書式. "f":float32, "d":float64, "h":int16 など)
+        is_big_endian: bool
+            ビッグエンディアンならTrue
+        header_fmt: str
+            データの前につくヘッダーの形式
+            "ieee"ならIEEE488.2の確定長ブロック(#<桁数><バイト数><データ>), ヘッダーがなければ"empty"
+        expect_termination: bool
+            データの後ろに終端文字が付いてくるかどうか
+        """
+        if self._instrument is None:
+            raise USBError("query_binary_values()を呼ぶより前に機器に接続してください")
+        return self._instrument.query_binary_values(
+            command,
+            datatype=datatype,
+            is_big_endian=is_big_endian,
+            header_fmt=header_fmt,
+            expect_termination=expect_termination,
+            container=np.array,
+        )
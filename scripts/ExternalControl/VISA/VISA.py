@@ -0,0 +1,124 @@
+"""
+VISA(pyvisa)のResourceManagerと開いた機器をプロセス全体で共有する
+GPIBControllerやUSBControllerから使う
+
+pyvisa.ResourceManager()の作成(VISAライブラリの初期化)は重いので1回だけにして,
+同じアドレスへの接続は開いたリソースと*IDN?の結果を使い回す
+"""
+import threading
+from logging import getLogger
+from typing import Dict, Optional, Tuple
+
+import pyvisa
+
+logger = getLogger(f"SSR.{__name__}")
+
+
+class VISAResourcePool:
+    """ResourceManagerと開いたリソースをアドレスごとに保持するクラス
+
+    インスタンスは作らずにクラスメソッドから使う
+
+    Attributes
+    ----------
+    _resource_manager:
+        プロセスで共有するpyvisa.ResourceManager
+    _resources: Dict[str, Resource]
+        開いたリソース(キーはアドレス)
+    _idn: Dict[str, str]
+        *IDN?の返答(キーはアドレス)
+    _address_locks: Dict[str, threading.Lock]
+        *IDN?を問い合わせ中のアドレスのロック
+    """
+
+    _resource_manager: Optional[pyvisa.ResourceManager] = None
+    _resources: Dict[str, pyvisa.resources.Resource] = {}
+    _idn: Dict[str, str] = {}
+    _address_locks: Dict[str, threading.Lock] = {}
+    _lock = threading.RLock()
+
+    @classmethod
+    def get_resource_manager(cls) -> pyvisa.ResourceManager:
+        """共有のResourceManagerを返す. 最初の1回だけ作成する
+
+        VISAがインストールされていないときはpyvisaのエラー(ValueErrorなど)がそのまま出るので呼び出し側で処理する
+        """
+        with cls._lock:
+            if cls._resource_manager is None:
+                cls._resource_manager = pyvisa.ResourceManager()
+                logger.debug("create VISA ResourceManager")
+            return cls._resource_manager
+
+    @classmethod
+    def set_resource_manager(cls, resource_manager) -> None:
+        """共有するResourceManagerを差し替える(シミュレーションなどで使う)
+
+        開いていたリソースとIDNのキャッシュは破棄する
+        """
+        with cls._lock:
+            cls.clear()
+            cls._resource_manager = resource_manager
+
+    @classmethod
+    def open_resource(cls, address: str) -> pyvisa.resources.Resource:
+        """アドレスに対応するリソースを返す. 開いていなければ開いて保持する"""
+        with cls._lock:
+            inst = cls._resources.get(address)
+            if inst is None:
+                inst = cls.get_resource_manager().open_resource(address)
+                cls._resources[address] = inst
+                logger.debug("open VISA resource %s", address)
+            return inst
+
+    @classmethod
+    def query_idn(cls, address: str) -> str:
+        """*IDN?の返答を返す. 一度返答があったアドレスは機器に問い合わせない
+
+        機器が応答しないときは開いたリソースを閉じてからpyvisaのエラーをそのまま出す
+        問い合わせ中はそのアドレスだけをロックするので, 別のアドレスへの問い合わせは同時にできる
+        """
+        with cls._lock:
+            idn = cls._idn.get(address)
+            if idn is not None:
+                return idn
+            inst = cls.open_resource(address)
+            address_lock = cls._address_locks.setdefault(address, threading.Lock())
+
+        with address_lock:
+            with cls._lock:
+                idn = cls._idn.get(address)  # 待っている間に他のスレッドが問い合わせたかもしれない
+            if idn is not None:
+                return idn
+            try:
+                idn = inst.query("*IDN?")
+            except Exception:
+                cls.close_resource(address)
+                raise
+            with cls._lock:
+                cls._idn[address] = idn
+            return idn
+
+    @classmethod
+    def list_resources(cls, query: str = "?*::INSTR") -> Tuple[str, ...]:
+        """VISAから見えるリソースのアドレスを返す"""
+        return tuple(cls.get_resource_manager().list_resources(query))
+
+    @classmethod
+    def close_resource(cls, address: str) -> None:
+        """リソースを閉じてキャッシュから消す(再接続のときに使う)"""
+        with cls._lock:
+            cls._idn.pop(address, None)
+            inst = cls._resources.pop(address, None)
+            if inst is not None:
+                try:
+                    inst.close()
+                except Exception:
+                    logger.debug("failed to close VISA resource %s", address)
+
+    @classmethod
+    def clear(cls) -> None:
+        """開いているリソースを全て閉じる(ResourceManagerは残す)"""
+        with cls._lock:
+            for address in list(cls._resources.keys()):
+                cls.close_resource(address)
+            cls._idn.clear()
@@ -3,33 +3,43 @@
 ユーザーの書いたマクロを取得して
 マクロを動かす関数にわたす
 """
-import ctypes
+import argparse
+import json
 import os
+import signal
 import sys
 import time
 from logging import getLogger
 from pathlib import Path
-from typing import Callable
+from typing import Callable, Optional
 
-import measurement_manager as mm
 import variables
-import win32api
-import win32con
 from define import read_deffile
-from macro import get_macro, get_macro_recalculate, get_macro_split, get_macropath
-from macro_grammar import macro_grammer_check
-from utility import MyException, ask_open_filename
-from variables import USER_VARIABLES
+from macro import (
+    check_macro_grammar,
+    get_macro,
+    get_macro_recalculate,
+    get_macro_split,
+    get_macropath,
+)
+from utility import MyException, ask_directory, ask_open_filename
+from variables import RUN_OPTIONS, USER_VARIABLES
 
 from log import set_user_log, setlog
 
 logger = getLogger(f"SSR.{__name__}")
 
 
-def main() -> None:
+class MainError(MyException):
+    """起動時の引数や設定ファイル関係のエラー"""
+
+
+def main(deffile: Optional[Path] = None, macrofile: Optional[Path] = None) -> None:
     """
     測定マクロを動かすための準備をするスクリプト
 
+    deffile, macrofileが指定されていなければダイアログで選択する
+
     実装としては
 
     定義ファイル選択
@@ -43,13 +53,13 @@ def main() -> None:
     measurementManager._measure_startを実行
     """
     # 定義ファイル読み取り
-    read_deffile()
+    read_deffile(deffile)
 
     # ユーザー側にlogファイル表示
     set_user_log(USER_VARIABLES.TEMPDIR)
 
     # マクロファイルのパスを取得
-    macropath, _, macrodir = get_macropath()
+    macropath, _, macrodir = get_macropath(macrofile)
 
     logger.info(f"macro: {macropath}")
     # scriptsフォルダーを検索パスに追加
@@ -65,7 +75,11 @@ def main() -> None:
     macro = get_macro(macropath)
 
     # マクロがSSRの文法規則を満たしているかチェック
-    macro_grammer_check(macro)
+    check_macro_grammar(macro)
+
+    # measurement_managerはマクロを選ぶまで使わないのでここで読み込む
+    # (起動してから最初のダイアログが出るまでの時間を短くするため)
+    import measurement_manager as mm
 
     # 強制終了時の処理を追加
     on_forced_termination(lambda: mm.finish())
@@ -83,6 +97,26 @@ def on_forced_termination(func: Callable[[None], None]) -> None:
         強制終了時に実行する関数
     """
 
+    if sys.platform != "win32":
+        # Windows以外ではSIGTERM(killなど)とSIGHUP(端末を閉じたとき)で終了処理をする
+        main_pid = os.getpid()
+
+        def signal_handler(signum, frame):
+            if os.getpid() != main_pid:
+                # forkで作られたプロセス(プロット画面など)は普通に終了させる
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+                return
+            logger.info("terminating measurement... 強制終了中...")
+            func()
+
+        signal.signal(signal.SIGTERM, signal_handler)
+        signal.signal(signal.SIGHUP, signal_handler)
+        return
+
+    import win32api
+    import win32con
+
     def consoleCtrHandler(ctrlType):
         """コマンドプロンプト上でイベントが発生したときに呼ばれる関数
 
@@ -106,16 +140,39 @@ def on_forced_termination(func: Callable[[None], None]) -> None:
 
 
 # 分割関数だけを呼び出し
-def split_only() -> None:
-    logger.info("分割マクロ選択...")
-    macroPath = ask_open_filename(
-        filetypes=[("pythonファイル", "*.py *.SSR")], title="分割マクロを選択してください"
-    )
+def split_only(
+    macrofile: Optional[Path] = None,
+    files: Optional[str] = None,
+    processes: Optional[int] = None,
+    deffile: Optional[Path] = None,
+) -> None:
+    """マクロのsplit関数だけを実行する
+
+    filesにフォルダかglobを指定すると, 当てはまる全てのファイルをまとめて並列に分割して
+    処理時間とエラーのレポートを作る (deffileを指定すると各プロセスで定義ファイルを読み込む)
+    """
+    if macrofile is None:
+        if RUN_OPTIONS.HEADLESS:
+            raise MainError("ヘッドレスモードではマクロを指定してください")
+        logger.info("分割マクロ選択...")
+        macroPath = ask_open_filename(
+            filetypes=[("pythonファイル", "*.py *.SSR")], title="分割マクロを選択してください"
+        )
+    else:
+        macroPath = Path(macrofile).absolute()
+    if files is not None:
+        files = str(Path(files).absolute())  # 相対パスはマクロのフォルダに移動する前の場所から
     sys.path.append(os.path.abspath(macroPath.parent))
     os.chdir(str(macroPath.parent))
 
     logger.info(f"macro: {macroPath.stem}")
 
+    if files is not None:
+        split_batch(macroPath, files, processes, deffile)
+        return
+    if RUN_OPTIONS.HEADLESS:
+        raise MainError("ヘッドレスモードでは分割するファイル(--files)を指定してください")
+
     def noop(address):  # ダミーの関数. こいつは何もしない
         return None
 
@@ -140,35 +197,175 @@ def split_only() -> None:
     target.split(filePath)
     # 画面が閉じないようにinputをいれておく
     logger.info("finish splitting ... ")
-    input()
+    if not RUN_OPTIONS.HEADLESS:
+        input()
+
+
+def split_batch(
+    macroPath: Path, files: str, processes: Optional[int] = None, deffile: Optional[Path] = None
+) -> None:
+    """filesに当てはまる全てのファイルをまとめて分割する"""
+    import batch
+
+    # マクロの読み込みとsplit関数の確認は先にここで1度しておく
+    get_macro_split(macroPath)
+    results, report_path = batch.split(macroPath, files, processes=processes, deffile=deffile)
+    failed = [str(r.path) for r in results if not r.ok]
+    if len(failed) > 0:
+        raise MainError(
+            f"{len(failed)}個のファイルの分割に失敗しました (詳しくは{report_path})\n" + "\n".join(failed)
+        )
+
+    logger.info("finish splitting ... ")
+    if not RUN_OPTIONS.HEADLESS:
+        input()
+
+
+def recalculate(
+    macrofile: Optional[Path] = None,
+    files: Optional[str] = None,
+    processes: Optional[int] = None,
+    force: bool = False,
+    deffile: Optional[Path] = None,
+) -> None:
+    """マクロのrecalculate関数をフォルダ(またはglob)のファイルにまとめて実行する
+
+    前回から変わっていないファイルは飛ばす(forceがTrueなら全て実行する)
+    deffileを指定すると各プロセスで定義ファイルを読み込む
+    """
+    import batch
+
+    if macrofile is None:
+        if RUN_OPTIONS.HEADLESS:
+            raise MainError("ヘッドレスモードではマクロを指定してください")
+        logger.info("再計算マクロ選択...")
+        macrofile = ask_open_filename(
+            filetypes=[("pythonファイル", "*.py *.SSR")], title="再計算マクロを選択してください"
+        )
+    macrofile = Path(macrofile).absolute()
+    # マクロの読み込みとrecalculate関数の確認は先にここで1度しておく
+    sys.path.append(str(macrofile.parent))
+    get_macro_recalculate(macrofile)
+    logger.info(f"macro: {macrofile.stem}")
+
+    if files is None:
+        if RUN_OPTIONS.HEADLESS:
+            raise MainError("ヘッドレスモードでは再計算するファイル(--files)を指定してください")
+        logger.info("再計算するフォルダ選択...")
+        files = ask_directory(title="再計算するフォルダを選択してください")
+
+    results = batch.recalculate(macrofile, files, processes=processes, force=force, deffile=deffile)
+    failed = [str(r.path) for r in results if not r.ok]
+    if len(failed) > 0:
+        raise MainError(f"{len(failed)}個のファイルの再計算に失敗しました\n" + "\n".join(failed))
+
+    logger.info("finish recalculating ... ")
+    if not RUN_OPTIONS.HEADLESS:
+        input()
 
 
 def setting() -> None:
     """変数のセット"""
     variables.init(Path.cwd())
 
-    # 簡易編集モードをOFFにするためのおまじない
-    # (簡易編集モードがONだと、画面をクリックしたときに処理が停止してしまう)
-    kernel32 = ctypes.windll.kernel32
-    # 簡易編集モードとENABLE_WINDOW_INPUT と ENABLE_VIRTUAL_TERMINAL_INPUT をOFFに
-    mode = 0xFDB7  # 16進数
-    kernel32.SetConsoleMode(kernel32.GetStdHandle(-10), mode)
+    if sys.platform == "win32" and not RUN_OPTIONS.HEADLESS:
+        import ctypes
+
+        # 簡易編集モードをOFFにするためのおまじない
+        # (簡易編集モードがONだと、画面をクリックしたときに処理が停止してしまう)
+        kernel32 = ctypes.windll.kernel32
+        # 簡易編集モードとENABLE_WINDOW_INPUT と ENABLE_VIRTUAL_TERMINAL_INPUT をOFFに
+        mode = 0xFDB7  # 16進数
+        kernel32.SetConsoleMode(kernel32.GetStdHandle(-10), mode)
 
     setlog()
 
 
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    """起動時の引数を読み取る
+
+    --configで設定ファイル(JSON)を指定した場合は, そこに書かれた値を既定値とする
+    (引数で指定した値の方が優先される)
+
+    設定ファイルの例
+    {"mode": "MEAS", "def": "C:/SSR/user.def", "macro": "C:/SSR/macro/IV.py",
+     "output": "sample1.txt", "no_plot": true, "headless": true}
+    """
+    parser = argparse.ArgumentParser(description="SSR")
+    parser.add_argument("mode", nargs="?", default=None, help="MEAS, SPLIT or RECALC")
+    parser.add_argument("--def", dest="deffile", type=Path, help="定義ファイル")
+    parser.add_argument("--macro", type=Path, help="マクロファイル")
+    parser.add_argument("--output", type=Path, help="データを保存するファイル")
+    parser.add_argument(
+        "--no-plot", action="store_true", default=None, help="プロット画面を出さない"
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        default=None,
+        help="ダイアログや入力待ちを出さずに動かす",
+    )
+    parser.add_argument("--files", help="まとめて処理するファイルのフォルダかglob")
+    parser.add_argument("--processes", type=int, help="まとめて処理するときのプロセス数")
+    parser.add_argument(
+        "--force", action="store_true", default=None, help="変わっていないファイルも再計算する"
+    )
+    parser.add_argument("--config", type=Path, help="設定ファイル(JSON)")
+    args = parser.parse_args(argv)
+
+    config = {}
+    if args.config is not None:
+        try:
+            config = json.loads(args.config.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            raise MainError(f"設定ファイル{args.config}が読み込めません: {e}")
+
+    def pick(name, key, convert=lambda x: x):
+        value = getattr(args, name)
+        if value is None and config.get(key) is not None:
+            value = convert(config[key])
+        return value
+
+    args.mode = pick("mode", "mode")
+    args.deffile = pick("deffile", "def", Path)
+    args.macro = pick("macro", "macro", Path)
+    args.output = pick("output", "output", Path)
+    args.files = pick("files", "files")
+    args.processes = pick("processes", "processes", int)
+    args.force = bool(pick("force", "force"))
+    args.no_plot = bool(pick("no_plot", "no_plot"))
+    args.headless = bool(pick("headless", "headless"))
+    return args
+
+
+def apply_args(args: argparse.Namespace) -> None:
+    """引数をRUN_OPTIONSに反映させる"""
+    RUN_OPTIONS.HEADLESS = args.headless
+    RUN_OPTIONS.OUTPUT = args.output
+    RUN_OPTIONS.NO_PLOT = args.no_plot
+
+
 if __name__ == "__main__":
+    try:
+        args = parse_args()
+    except MyException as e:
+        print(e.message)
+        sys.exit(1)
+    apply_args(args)
+
     setting()
 
-    mode: str = ""
-    args = sys.argv
-    if len(args) > 1:
-        mode = args[1].upper()
+    mode: str = "" if args.mode is None else args.mode.upper()
 
-    # 引数によって測定モードか分割モードかを判定
+    # 引数によって測定モードか分割モードか再計算モードかを判定
     while True:
-        if mode in ["MEAS", "SPLIT"]:
+        if mode == "RECALCULATE":
+            mode = "RECALC"
+        if mode in ["MEAS", "SPLIT", "RECALC"]:
             break
+        if RUN_OPTIONS.HEADLESS:
+            print("ヘッドレスモードではモード(MEAS, SPLIT or RECALC)を指定してください")
+            sys.exit(1)
         mode = input("mode is > ").upper()
 
     logger.debug("---------------------------------------------------------------")
@@ -176,13 +373,18 @@ if __name__ == "__main__":
     # 処理を開始
     try:
         if mode == "MEAS":
-            main()
+            main(args.deffile, args.macro)
         elif mode == "SPLIT":
-            split_only()
+            split_only(args.macro, args.files, args.processes, args.deffile)
+        elif mode == "RECALC":
+            recalculate(args.macro, args.files, args.processes, args.force, args.deffile)
     # エラーは全てここでキャッチ
     except MyException as e:
         print("*****************Error*****************")
         print(e.message)  # MyExceptionならメッセージだけを表示
+        if RUN_OPTIONS.HEADLESS:  # ヘッドレスモードでは入力を待たずに終了コード1で終わる
+            logger.exception("")
+            sys.exit(1)
         input("*****************Error*****************")
         print("↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓詳細↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓")
         logger.exception("")
@@ -190,5 +392,7 @@ if __name__ == "__main__":
     except Exception as e:
         print("*****************Error*****************")
         logger.exception("")
+        if RUN_OPTIONS.HEADLESS:
+            sys.exit(1)
         # コンソールウィンドウが落ちないように入力待ちを入れる
         input("*****************Error*****************")
@@ -1,13 +1,88 @@
 from __future__ import annotations
 
 import re
-import textwrap
+from operator import attrgetter
 from typing import Any
 
 from utility import MyException
 
+_DEFINITION_ERROR_TEXT = (
+    'を継承したクラスの変数は、{変数名}:"[{単位}]"の形にしてください \n 例) voltage:"[mV]"  \n     loopnumber:"" (単位がないときは "" をつける)'
+)
 
-class BaseData:
+_POSITIONAL_ERROR_TEXT = (
+    "【Dataクラス(BaseDataを継承したクラス)のエラー】\n"
+    + "インスタンスを作成する際はData('変数名1'='値1','変数名2'='値2')のような形で入れてください\n"
+    + "Data('値1','値2')のような書き方はだめです"
+)
+
+_KEYWORD_ERROR_TEXT = (
+    "【Dataクラス(BaseDataを継承したクラス)のエラー】\n"
+    + "マクロ内でDataクラスを定義したときに決めた変数と\n"
+    + "インスタンスを作成するときに入力した変数が異なっています。\n"
+    + "例えば、\n\n"
+    + "class Data(BaseData):\n"
+    + "    '変数1': \"['単位']\"\n"
+    + "    '変数2': \"['単位']\"\n"
+    + "    '変数3': \"['単位']\"\n\n"
+    + "とDataクラスを定義したのなら、\n\n"
+    + "data = Data('変数1'='値1','変数2'='値2','変数3'='値3')\n\n"
+    + "としなければいけません。\n"
+    + "最初に定義していない変数名を入れたり(例：data = Data('変数4'='値4'))、\n"
+    + "最初に定義した変数を入れないのはだめです(例：data = Data('変数1'='値1','変数2'='値2'))"
+)
+
+
+class _Missing:
+    """コンストラクタで値が入力されなかったことを表す"""
+
+    def __repr__(self) -> str:
+        return "<missing>"
+
+
+_MISSING = _Missing()
+
+
+class _BaseDataMeta(type):
+    """BaseDataを継承したクラスを作るときに, 変数の定義を確認して__slots__を追加する
+
+    __slots__はクラスを作る前に決めておく必要があるので__init_subclass__ではなくここで行う
+    """
+
+    def __new__(mcls, name: str, bases: tuple, namespace: dict, **kwargs):
+        if not any(isinstance(base, _BaseDataMeta) for base in bases):  # BaseData自身
+            return super().__new__(mcls, name, bases, namespace, **kwargs)
+
+        error = BaseData.BaseDataError
+        base_name = bases[0].__name__
+        annotations = namespace.get("__annotations__", {})
+        # 変数名を取得
+        variables = [v for v in namespace.keys() if not re.fullmatch("__.*__", v)]
+
+        # 全ての変数にアノテーションがついてなければエラー
+        for v in variables:
+            if v not in annotations.keys():
+                raise error(
+                    f"{name}クラスの変数{v}の定義方法にエラーが発生しています. \n "
+                    f"{base_name}" + _DEFINITION_ERROR_TEXT
+                )
+        # アノテーションが文字列でなければエラー
+        for var, anot in annotations.items():
+            if type(anot) is not str:
+                raise error(
+                    f"{name}クラスの変数{var}の定義方法にエラーが発生しています. \n "
+                    f"{base_name}" + _DEFINITION_ERROR_TEXT
+                )
+            if var in namespace.keys():
+                raise error(
+                    f"{name}クラスの変数定義の方法にエラーが存在します。\nBaseDataを継承したクラスではデフォルト値を設定することはできません。"
+                )
+
+        namespace["__slots__"] = tuple(annotations.keys())
+        return super().__new__(mcls, name, bases, namespace, **kwargs)
+
+
+class BaseData(metaclass=_BaseDataMeta):
     """ユーザーマクロで使えるデータを保持するクラス
 
     利点としては
@@ -16,113 +91,74 @@ class BaseData:
     2. ラベル化の際に単位の情報も載せられる(単位はインスタンス変数と同名のクラス変数に格納)
     3. iterableなのでsave関数にそのまま渡せば展開される
     4. 自動的にdataclassになるので、コンストラクタが自動生成される
+    5. __slots__を使うので, インスタンスの作成が速くメモリも少なくて済む
 
-
+    変数の確認はクラスを作ったときに一度だけ行う
     """
 
     class BaseDataError(MyException):
         """データを保持するクラス関係のえらー"""
 
+    __slots__ = ()
+    _fields: tuple[str, ...] = ()  # 変数名(定義した順)
+    _get_values = staticmethod(lambda self: ())  # 変数の値のタプルを返す関数
+
     def __setattr__(
         self, __name: str, __value: Any
     ) -> None:  # 要素に代入するとき(例 data.time = 100)に呼ばれる関数
         """あとから要素を追加するのを阻止"""
-
-        if (
-            __name in self.__class__.__dict__.get("__annotations__").keys()
-        ):  # すでに存在する変数への代入ならば許可
-            super().__setattr__(__name, __value)
-        else:  # 新しい変数への代入ならば不許可
+        try:
+            object.__setattr__(self, __name, __value)
+        except AttributeError:  # __slots__にない変数への代入は不許可
             raise self.BaseDataError(
                 f"{__name}は{self.__class__.__name__}に最初に定義された変数に含まれていません。\n 使用する変数は宣言時に定義しておいてください"
-            )
+            ) from None
 
     def __init_subclass__(cls, **kwargs) -> None:
         """このクラスを継承したクラスが作られたときに呼ばれる"""
-        attrs = cls.__dict__
-        annotations = attrs.get("__annotations__")  # 型ヒントの付いた変数を取得
-        # 変数名を取得
-        variables = dict(
-            filter(
-                lambda item: not re.fullmatch("__.*__", item[0]), cls.__dict__.items()
-            )
-        )
-
-        # 全ての変数にアノテーションがついてなければエラー
-        for v in variables.keys():
-            if (annotations is None) or (v not in annotations.keys()):
-                raise cls.BaseDataError(
-                    f"{cls.__name__}クラスの変数{v}の定義方法にエラーが発生しています. \n "
-                    f"{cls.__base__.__name__}"
-                    'を継承したクラスの変数は、{変数名}:"[{単位}]"の形にしてください \n 例) voltage:"[mV]"  \n     loopnumber:"" (単位がないときは "" をつける)'
-                )
-        # アノテーションが文字列でなければエラー
-        for var, anot in annotations.items():
-            if type(anot) is not str:
-                raise cls.BaseDataError(
-                    f"{cls.__name__}クラスの変数{var}の定義方法にエラーが発生しています. \n "
-                    f"{cls.__base__.__name__}"
-                    'を継承したクラスの変数は、{変数名}:"[{単位}]"の形にしてください \n 例) voltage:"[mV]"  \n     loopnumber:"" (単位がないときは "" をつける)'
-                )
+        fields = cls.__slots__
+        cls._fields = fields
+        if len(fields) == 1:
+            getter = attrgetter(fields[0])
+            cls._get_values = staticmethod(lambda self: (getter(self),))
+        elif len(fields) > 1:
+            cls._get_values = staticmethod(attrgetter(*fields))
 
         # コンストラクタが定義されてなければ自動的に定義
         cls.auto_create_initfunc = "__init__" not in cls.__dict__.keys()
         if cls.auto_create_initfunc:
-            parameter_text = ""
-            assign_text = ""
-            default = False
-            for parameter_name in annotations.keys():
-                if cls.__dict__.get(parameter_name) is None:
-                    parameter_text += f"{parameter_name},"
-                else:
-                    raise cls.BaseDataError(
-                        f"{cls.__name__}クラスの変数定義の方法にエラーが存在します。\nBaseDataを継承したクラスではデフォルト値を設定することはできません。"
-                    )
-
-                assign_text += f"self.{parameter_name}={parameter_name};"
+            cls.__init__ = cls._create_initfunc()
 
-            parameter_text = parameter_text[:-1]
-
-            init_text = f"""
-            def __init__(self,{parameter_text}):
-                {assign_text}
-                
-
-            cls.__init__ = __init__
+        return super().__init_subclass__(**kwargs)  # これはおまじない
 
-            """
-            init_text = textwrap.dedent(init_text)
-            exec(init_text)  # 文字列で書いたコードを実行
+    @classmethod
+    def _create_initfunc(cls):
+        """コンストラクタを作る
 
-        return super().__init_subclass__(**kwargs)  # これはおまじない
+        引数は全てキーワード専用で, 入力されなかった引数は_MISSINGになる
+        代入は__slots__のディスクリプタを直接呼んで__setattr__を通さない
+        変数名(argsやselfなど)とぶつからないように, 変数以外の名前には__ssr_をつける
+        """
+        parameters = "".join(f"{f}=__ssr_missing," for f in cls._fields)
+        checks = " or ".join(f"{f} is __ssr_missing" for f in cls._fields) or "False"
+        assigns = "".join(f"    __ssr_set_{f}(__ssr_self, {f})\n" for f in cls._fields)
+        init_text = (
+            f"def __init__(__ssr_self, *__ssr_args, {parameters} **__ssr_kwargs):\n"
+            f"    if __ssr_args or __ssr_kwargs or {checks}:\n"
+            f"        __ssr_init_error(__ssr_args)\n"
+            f"{assigns}"
+        )
 
-    def __new__(cls, *args, **keywards):
-        if cls.auto_create_initfunc:
+        def _init_error(args):
             if len(args) > 0:
-                raise cls.BaseDataError(
-                    "【Dataクラス(BaseDataを継承したクラス)のエラー】\n"
-                    + "インスタンスを作成する際はData('変数名1'='値1','変数名2'='値2')のような形で入れてください\n"
-                    + "Data('値1','値2')のような書き方はだめです"
-                )
-            attrs = cls.__dict__
-            annotations = attrs.get("__annotations__")  # 型ヒントの付いた変数を取得
-            if set(annotations.keys()) != set(keywards.keys()):
-                raise cls.BaseDataError(
-                    "【Dataクラス(BaseDataを継承したクラス)のエラー】\n"
-                    + "マクロ内でDataクラスを定義したときに決めた変数と\n"
-                    + "インスタンスを作成するときに入力した変数が異なっています。\n"
-                    + "例えば、\n\n"
-                    + "class Data(BaseData):\n"
-                    + "    '変数1': \"['単位']\"\n"
-                    + "    '変数2': \"['単位']\"\n"
-                    + "    '変数3': \"['単位']\"\n\n"
-                    + "とDataクラスを定義したのなら、\n\n"
-                    + "data = Data('変数1'='値1','変数2'='値2','変数3'='値3')\n\n"
-                    + "としなければいけません。\n"
-                    + "最初に定義していない変数名を入れたり(例：data = Data('変数4'='値4'))、\n"
-                    + "最初に定義した変数を入れないのはだめです(例：data = Data('変数1'='値1','変数2'='値2'))"
-                )
-        return super().__new__(cls)
+                raise cls.BaseDataError(_POSITIONAL_ERROR_TEXT)
+            raise cls.BaseDataError(_KEYWORD_ERROR_TEXT)
+
+        namespace = {"__ssr_missing": _MISSING, "__ssr_init_error": _init_error}
+        for f in cls._fields:
+            namespace[f"__ssr_set_{f}"] = cls.__dict__[f].__set__
+        exec(init_text, namespace)  # 文字列で書いたコードを実行
+        return namespace["__init__"]
 
     @classmethod
     def to_label(cls):
@@ -137,7 +173,7 @@ class BaseData:
         """変数名の文字列を返す"""
 
         annotations = cls.__dict__.get(
-            "__annotations__"
+            "__annotations__", {}
         )  # クラスから、アノテーションがついた変数の配列を取得
         text = ""
         index = 0
@@ -147,9 +183,18 @@ class BaseData:
         text = text[:-1]  # 最後の"\t"は消しておく
         return text
 
+    def _values(self) -> tuple:
+        """変数の値のタプル(値が入っていない変数は飛ばす)"""
+        try:
+            return self._get_values(self)
+        except AttributeError:  # コンストラクタを自分で書いて値を入れていない変数がある
+            return tuple(
+                getattr(self, f) for f in self._fields if hasattr(self, f)
+            )
+
     def __iter__(self):
         """配列として扱えるようにするための関数"""  # for文のinの後ろにつけたときなどに呼ばれる
-        yield from list(self.__dict__.values())  # 変数をリストにして返す
+        return iter(self._values())  # 変数をタプルにして返す
 
     def __str__(self) -> str:  # str(data)のときに呼ばれる関数
-        return ",".join([str(s) for s in self.__dict__.values()])
+        return ",".join(map(str, self._values()))
@@ -0,0 +1,402 @@
+"""
+マクロの関数(recalculateなど)をたくさんのデータファイルにまとめて実行する
+
+ファイルごとに別のプロセスで並列に実行するので, CPUのコアを全部使える
+あるファイルでエラーが起きても他のファイルの処理は続ける
+
+再計算(recalculate)では処理したファイルをフォルダごとのマニフェスト(.ssr_recalc.json)に記録して,
+前回から変わっていないファイルは飛ばす
+分割(split)では処理時間とエラーをまとめたレポートを作る
+"""
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from logging import getLogger
+from pathlib import Path
+from typing import Callable, Iterable, List, NamedTuple, Optional, Union
+
+from utility import MyException, get_date_text
+from variables import SHARED_VARIABLES
+
+logger = getLogger(f"SSR.{__name__}")
+
+MANIFEST_NAME = ".ssr_recalc.json"
+
+
+class BatchError(MyException):
+    """まとめて処理するとき関係のエラー"""
+
+
+class BatchResult(NamedTuple):
+    """1つのファイルの処理結果
+
+    Attributes
+    ----------
+    path: Path
+        処理したファイル
+    ok: bool
+        エラーなく終わったかどうか
+    elapsed: float
+        かかった時間[s]
+    error: str
+        エラーの内容(トレースバック). エラーがなければ""
+    outputs: tuple[str, ...]
+        マクロの関数が返した出力ファイル
+    """
+
+    path: Path
+    ok: bool
+    elapsed: float
+    error: str = ""
+    outputs: tuple = ()
+
+
+def find_files(target: Union[str, Path], pattern: str = "*.txt") -> List[Path]:
+    """処理するファイルを探す
+
+    Parameters
+    ----------
+    target: Union[str, Path]
+        フォルダならその中のpatternに合うファイル, それ以外はglob (例 "data/**/*.txt")
+    pattern: str
+        targetがフォルダのときに使うパターン
+    """
+    target = Path(target)
+    if target.is_dir():
+        files = target.glob(pattern)
+    elif target.is_file():
+        files = [target]
+    else:
+        files = (Path(f) for f in glob.glob(str(target), recursive=True))
+    # 先頭にアンダーバーがつくファイル(分割でできたファイルなど)は除く
+    files = sorted(f.absolute() for f in files if f.is_file() and not f.name.startswith("_"))
+    if len(files) == 0:
+        raise BatchError(f"{target}に処理するファイルがありません")
+    return files
+
+
+# ---- ワーカープロセス側 ----
+
+_worker_function: Optional[Callable] = None
+
+
+def _init_worker(
+    macropath: str, function_name: str, home: Optional[str] = None, deffile: Optional[str] = None
+) -> None:
+    """ワーカープロセスの最初に1度だけ呼ばれて, SSRの変数とログを設定してマクロを読み込む
+
+    spawnで起動したプロセス(Windows)は親プロセスの変数を引き継がないので, ここで設定し直す
+    """
+    global _worker_function
+    from macro import get_macro_recalculate, get_macro_split
+
+    if home is not None and _get_home() is None:  # forkしたプロセスは親プロセスの設定をそのまま使う
+        import variables
+        from log import setlog
+
+        variables.init(Path(home))
+        setlog()
+    if deffile is not None:
+        from define import read_deffile
+
+        read_deffile(Path(deffile))
+
+    macropath = Path(macropath)
+    sys.path.append(str(macropath.parent))
+    os.chdir(str(macropath.parent))
+    if function_name == "recalculate":
+        target = get_macro_recalculate(macropath)
+    else:
+        target = get_macro_split(macropath)
+    _worker_function = getattr(target, function_name)
+
+
+def _run_one(path: Path) -> BatchResult:
+    """1つのファイルを処理する. エラーは結果に詰めて返す"""
+    start = time.perf_counter()
+    try:
+        outputs = _worker_function(path)
+    except BaseException:  # どんなエラーでも他のファイルの処理は続ける
+        return BatchResult(path, False, time.perf_counter() - start, traceback.format_exc())
+    return BatchResult(path, True, time.perf_counter() - start, "", _to_outputs(outputs))
+
+
+def _to_outputs(outputs) -> tuple:
+    """マクロの関数の返り値を出力ファイルのタプルにする"""
+    if outputs is None:
+        return ()
+    if isinstance(outputs, (str, os.PathLike)):
+        outputs = [outputs]
+    try:
+        return tuple(str(Path(o).absolute()) for o in outputs)
+    except TypeError:  # パス以外を返したときは無視
+        return ()
+
+
+# ---- 親プロセス側 ----
+
+
+def _get_home() -> Optional[Path]:
+    """SSRのフォルダ. まだ設定されていなければNone"""
+    try:
+        return SHARED_VARIABLES.SSR_HOMEDIR
+    except ValueError:
+        return None
+
+
+def run_batch(
+    macropath: Path,
+    function_name: str,
+    files: Iterable[Path],
+    processes: Optional[int] = None,
+    on_result: Optional[Callable[[BatchResult], None]] = None,
+    deffile: Optional[Path] = None,
+    mp_context=None,
+) -> List[BatchResult]:
+    """マクロのfunction_name関数をfilesに並列で実行する
+
+    Parameters
+    ----------
+    macropath: Path
+        マクロのパス
+    function_name: str
+        "recalculate" か "split"
+    files: Iterable[Path]
+        処理するファイル
+    processes: Optional[int]
+        プロセスの数. Noneならコアの数
+    on_result: Optional[Callable[[BatchResult], None]]
+        1つのファイルの処理が終わるごとに呼ばれる
+    deffile: Optional[Path]
+        ワーカープロセスで読み込む定義ファイル. Noneなら読み込まない
+    mp_context: Optional[multiprocessing.context.BaseContext]
+        ワーカープロセスの起動方法 (multiprocessing.get_context("spawn")など). Noneなら既定
+    """
+    files = list(files)
+    results = []
+    if len(files) == 0:
+        return results
+
+    processes = min(processes or os.cpu_count() or 1, len(files))
+    home = _get_home()
+    initargs = (
+        str(Path(macropath).absolute()),
+        function_name,
+        None if home is None else str(home),
+        None if deffile is None else str(Path(deffile).absolute()),
+    )
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=mp_context, initializer=_init_worker, initargs=initargs
+    ) as executor:
+        futures = {}
+        for f in files:
+            try:
+                futures[executor.submit(_run_one, f)] = f
+            except BrokenProcessPool as e:  # 既にワーカープロセスが落ちている
+                results.append(BatchResult(f, False, 0.0, f"{type(e).__name__}: {e}"))
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:  # ワーカープロセスが落ちた(メモリ不足など). 終わったファイルの結果は残す
+                result = BatchResult(futures[future], False, 0.0, f"{type(e).__name__}: {e}")
+            results.append(result)
+            _log_progress(result, len(results), len(files), time.perf_counter() - start)
+            if on_result is not None:
+                on_result(result)
+
+    # 渡されたファイルの順に並べ直す
+    order = {f: i for i, f in enumerate(files)}
+    results.sort(key=lambda r: order[r.path])
+    return results
+
+
+def _log_progress(result: BatchResult, done: int, total: int, elapsed: float) -> None:
+    """進捗をログに出す"""
+    remaining = elapsed / done * (total - done)
+    status = "ok" if result.ok else "ERROR"
+    logger.info(
+        f"[{done}/{total}] {status} {result.path.name} ({result.elapsed:.2f} s) 残り約{remaining:.0f} s"
+    )
+    if not result.ok:
+        logger.error(result.error)
+
+
+class RecalcManifest:
+    """再計算したファイルの記録 (フォルダごとに1つ)
+
+    ファイル名ごとに, 再計算したときの入力ファイルの更新日時・サイズ,
+    マクロのハッシュ値, 出力ファイルを記録する
+    """
+
+    def __init__(self, folder: Path) -> None:
+        self.path = Path(folder) / MANIFEST_NAME
+        try:
+            self.records = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.records = {}
+
+    def outputs(self) -> set:
+        """記録されている出力ファイル"""
+        return {o for record in self.records.values() for o in record.get("outputs", [])}
+
+    def is_up_to_date(self, path: Path, macro_hash: str) -> bool:
+        """前回の再計算から入力ファイルもマクロも変わっておらず, 出力ファイルが入力より新しいか"""
+        record = self.records.get(path.name)
+        if record is None or record.get("macro") != macro_hash:
+            return False
+        stat = path.stat()
+        if record.get("mtime_ns") != stat.st_mtime_ns or record.get("size") != stat.st_size:
+            return False
+        for output in record.get("outputs", []):
+            output = Path(output)
+            if not output.is_file() or output.stat().st_mtime_ns < stat.st_mtime_ns:
+                return False
+        return True
+
+    def update(self, result: BatchResult, macro_hash: str) -> None:
+        stat = result.path.stat()
+        self.records[result.path.name] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "macro": macro_hash,
+            "outputs": list(result.outputs),
+        }
+
+    def save(self) -> None:
+        self.path.write_text(json.dumps(self.records, indent=1, ensure_ascii=False), encoding="utf-8")
+
+
+def get_macro_hash(macropath: Path) -> str:
+    """マクロの中身のハッシュ値 (マクロを書き換えたら全て再計算するため)"""
+    return hashlib.sha256(Path(macropath).read_bytes()).hexdigest()
+
+
+def recalculate(
+    macropath: Path,
+    target: Union[str, Path],
+    processes: Optional[int] = None,
+    force: bool = False,
+    deffile: Optional[Path] = None,
+) -> List[BatchResult]:
+    """マクロのrecalculate関数をtargetのファイルにまとめて実行する
+
+    recalculate関数が出力ファイルのパス(またはそのリスト)を返すと,
+    次回からは出力ファイルが入力ファイルより新しいときに飛ばす
+
+    Parameters
+    ----------
+    macropath: Path
+        マクロのパス
+    target: Union[str, Path]
+        フォルダかglob
+    processes: Optional[int]
+        プロセスの数. Noneならコアの数
+    force: bool
+        Trueなら前回から変わっていないファイルも再計算する
+    deffile: Optional[Path]
+        ワーカープロセスで読み込む定義ファイル. Noneなら読み込まない
+    """
+    macro_hash = get_macro_hash(macropath)
+    files = find_files(target)
+
+    manifests = {}
+    for folder in {f.parent for f in files}:
+        manifests[folder] = RecalcManifest(folder)
+    # 前回の再計算で出力されたファイルは入力にしない
+    outputs = set().union(*(m.outputs() for m in manifests.values()))
+    files = [f for f in files if str(f) not in outputs]
+
+    if force:
+        todo = files
+    else:
+        todo = [f for f in files if not manifests[f.parent].is_up_to_date(f, macro_hash)]
+    logger.info(f"recalculate: {len(todo)} files ({len(files) - len(todo)} files are up to date)")
+
+    def record(result: BatchResult) -> None:
+        # 途中で止まっても(Ctrl-Cなど)終わったファイルは次回飛ばせるように, 1つ終わるごとに保存する
+        if result.ok:
+            manifest = manifests[result.path.parent]
+            manifest.update(result, macro_hash)
+            manifest.save()
+
+    results = run_batch(macropath, "recalculate", todo, processes, on_result=record, deffile=deffile)
+    for manifest in manifests.values():
+        manifest.save()
+
+    failed = [r for r in results if not r.ok]
+    logger.info(f"finish recalculating: {len(results) - len(failed)} succeeded, {len(failed)} failed")
+    return results
+
+
+def split(
+    macropath: Path,
+    target: Union[str, Path],
+    processes: Optional[int] = None,
+    report_path: Optional[Path] = None,
+    deffile: Optional[Path] = None,
+) -> tuple[List[BatchResult], Path]:
+    """マクロのsplit関数をtargetのファイルにまとめて実行して, レポートを作る
+
+    Parameters
+    ----------
+    macropath: Path
+        マクロのパス
+    target: Union[str, Path]
+        フォルダかglob
+    processes: Optional[int]
+        プロセスの数. Noneならコアの数
+    report_path: Optional[Path]
+        レポートのパス. Noneなら最初のファイルのフォルダに_split_report_{日付}.txtを作る
+    deffile: Optional[Path]
+        ワーカープロセスで読み込む定義ファイル. Noneなら読み込まない
+
+    Returns
+    -------
+    results: List[BatchResult]
+        ファイルごとの結果
+    report_path: Path
+        レポートのパス
+    """
+    files = find_files(target)
+    logger.info(f"split: {len(files)} files")
+
+    start = time.perf_counter()
+    results = run_batch(macropath, "split", files, processes, deffile=deffile)
+    elapsed = time.perf_counter() - start
+
+    if report_path is None:
+        report_path = files[0].parent / f"_split_report_{get_date_text()}.txt"
+    write_report(report_path, macropath, results, elapsed)
+
+    failed = [r for r in results if not r.ok]
+    logger.info(f"finish splitting: {len(results) - len(failed)} succeeded, {len(failed)} failed")
+    logger.info(f"report: {report_path}")
+    return results, Path(report_path)
+
+
+def write_report(
+    report_path: Path, macropath: Path, results: List[BatchResult], elapsed: float
+) -> None:
+    """処理時間とエラーのレポートを書く"""
+    failed = [r for r in results if not r.ok]
+    lines = [
+        f"macro: {Path(macropath).absolute()}",
+        f"files: {len(results)}  succeeded: {len(results) - len(failed)}  failed: {len(failed)}",
+        f"total: {elapsed:.2f} s",
+        "",
+        "status\ttime[s]\tfile",
+    ]
+    for r in results:
+        lines.append(f"{'ok' if r.ok else 'ERROR'}\t{r.elapsed:.3f}\t{r.path}")
+    for r in failed:
+        lines += ["", f"---- {r.path} ----", r.error.rstrip()]
+    Path(report_path).write_text("\n".join(lines) + "\n", encoding="utf-8")
@@ -9,7 +9,6 @@ from logging import getLogger
 from pathlib import Path
 from typing import Callable, Optional
 
-from scipy import interpolate
 from utility import MyException, get_encode_type
 from variables import SHARED_VARIABLES
 
@@ -38,6 +37,7 @@ class TMRCalibrationManager:
 
     calib_file_name: str
     interpolate_func: Optional[Callable[[float], float]] = None  # 変換の関数
+    _calib_table: Optional[tuple] = None  # キャリブレーションファイルの(抵抗値, 温度)
 
     def set_shared_calib_file(self) -> None:
         """キャリブレーションファイルを共有フォルダから取得してインスタンスにセット"""
@@ -123,9 +123,12 @@ class TMRCalibrationManager:
                 except Exception:
                     pass
 
+        self._calib_table = (x, y)
         self.calib_file_name = filepath_calib.parts[1]
         logger.info("calibration : %s", str(filepath_calib))
 
+        from scipy import interpolate  # SciPyは読み込みが重いので使うときに読み込む
+
         self.interpolate_func = interpolate.interp1d(
             x, y, bounds_error=False, fill_value="extrapolate"
         )  # 線形補間関数定義
@@ -143,3 +146,18 @@ class TMRCalibrationManager:
         except Exception as e:
             raise CalibrationError("予期せぬエラーが発生しました") from e
         return y
+
+    @property
+    def table(self):
+        """抵抗値の小さい順に並べた(抵抗値, 温度)の配列
+
+        conversion.ConversionChainに渡すと他の変換とまとめられる
+        """
+        if self._calib_table is None:
+            raise CalibrationError("キャリブレーションファイルが読み込まれていない可能性があります")
+        from conversion import ConverterError, sort_table
+
+        try:
+            return sort_table(*self._calib_table)
+        except ConverterError as e:
+            raise CalibrationError(f"キャリブレーションファイルの中身が不正です: {e}") from e
@@ -0,0 +1,129 @@
+"""
+コンソールからの入力を扱う
+
+Windowsではmsvcrt, それ以外(Linuxなど)ではselectを使って入力があるかどうかを調べる
+どちらも入力が来たらすぐに戻るので, 一定時間ごとに入力を調べる(ポーリングする)必要はない
+"""
+import os
+import sys
+import time
+from logging import getLogger
+from typing import Optional, TextIO
+
+logger = getLogger(f"SSR.{__name__}")
+
+
+class WindowsConsoleBackend:
+    """msvcrtを使ってコンソールの入力を調べる"""
+
+    POLLING_INTERVAL = 0.02  # msvcrtには入力を待つ関数がないので短い間隔で調べる
+
+    def __init__(self) -> None:
+        import msvcrt
+
+        self._msvcrt = msvcrt
+
+    def wait_input(self, timeout: Optional[float] = None) -> bool:
+        """入力が来るまで最大timeout秒待つ. 入力があればTrue"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._msvcrt.kbhit():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.POLLING_INTERVAL)
+        return True
+
+    def read_line(self) -> str:
+        """1行読む. 標準入力が閉じられていればEOFError"""
+        return input()
+
+    def flush(self) -> None:
+        """既に入っている入力を捨てる"""
+        while self._msvcrt.kbhit():
+            self._msvcrt.getwch()
+
+
+class PosixConsoleBackend:
+    """selectを使ってコンソール(標準入力)の入力を調べる
+
+    sys.stdinのバッファに溜まった入力はselectでは分からないので, ファイルディスクリプタから直接読む.
+    改行より後は読まずに残すので, 続きの入力は後からinput()などでも読める
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        self._stream = stream
+
+    @property
+    def stream(self) -> TextIO:
+        return self._stream if self._stream is not None else sys.stdin
+
+    def wait_input(self, timeout: Optional[float] = None) -> bool:
+        """入力が来るまで最大timeout秒待つ. 入力があればTrue"""
+        import select
+
+        try:
+            readable, _, _ = select.select([self.stream], [], [], timeout)
+        except (ValueError, OSError):  # 標準入力が閉じられている
+            return False
+        return len(readable) > 0
+
+    def read_line(self) -> str:
+        """1行読む(改行は含まない). 標準入力が閉じられていればEOFError"""
+        fd = self.stream.fileno()
+        line = bytearray()
+        while True:
+            byte = os.read(fd, 1)  # 改行より後を読んでしまわないように1バイトずつ読む
+            if byte == b"":
+                if len(line) == 0:
+                    raise EOFError()
+                break
+            if byte == b"\n":
+                break
+            line += byte
+        encoding = getattr(self.stream, "encoding", None) or "utf-8"
+        return line.decode(encoding, errors="replace").rstrip("\r")
+
+    def flush(self) -> None:
+        """既に入っている入力を捨てる
+
+        端末から入力しているときだけ捨てる(パイプなどから流し込んだ入力は捨てない)
+        """
+        try:
+            if not self.stream.isatty():
+                return
+            import termios
+
+            termios.tcflush(self.stream.fileno(), termios.TCIFLUSH)
+        except (ValueError, OSError):
+            pass
+
+
+def get_backend():
+    """実行環境に合ったバックエンドを返す"""
+    if sys.platform == "win32":
+        return WindowsConsoleBackend()
+    return PosixConsoleBackend()
+
+
+_backend = None
+
+
+def _get_default_backend():
+    global _backend
+    if _backend is None:
+        _backend = get_backend()
+    return _backend
+
+
+def wait_input(timeout: Optional[float] = None) -> bool:
+    """コンソールに入力が来るまで最大timeout秒待つ. 入力があればTrue"""
+    return _get_default_backend().wait_input(timeout)
+
+
+def read_line() -> str:
+    """コンソールから1行読む. 標準入力が閉じられていればEOFError"""
+    return _get_default_backend().read_line()
+
+
+def flush_input() -> None:
+    """コンソールに既に入っている入力を捨てる"""
+    _get_default_backend().flush()
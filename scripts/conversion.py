@@ -2,12 +2,23 @@
 x-yのデータ表をもとに変換グラフを作って
 
 新しいxのデータを変換表に合わせて変換する
+
+いくつかの変換表や関数をつなげた変換(抵抗値→温度→ステージ温度の補正 など)は
+ConversionChainで1つの変換表にまとめられる
+
+使用例
+
+chain = ConversionChain()
+chain.add_file("JPT100JIS.dat", skiprows=1, delimiter="\t", x_column=1, y_column=0)  # 抵抗値→温度
+chain.add(calibration_manager)                                                     # 温度の補正
+converter = chain.compile()
+temperature = converter.convert(resistance)  # 配列をまとめて変換できる
 """
 
 from logging import getLogger
+from typing import Callable, Optional, Union
 
 import numpy as np
-from scipy import interpolate
 from utility import MyException, get_encode_type
 
 logger = getLogger(f"SSR.{__name__}")
@@ -19,6 +30,7 @@ class ConverterError(MyException):
 
 class DataConverter:
     _interpolate_func = None
+    _table: Optional[tuple] = None  # set_tableに渡された(x, y). 並べ替えはtableを使うときにする
 
     def set_file(self, filepath, skiprows, delimiter, x_colmun=0, y_column=1):
         """データ変換に使う変換表をセット(ファイルから)"""
@@ -33,6 +45,9 @@ class DataConverter:
 
     def set_table(self, x, y, bounds_error=False, fill_value="extrapolate"):
         """データ変換に使う変換表をセット(x,yの配列から)"""
+        from scipy import interpolate  # SciPyは読み込みが重いので使うときに読み込む
+
+        self._table = (x, y)
         self._interpolate_func = interpolate.interp1d(
             x, y, bounds_error=bounds_error, fill_value=fill_value
         )  # 線形補間関数定義
@@ -50,3 +65,259 @@ class DataConverter:
         except Exception as e:
             raise ConverterError("予期せぬエラーが発生しました") from e
         return output_value
+
+    @property
+    def table(self) -> tuple[np.ndarray, np.ndarray]:
+        """xの小さい順に並べた変換表(x, y)
+
+        ConversionChainに渡すときに並べ替える. xに同じ値があったり2点未満だったりするとConverterError
+        """
+        if self._table is None:
+            raise ConverterError("データ変換表がセットされていません")
+        return sort_table(*self._table)
+
+
+def sort_table(x, y) -> tuple[np.ndarray, np.ndarray]:
+    """変換表をxの小さい順に並べる"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x.ndim != 1 or x.shape != y.shape:
+        raise ConverterError("変換表のxとyは同じ長さの1次元配列にしてください")
+    if len(x) < 2:
+        raise ConverterError("変換表には2点以上必要です")
+    order = np.argsort(x, kind="stable")
+    x, y = x[order], y[order]
+    if np.any(np.diff(x) == 0):
+        raise ConverterError("変換表のxに同じ値が含まれています")
+    return x, y
+
+
+def interp_extrapolate(x, xp: np.ndarray, fp: np.ndarray):
+    """np.interpで線形補間する. 範囲外は両端の傾きで線形に外挿する
+
+    scipyのinterp1d(fill_value="extrapolate")と同じ結果になる
+    """
+    if np.ndim(x) == 0:  # 1点だけのとき(測定中の変換)は配列を作らない
+        x = float(x)
+        if x < xp[0]:
+            return float(fp[0] + (fp[1] - fp[0]) / (xp[1] - xp[0]) * (x - xp[0]))
+        if x > xp[-1]:
+            return float(fp[-1] + (fp[-1] - fp[-2]) / (xp[-1] - xp[-2]) * (x - xp[-1]))
+        return float(np.interp(x, xp, fp))
+    x_array = np.asarray(x, dtype=float)
+    y = np.interp(x_array, xp, fp)
+    below = x_array < xp[0]
+    if np.any(below):
+        slope = (fp[1] - fp[0]) / (xp[1] - xp[0])
+        y = np.where(below, fp[0] + slope * (x_array - xp[0]), y)
+    above = x_array > xp[-1]
+    if np.any(above):
+        slope = (fp[-1] - fp[-2]) / (xp[-1] - xp[-2])
+        y = np.where(above, fp[-1] + slope * (x_array - xp[-1]), y)
+    return y
+
+
+class _TableStage:
+    """変換表(区分線形)の段"""
+
+    def __init__(self, x, y) -> None:
+        self.x, self.y = sort_table(x, y)
+
+    def __call__(self, x):
+        return interp_extrapolate(x, self.x, self.y)
+
+
+class _FunctionStage:
+    """任意の関数の段 (配列をまとめて変換できる関数)"""
+
+    def __init__(self, func: Callable) -> None:
+        self.func = func
+
+    def __call__(self, x):
+        return np.asarray(self.func(x), dtype=float)
+
+
+class ConversionChain:
+    """変換表や関数をつなげた変換
+
+    compileすると全体を1つの単調な区分線形の変換表(CompiledConversion)にまとめる.
+    変換表だけをつなげたときは変換表の折れ目をすべて含めるので, 範囲内ではつなげたまま変換したときと
+    (計算誤差を除いて)同じ値になる. 関数を含むときは区間ごとに何点かで誤差を調べて,
+    max_errorを超えた区間に点を増やす(調べた点の間の誤差は保証しない)
+    """
+
+    def __init__(self) -> None:
+        self._stages: list = []
+
+    def add_table(self, x, y) -> "ConversionChain":
+        """変換表(xの配列, yの配列)を追加する"""
+        self._stages.append(_TableStage(x, y))
+        return self
+
+    def add_file(
+        self, filepath, skiprows=0, delimiter=None, x_column=0, y_column=1
+    ) -> "ConversionChain":
+        """ファイルの変換表を追加する (DataConverter.set_fileと同じ引数)"""
+        datas = np.loadtxt(
+            fname=filepath,
+            skiprows=skiprows,
+            delimiter=delimiter,
+            unpack=True,
+            encoding=get_encode_type(filepath),
+        )
+        return self.add_table(datas[x_column], datas[y_column])
+
+    def add_function(self, func: Callable) -> "ConversionChain":
+        """関数を追加する. funcはnumpyの配列を受け取って同じ長さの配列を返すこと"""
+        if not callable(func):
+            raise ConverterError(f"{func}は関数ではありません")
+        self._stages.append(_FunctionStage(func))
+        return self
+
+    def add(self, stage) -> "ConversionChain":
+        """変換表を持つもの(DataConverter, TMRCalibrationManagerなど)か関数を追加する"""
+        table = getattr(stage, "table", None)
+        if table is not None:
+            return self.add_table(*table)
+        return self.add_function(stage)
+
+    def __len__(self) -> int:
+        return len(self._stages)
+
+    def __call__(self, x):
+        """つなげたまま変換する (compileしたものと比べる用)"""
+        y = np.asarray(x, dtype=float)
+        for stage in self._stages:
+            y = stage(y)
+        return float(y) if np.ndim(x) == 0 else y
+
+    def compile(
+        self,
+        x_min: Optional[float] = None,
+        x_max: Optional[float] = None,
+        max_error: float = 1e-6,
+        max_points: int = 100000,
+    ) -> "CompiledConversion":
+        """1つの区分線形の変換表にまとめる
+
+        Parameters
+        ----------
+        x_min, x_max: Optional[float]
+            変換表を作る入力の範囲. Noneなら最初の変換表の範囲. 範囲外は線形に外挿する
+        max_error: float
+            関数を含むときの許容誤差(出力の単位). 区間ごとに1/4, 1/2, 3/4の点で誤差を調べて, 超えたら区間を2つに分ける
+            調べた点の間で急に変わる関数だと誤差がmax_errorを超えることがあるので, compileしたものを
+            つなげたままの変換(__call__)と比べて確かめること
+        max_points: int
+            変換表の点の数の上限. 超えるとConverterError
+        """
+        if len(self._stages) == 0:
+            raise ConverterError("変換が1つも追加されていません")
+        if x_min is None or x_max is None:
+            first = self._stages[0]
+            if not isinstance(first, _TableStage):
+                raise ConverterError("最初が関数のときはx_minとx_maxを指定してください")
+            x_min = first.x[0] if x_min is None else x_min
+            x_max = first.x[-1] if x_max is None else x_max
+        if not x_min < x_max:
+            raise ConverterError(f"x_min({x_min})はx_max({x_max})より小さくしてください")
+
+        xs = np.array([x_min, x_max], dtype=float)
+        ys = xs.copy()
+        for stage in self._stages:
+            if isinstance(stage, _TableStage):
+                xs, ys = _compose_table(xs, ys, stage)
+            else:
+                xs, ys = _compose_function(xs, ys, stage, max_error, max_points)
+            if len(xs) > max_points:
+                raise ConverterError(
+                    f"変換表の点の数が{max_points}を超えました. max_errorを大きくするか範囲を狭くしてください"
+                )
+
+        logger.debug(f"compiled conversion: {len(self._stages)} stages -> {len(xs)} points")
+        return CompiledConversion(xs, ys)
+
+
+def _compose_table(xs: np.ndarray, ys: np.ndarray, stage: _TableStage):
+    """区分線形の変換(xs→ys)の後に変換表をつなげる
+
+    ysが変換表の折れ目をまたぐ区間には折れ目に対応するxを足すので, つなげた後も正確に区分線形になる
+    """
+    new_x = [xs]
+    y0, y1 = ys[:-1], ys[1:]
+    for knot in stage.x:
+        crossing = np.flatnonzero((np.minimum(y0, y1) < knot) & (knot < np.maximum(y0, y1)))
+        if len(crossing) == 0:
+            continue
+        ratio = (knot - y0[crossing]) / (y1[crossing] - y0[crossing])
+        new_x.append(xs[crossing] + ratio * (xs[crossing + 1] - xs[crossing]))
+    xs_new = np.unique(np.concatenate(new_x))
+    return xs_new, stage(np.interp(xs_new, xs, ys))
+
+
+def _compose_function(xs: np.ndarray, ys: np.ndarray, stage: _FunctionStage, max_error, max_points):
+    """区分線形の変換(xs→ys)の後に関数をつなげる
+
+    各区間の1/4, 1/2, 3/4の点で線形補間との差を調べて, max_errorを超えた区間を2つに分ける
+    調べるのはこの3点だけなので, 滑らかな関数でないと区間内の誤差がmax_error以下になるとは限らない
+    """
+    fractions = np.array([0.25, 0.5, 0.75])
+    values = stage(ys)
+    while True:
+        width = np.diff(xs)
+        samples = xs[:-1, None] + width[:, None] * fractions
+        exact = stage(np.interp(samples.ravel(), xs, ys)).reshape(samples.shape)
+        linear = values[:-1, None] + (values[1:] - values[:-1])[:, None] * fractions
+        bad = np.flatnonzero(np.max(np.abs(exact - linear), axis=1) > max_error)
+        if len(bad) == 0:
+            return xs, values
+        if len(xs) + len(bad) > max_points:
+            raise ConverterError(
+                f"変換表の点の数が{max_points}を超えました. max_errorを大きくするか範囲を狭くしてください"
+            )
+        middle = xs[bad] + width[bad] / 2
+        order = np.argsort(np.concatenate([xs, middle]), kind="stable")
+        ys = np.concatenate([ys, np.interp(middle, xs, ys)])[order]
+        values = np.concatenate([values, exact[bad, 1]])[order]
+        xs = np.concatenate([xs, middle])[order]
+
+
+class CompiledConversion:
+    """1つにまとめた区分線形の変換表
+
+    np.interpで配列をまとめて変換する. 範囲外は両端の傾きで線形に外挿する
+
+    Attributes
+    ----------
+    x, y: np.ndarray
+        変換表 (xは小さい順)
+    increasing: bool
+        単調増加ならTrue, 単調減少ならFalse
+    """
+
+    def __init__(self, x, y) -> None:
+        self.x, self.y = sort_table(x, y)
+        dy = np.diff(self.y)
+        if np.all(dy > 0):
+            self.increasing = True
+        elif np.all(dy < 0):
+            self.increasing = False
+        else:
+            raise ConverterError("まとめた変換が単調になっていません. 変換表や関数が単調か確認してください")
+
+    @property
+    def table(self) -> tuple[np.ndarray, np.ndarray]:
+        return self.x, self.y
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def convert(self, input_value: Union[float, np.ndarray]):
+        """変換表に合わせて入力データを変換"""
+        return interp_extrapolate(input_value, self.x, self.y)
+
+    __call__ = convert
+
+    def inverse(self) -> "CompiledConversion":
+        """逆変換 (単調なので必ず作れる)"""
+        return CompiledConversion(self.y, self.x)
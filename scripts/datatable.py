@@ -0,0 +1,144 @@
+"""
+BaseDataを継承したクラスのデータを表にためておく
+
+Dataのインスタンスをリストにためる代わりに使うとメモリが少なくて済む
+(1行あたり 8バイト × 列数)
+
+使用例
+
+class Data(BaseData):
+    time: "[s]"
+    voltage: "[V]"
+
+table = DataTable(Data)
+
+def update():
+    data = Data(time=..., voltage=...)
+    table.append(data)
+
+def end():
+    save(table)                                  # ファイルにまとめて書き込む
+    plot_array(table["time"], table["voltage"])  # まとめてプロット
+"""
+from __future__ import annotations
+
+from typing import Iterable, Optional, Union
+
+import numpy as np
+from basedata import BaseData
+from utility import MyException
+
+
+class DataTableError(MyException):
+    """データの表関係のエラー"""
+
+
+class DataTable:
+    """BaseDataを継承したクラスのデータをためるNumPyの構造化配列
+
+    列はDataクラスで変数を定義した順に並ぶ
+    あらかじめ確保した配列がいっぱいになったら2倍の大きさの配列に移す
+
+    Attributes
+    ----------
+    data_class: type[BaseData]
+        表にためるDataクラス
+    units: dict[str, str]
+        列名と単位
+    dtype: np.dtype
+        構造化配列の型
+    """
+
+    def __init__(
+        self,
+        data_class: type[BaseData],
+        capacity: int = 1024,
+        dtypes: Optional[dict] = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        data_class: type[BaseData]
+            表にためるDataクラス
+        capacity: int
+            最初に確保する行数
+        dtypes: Optional[dict]
+            列ごとの型 (例 {"count": "i8", "comment": "U32"}). 指定しなかった列はfloat64
+        """
+        if not (isinstance(data_class, type) and issubclass(data_class, BaseData)):
+            raise DataTableError("DataTableにはBaseDataを継承したクラスを渡してください")
+        dtypes = {} if dtypes is None else dtypes
+        fields = data_class._fields
+        for name in dtypes.keys():
+            if name not in fields:
+                raise DataTableError(f"{name}は{data_class.__name__}に定義された変数に含まれていません")
+
+        self.data_class = data_class
+        self.units = {name: data_class.__annotations__[name] for name in fields}
+        self.dtype = np.dtype([(name, dtypes.get(name, "f8")) for name in fields])
+        self._array = np.empty(max(capacity, 1), dtype=self.dtype)
+        self._size = 0
+
+    def append(self, data: Union[BaseData, tuple]) -> None:
+        """1行追加する"""
+        if self._size == len(self._array):
+            self._grow(2 * len(self._array))
+        if isinstance(data, BaseData):
+            data = data._values()
+        try:
+            self._array[self._size] = data
+        except (TypeError, ValueError) as e:
+            raise DataTableError(
+                f"{self.data_class.__name__}の表に追加できないデータです: {data}"
+            ) from e
+        self._size += 1
+
+    def extend(self, datas: Iterable[Union[BaseData, tuple]]) -> None:
+        """複数行追加する"""
+        for data in datas:
+            self.append(data)
+
+    def _grow(self, capacity: int) -> None:
+        """配列をcapacity行に広げる"""
+        array = np.empty(capacity, dtype=self.dtype)
+        array[: self._size] = self._array[: self._size]
+        self._array = array
+
+    def clear(self) -> None:
+        """全ての行を消す (確保した配列はそのまま使う)"""
+        self._size = 0
+
+    @property
+    def array(self) -> np.ndarray:
+        """ためたデータの構造化配列 (コピーしない)"""
+        return self._array[: self._size]
+
+    @property
+    def columns(self) -> tuple[str, ...]:
+        """列名"""
+        return self.data_class._fields
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, key):
+        """列名なら列の配列を, 番号やスライスなら行を返す (どちらもコピーしない)"""
+        if isinstance(key, str):
+            if key not in self.dtype.names:
+                raise DataTableError(f"{key}は{self.data_class.__name__}に定義された変数に含まれていません")
+            return self._array[key][: self._size]
+        return self.array[key]
+
+    def __iter__(self):
+        """1行ずつタプルで返す"""
+        return iter(self.array.tolist())
+
+    def get_names(self, do_index=True, do_put_unit=True) -> str:
+        """列名の文字列を返す (Dataクラスのget_namesと同じ)"""
+        return self.data_class.get_names(do_index=do_index, do_put_unit=do_put_unit)
+
+    def to_text(self, delimiter="\t") -> str:
+        """全ての行をdelimiter区切りの文字列にする"""
+        return "".join(
+            delimiter.join(map(str, row)) + "\n" for row in self.array.tolist()
+        )
@@ -4,7 +4,7 @@ from pathlib import Path
 from typing import Optional
 
 from utility import MyException, ask_open_filename, get_encode_type
-from variables import SHARED_VARIABLES, USER_VARIABLES
+from variables import RUN_OPTIONS, SHARED_VARIABLES, USER_VARIABLES
 
 logger = getLogger(f"SSR.{__name__}")
 
@@ -42,9 +42,21 @@ def get_deffile() -> Path:
     return defpath
 
 
-def read_deffile() -> None:
-    """定義ファイルを読み込んで各フォルダのパスを取得"""
-    path_deffile = get_deffile()
+def read_deffile(path_deffile: Optional[Path] = None) -> None:
+    """定義ファイルを読み込んで各フォルダのパスを取得
+
+    Parameters
+    ----------
+    path_deffile: Optional[Path]
+        定義ファイルのパス. Noneならダイアログで選択する
+    """
+    if path_deffile is None:
+        if RUN_OPTIONS.HEADLESS:
+            raise DefineFileError("ヘッドレスモードでは定義ファイルを指定してください")
+        path_deffile = get_deffile()
+    path_deffile = Path(path_deffile).absolute()
+    if not path_deffile.is_file():
+        raise DefineFileError(f"定義ファイル{path_deffile}が存在しません")
     logger.info("define file:%s", path_deffile.stem)
 
     datadir = None
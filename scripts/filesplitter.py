@@ -55,6 +55,29 @@ class FileSplitter:
         self.rootfileinfo = fileinfo
         self.folderpath = filepath.parent
 
+    @classmethod
+    def from_table(cls, table, folderpath, label=None) -> FileSplitter:
+        """datatable.pyのDataTableから直接FileSplitterを作る
+
+        ファイルを読み直さずに, 測定中にためたデータをそのまま分割する
+
+        Parameters
+        --------------
+        table: DataTable
+            分割するデータ
+        folderpath: str
+            分割したファイルを作るフォルダのパス
+        label: str
+            分割したファイルの先頭につける文字列. Noneなら列名(table.get_names())
+        """
+        splitter = cls.__new__(cls)
+        splitter.label = table.get_names() + "\n" if label is None else label
+        fileinfo = FileSplitter.FileInfo(name="", data=table.array.tolist(), count=None)
+        fileinfo.is_root = True
+        splitter.rootfileinfo = fileinfo
+        splitter.folderpath = Path(folderpath)
+        return splitter
+
     class FileInfo:
         def __init__(self, name, data, count) -> None:
             self.count = count
@@ -1,14 +1,24 @@
 """
 マクロの読み込みなど
+
+読み込んだマクロはコンパイルしたコードと文法チェックの結果を共有の一時フォルダ(macro_cache)に保存しておき,
+次にマクロを読み込んだときに中身が変わっていなければコンパイルと文法チェックを飛ばす
+(.ssrは勝手に作った拡張子なので__pycache__が作られない)
 """
+import hashlib
+import linecache
+import marshal
+import os
 from importlib.machinery import SourceFileLoader
-from importlib.util import module_from_spec, spec_from_loader
+from importlib.util import MAGIC_NUMBER, module_from_spec, spec_from_loader
 from logging import getLogger
 from pathlib import Path
-from types import ModuleType
+from types import CodeType, FunctionType, ModuleType
+from typing import Optional
 
+from macro_grammar import macro_grammer_check
 from utility import MyException, ask_open_filename
-from variables import SHARED_VARIABLES, USER_VARIABLES
+from variables import RUN_OPTIONS, SHARED_VARIABLES, USER_VARIABLES
 
 logger = getLogger(f"SSR.{__name__}")
 
@@ -17,20 +27,34 @@ class MacroError(MyException):
     """マクロ関連のエラー"""
 
 
-def get_macropath() -> tuple[Path, str, Path]:
-    """前回のマクロ名が保存されたファイルのパス"""
+def get_macropath(macropath: Optional[Path] = None) -> tuple[Path, str, Path]:
+    """マクロのパス, 名前, フォルダを返す
+
+    Parameters
+    ----------
+    macropath: Optional[Path]
+        マクロのパス. Noneならダイアログで選択する
+    """
+    # 前回のマクロ名が保存されたファイルのパス
     path_premacroname = SHARED_VARIABLES.TEMPDIR / "premacroname"
     path_premacroname.touch()
 
-    premacroname = path_premacroname.read_text(encoding="utf-8")
-
-    # .ssrは勝手に作った拡張子
-    macropath = ask_open_filename(
-        filetypes=[("pythonファイル", "*.py *.ssr")],
-        title="マクロを選択してください",
-        initialdir=str(USER_VARIABLES.MACRODIR),
-        initialfile=premacroname,
-    )
+    if macropath is None:
+        if RUN_OPTIONS.HEADLESS:
+            raise MacroError("ヘッドレスモードではマクロを指定してください")
+        premacroname = path_premacroname.read_text(encoding="utf-8")
+
+        # .ssrは勝手に作った拡張子
+        macropath = ask_open_filename(
+            filetypes=[("pythonファイル", "*.py *.ssr")],
+            title="マクロを選択してください",
+            initialdir=str(USER_VARIABLES.MACRODIR),
+            initialfile=premacroname,
+        )
+    else:
+        macropath = Path(macropath).absolute()
+        if not macropath.is_file():
+            raise MacroError(f"マクロ{macropath}が存在しません")
 
     macrodir = macropath.parent
     macroname = macropath.stem
@@ -41,14 +65,96 @@ def get_macropath() -> tuple[Path, str, Path]:
     return macropath, macroname, macrodir
 
 
-def get_macro(macropath: Path) -> ModuleType:
-    """パスから各種関数を読み込んでユーザーマクロを返す"""
+MACRO_CACHE_SIZE = 64  # 残しておくキャッシュの数
+
+
+def get_macro_cache_dir() -> Optional[Path]:
+    """マクロのキャッシュを置くフォルダ. 共有の一時フォルダが決まっていなければNone"""
+    try:
+        return SHARED_VARIABLES.TEMPDIR / "macro_cache"
+    except ValueError:
+        return None
+
+
+def get_macro_cache_key(macropath: Path, source: bytes) -> str:
+    """マクロのパスと中身とPythonのバージョンから作ったキャッシュの名前"""
+    sha = hashlib.sha256(MAGIC_NUMBER)
+    sha.update(str(macropath).encode("utf-8") + b"\0")
+    sha.update(source)
+    return sha.hexdigest()
+
+
+def compile_macro(macropath: Path) -> tuple[CodeType, Optional[Path]]:
+    """マクロをコンパイルしたコードとキャッシュのパス(キャッシュを使わないならNone)を返す"""
+    source = macropath.read_bytes()
+    cache_dir = get_macro_cache_dir()
+    if cache_dir is None:
+        return compile(source, str(macropath), "exec", dont_inherit=True), None
+
+    cache_path = cache_dir / (get_macro_cache_key(macropath, source) + ".code")
+    try:
+        code = marshal.loads(cache_path.read_bytes())
+        if isinstance(code, CodeType):
+            logger.debug(f"macro cache hit: {cache_path.name}")
+            return code, cache_path
+    except (OSError, ValueError, EOFError, TypeError):
+        pass
+
+    code = compile(source, str(macropath), "exec", dont_inherit=True)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # 他のSSRと同時に書き込んでも壊れないように別名で書いてから置き換える
+        temp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        temp_path.write_bytes(marshal.dumps(code))
+        os.replace(temp_path, cache_path)
+        prune_macro_cache(cache_dir)
+    except OSError as e:
+        logger.debug(f"failed to write macro cache: {e}")
+    return code, cache_path
+
+
+def prune_macro_cache(cache_dir: Path, size: int = MACRO_CACHE_SIZE) -> None:
+    """古いキャッシュを消してsize個だけ残す"""
+    codes = sorted(cache_dir.glob("*.code"), key=lambda p: p.stat().st_mtime_ns, reverse=True)
+    for path in codes[size:]:
+        path.unlink(missing_ok=True)
+        path.with_suffix(".checked").unlink(missing_ok=True)
+
+
+def load_macro(macropath: Path) -> ModuleType:
+    """マクロを読み込んでモジュールにする (キャッシュがあればコンパイルしない)"""
     macroname = macropath.stem
-
-    # importlibを使って動的にpythonファイルを読み込む
     spec = spec_from_loader(macroname, SourceFileLoader(macroname, str(macropath)))
     target = module_from_spec(spec)
-    spec.loader.exec_module(target)
+    code, cache_path = compile_macro(macropath)
+    target.__macro_cache__ = cache_path
+    exec(code, target.__dict__)
+    return target
+
+
+def check_macro_grammar(target: ModuleType) -> None:
+    """マクロがSSRの文法規則を満たしているかチェック
+
+    チェックを通ったマクロはキャッシュに記録して, 次からはチェックを飛ばす
+    """
+    cache_path: Optional[Path] = getattr(target, "__macro_cache__", None)
+    checked_path = None if cache_path is None else cache_path.with_suffix(".checked")
+    if checked_path is not None and checked_path.is_file():
+        logger.debug(f"macro grammar check skipped: {checked_path.name}")
+        return
+
+    macro_grammer_check(target)
+
+    if checked_path is not None:
+        try:
+            checked_path.touch()
+        except OSError as e:
+            logger.debug(f"failed to write macro cache: {e}")
+
+
+def get_macro(macropath: Path) -> ModuleType:
+    """パスから各種関数を読み込んでユーザーマクロを返す"""
+    target = load_macro(macropath)
 
     # 測定マクロに必要な関数と引数が含まれているか確認
     UNDIFINE_ERROR = False
@@ -108,12 +214,85 @@ def get_macro(macropath: Path) -> ModuleType:
     return target
 
 
+# マクロから呼び出す関数とその引数の数
+MACRO_FUNCTION_ARGCOUNTS = {"start": 0, "update": 0, "end": 0, "on_command": 1, "split": 1, "after": 1}
+
+
+def reload_macro(target: ModuleType) -> list[str]:
+    """測定中にマクロの関数だけを読み込み直す
+
+    マクロファイルをコンパイルし直して, マクロの中で定義された関数(updateやon_commandなど)の中身を入れ替える
+    マクロのトップレベルの処理は実行しないので, グローバル変数や接続済みの機器はそのまま使える
+    新しく定義された関数も追加する(デフォルト引数は引き継がれないので注意)
+
+    引数の数が変わったときや文法チェックに引っかかったときは元の関数に戻してエラーを出す
+
+    Returns
+    -------
+    list[str]
+        入れ替えた関数の名前
+    """
+    macropath = Path(target.__file__)
+    code, cache_path = compile_macro(macropath)  # 文法エラーならSyntaxError
+
+    # トップレベルで定義された関数のコード
+    codes = {
+        c.co_name: c
+        for c in code.co_consts
+        if isinstance(c, CodeType) and c.co_filename == str(macropath) and not c.co_name.startswith("<")
+    }
+
+    namespace = target.__dict__
+    backup = {"__macro_cache__": namespace.get("__macro_cache__")}
+    reloaded = []
+    try:
+        for name, new_code in codes.items():
+            old = namespace.get(name)
+            if isinstance(old, type):  # クラスはそのまま
+                continue
+            if old is not None and not _is_plain_function(old, name, macropath):
+                # デコレーターは読み込み直さないので, 中身だけ入れ替えるとデコレーターが外れてしまう
+                logger.warning(f"{name}はデコレーターがついているなどdefしたままの関数ではないので読み込み直せません")
+                continue
+            if isinstance(old, FunctionType):
+                if old.__code__.co_argcount != new_code.co_argcount:
+                    raise MacroError(f"{name}の引数の数が変わっています. 引数を変えたときは測定をやり直してください")
+                new = FunctionType(new_code, namespace, name, old.__defaults__)
+                new.__kwdefaults__ = old.__kwdefaults__
+                new.__dict__.update(old.__dict__)
+            elif old is None:  # 定義されていなかった関数(get_macroでNoneを入れている)
+                argcount = MACRO_FUNCTION_ARGCOUNTS.get(name)
+                if argcount is not None and new_code.co_argcount != argcount:
+                    raise MacroError(f"{name}の引数の数は{argcount}つにしてください")
+                new = FunctionType(new_code, namespace, name)
+            backup[name] = old
+            namespace[name] = new
+            reloaded.append(name)
+
+        namespace["__macro_cache__"] = cache_path
+        linecache.checkcache(str(macropath))  # 文法チェックで新しいソースを読むように
+        check_macro_grammar(target)
+    except BaseException:
+        namespace.update(backup)  # 元に戻す
+        raise
+
+    logger.info("reload macro: %s", ", ".join(reloaded))
+    return reloaded
+
+
+def _is_plain_function(obj, name: str, macropath: Path) -> bool:
+    """objがマクロでdefしたままの関数(デコレーターで包まれていない関数)かどうか"""
+    return (
+        isinstance(obj, FunctionType)
+        and obj.__code__.co_name == name
+        and obj.__code__.co_filename == str(macropath)
+        and not hasattr(obj, "__wrapped__")
+    )
+
+
 def get_macro_split(macroPath: Path) -> ModuleType:
     """マクロファイルを分割マクロに変換"""
-    macroname = macroPath.stem
-    spec = spec_from_loader(macroname, SourceFileLoader(macroname, str(macroPath)))
-    target = module_from_spec(spec)
-    spec.loader.exec_module(target)
+    target = load_macro(macroPath)
 
     if hasattr(target, "bunkatsu"):
         target.split = target.bunkatsu
@@ -129,10 +308,7 @@ def get_macro_split(macroPath: Path) -> ModuleType:
 
 def get_macro_recalculate(macroPath: Path):
     """マクロファイルを再計算マクロに変換"""
-    macroname = macroPath.stem
-    spec = spec_from_loader(macroname, SourceFileLoader(macroname, str(macroPath)))
-    target = module_from_spec(spec)
-    spec.loader.exec_module(target)
+    target = load_macro(macroPath)
 
     if not hasattr(target, "recalculate"):
         raise MacroError(f"{target.__name__}.pyにはrecalculate関数を定義する必要があります")
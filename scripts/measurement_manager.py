@@ -4,7 +4,6 @@
 一部処理はmeasurement_manager_supportに切り出しています
 """
 
-import msvcrt
 import os
 import sys
 import threading
@@ -13,9 +12,9 @@ from logging import getLogger
 from pathlib import Path
 from typing import Optional, Union
 
-import pyperclip
-
 import calibration as calib
+from console_input import flush_input
+from macro import reload_macro
 from measurement_manager_support import (
     CommandReceiver,
     FileManager,
@@ -23,8 +22,8 @@ from measurement_manager_support import (
     MeasurementStep,
     PlotAgency,
 )
-from utility import ask_save_filename, get_date_text
-from variables import USER_VARIABLES
+from utility import MyException, ask_save_filename, get_date_text
+from variables import RUN_OPTIONS, USER_VARIABLES
 
 logger = getLogger(f"SSR.{__name__}")
 
@@ -42,6 +41,53 @@ def finish() -> None:
     _measurement_manager.is_measuring = False
 
 
+def _get_default_filepath() -> Path:
+    """ファイル名が指定されなかったときのファイルのパス
+
+    起動時にファイルが指定されていればそれを, なければ日付をファイル名にする
+    """
+    if RUN_OPTIONS.OUTPUT is None:
+        return USER_VARIABLES.DATADIR / f"{get_date_text()}.txt"
+    return USER_VARIABLES.DATADIR / RUN_OPTIONS.OUTPUT  # 絶対パスならそのまま
+
+
+def _ask_filepath(openfolder=None) -> Path:
+    """作成するファイルのパスをダイアログで選択する
+
+    起動時にファイルが指定されているときやヘッドレスモードのときはダイアログを出さない
+    """
+    if RUN_OPTIONS.HEADLESS or RUN_OPTIONS.OUTPUT is not None:
+        return _get_default_filepath()
+    return ask_save_filename(
+        filetypes=[
+            ("TEXT", ".txt"),
+        ],
+        defaultextension="txt",
+        initialdir=USER_VARIABLES.DATADIR if openfolder is None else openfolder,
+        initialfile=get_date_text(),
+        title="作成するファイル名を設定してください",
+    )
+
+
+def _copy_to_clipboard(text: str) -> None:
+    """クリップボードにコピーする. ヘッドレスモードでは何もしない"""
+    if RUN_OPTIONS.HEADLESS:
+        return
+    import pyperclip
+
+    pyperclip.copy(text)
+
+
+def enable_hot_reload() -> None:
+    """on_commandを定義していないマクロでも測定中に":reload"でマクロを読み込み直せるようにする
+
+    on_commandを定義していればこの関数を呼ばなくても":reload"が使える
+    """
+    if _measurement_manager.state.current_step != MeasurementStep.START:
+        logger.warning(sys._getframe().f_code.co_name + "はstart関数内で用いてください")
+    _measurement_manager.hot_reload = True
+
+
 def set_file(filename: str = None, add_date: bool = True, openfolder=None):
     """ファイル名をセット
 
@@ -57,7 +103,7 @@ def set_file(filename: str = None, add_date: bool = True, openfolder=None):
     """
 
     if filename is not None:
-        pyperclip.copy(filename)  # ファイル名はクリップボードにコピーしておく
+        _copy_to_clipboard(filename)  # ファイル名はクリップボードにコピーしておく
         if add_date:
             filename = f"{get_date_text()}_{filename}.txt"  # 先頭に日付追加
             filepath = Path(f"{USER_VARIABLES.DATADIR}/{filename}")
@@ -65,17 +111,9 @@ def set_file(filename: str = None, add_date: bool = True, openfolder=None):
             filepath=filepath
         )  # データフォルダの下にファイルを作る
     else:
-        filepath = ask_save_filename(
-            filetypes=[
-                ("TEXT", ".txt"),
-            ],
-            defaultextension="txt",
-            initialdir=USER_VARIABLES.DATADIR if openfolder is None else openfolder,
-            initialfile=get_date_text(),
-            title="作成するファイル名を設定してください",
-        )
+        filepath = _ask_filepath(openfolder)
         filename = os.path.splitext(os.path.basename(filepath))[0]
-        pyperclip.copy(filename)  # ファイル名はクリップボードにコピーしておく
+        _copy_to_clipboard(filename)  # ファイル名はクリップボードにコピーしておく
         _measurement_manager.file_manager.set_file(
             filepath=filepath
         )  # filepath=Noneだとダイアログを出してくれる
@@ -84,7 +122,7 @@ def set_file(filename: str = None, add_date: bool = True, openfolder=None):
 # set_file()をfilenameを出力するように書き換えた関数
 def set_file_id(filename: str = None, add_date: bool = True, openfolder=None):
     if filename is not None:
-        pyperclip.copy(filename)  # ファイル名はクリップボードにコピーしておく
+        _copy_to_clipboard(filename)  # ファイル名はクリップボードにコピーしておく
         if add_date:
             filename = f"{get_date_text()}_{filename}.txt"  # 先頭に日付追加
             filepath = Path(f"{USER_VARIABLES.DATADIR}/{filename}")
@@ -92,17 +130,9 @@ def set_file_id(filename: str = None, add_date: bool = True, openfolder=None):
             filepath=filepath
         )  # データフォルダの下にファイルを作る
     else:
-        filepath = ask_save_filename(
-            filetypes=[
-                ("TEXT", ".txt"),
-            ],
-            defaultextension="txt",
-            initialdir=USER_VARIABLES.DATADIR if openfolder is None else openfolder,
-            initialfile=get_date_text(),
-            title="作成するファイル名を設定してください",
-        )
+        filepath = _ask_filepath(openfolder)
         filename = os.path.splitext(os.path.basename(filepath))[0]
-        pyperclip.copy(filename)  # ファイル名はクリップボードにコピーしておく
+        _copy_to_clipboard(filename)  # ファイル名はクリップボードにコピーしておく
         _measurement_manager.file_manager.set_file(
             filepath=filepath
         )  # filepath=Noneだとダイアログを出してくれる
@@ -297,21 +327,44 @@ def plot(x: float, y: float, label: str = "default") -> None:
         _measurement_manager.plot_agency.plot(x, y, label)
 
 
+def plot_array(x, y, label: str = "default") -> None:
+    """複数のデータをまとめてグラフ描画プロセスに渡す.
+
+    DataTableにためたデータをまとめてプロットするときなどに使う
+    (例: plot_array(table["time"], table["voltage"]))
+
+    Parameter
+    ---------
+
+    x,y : 配列
+        プロットのx,y座標
+
+    label : string or float
+        プロットの識別ラベル.
+    """
+    if _measurement_manager.is_measuring:
+        _measurement_manager.plot_agency.plot_array(x, y, label)
+
+
 def no_plot() -> None:
     """プロット画面を出さないときに呼ぶ"""
     if _measurement_manager.state.current_step != MeasurementStep.START:
         logger.warning(sys._getframe().f_code.co_name + "はstart関数内で用いてください")
+    _measurement_manager.plot_agency.cancel()  # 先に立ち上げておいたプロセスは終了させる
     _measurement_manager.plot_agency = PlotAgency.NoPlotAgency()
 
 
 class MeasurementManager:
     """測定の管理、マクロの各関数の呼び出し"""
 
+    RELOAD_COMMAND = ":reload"  # このコマンドが来たらマクロを読み込み直す
+
     file_manager = None
     plot_agency = None
     command_receiver = None
     state = MeasurementState()
     is_measuring = False
+    hot_reload = False
     _dont_make_file = False
 
     @classmethod
@@ -328,6 +381,8 @@ class MeasurementManager:
         self.plot_agency = PlotAgency()
         self.command_receiver = CommandReceiver(self.state)
         self.set_measurement_state(self.state)
+        if RUN_OPTIONS.NO_PLOT:  # 起動時にプロットしないと指定されている
+            self.plot_agency = PlotAgency.NoPlotAgency()
 
     def measure_start(self) -> None:
         """測定のメインとなる関数.
@@ -339,8 +394,10 @@ class MeasurementManager:
         # 測定状態の設定
         self.state.current_step = MeasurementStep.READY
 
-        while msvcrt.kbhit():  # 既に入っている入力は消す
-            msvcrt.getwch()
+        flush_input()  # 既に入っている入力は消す
+
+        # グラフ描画用のプロセスはstart関数と並行して立ち上げておく
+        self.plot_agency.prewarm()
 
         self.state.current_step = MeasurementStep.START
 
@@ -349,19 +406,16 @@ class MeasurementManager:
         if (not self._dont_make_file) and (
             self.file_manager.filepath is None
         ):  # start関数でファイルをセットしていなければここでファイル作成
-            self.file_manager.set_file(
-                filepath=f"{USER_VARIABLES.DATADIR}/{get_date_text()}.txt"
-            )
+            self.file_manager.set_file(filepath=_get_default_filepath())
         if not self._dont_make_file:
             logger.info(
                 f"file: {self.file_manager.filepath.name}"
             )  # 作成ファイル名をログに出力
         self.plot_agency.run_plot_window()  # グラフウィンドウの立ち上げ
 
-        while msvcrt.kbhit():  # 既に入っている入力は消す
-            msvcrt.getwch()
+        flush_input()  # 既に入っている入力は消す
 
-        if self.macro.on_command is not None:
+        if self.macro.on_command is not None or self.hot_reload:
             self.command_receiver.initialize()  # command関数があるならcommandを受け取る処理を走らせる
 
         logger.info("measurement start")
@@ -379,8 +433,12 @@ class MeasurementManager:
                 ) and not flag:  # updateの返り値がFalseなら測定ループを抜ける
                     logger.debug("return False from update function")
                     self.is_measuring = False
-            else:
+            elif command == self.RELOAD_COMMAND:
+                self.reload_macro()  # updateの合間にマクロの関数を入れ替える
+            elif self.macro.on_command is not None:
                 self.macro.on_command(command)  # コマンドが入っていればコマンドを呼ぶ
+            else:
+                logger.warning(f"on_commandが定義されていないのでコマンド{command}は無視します")
 
             if (
                 self.plot_agency.is_plot_window_forced_terminated()
@@ -391,8 +449,7 @@ class MeasurementManager:
         self.state.current_step = MeasurementStep.FINISH_MEASURE
         self.plot_agency.stop_renew_plot_window()  # 測定終了時にはプロットウィンドウの更新を中断
 
-        while msvcrt.kbhit():  # 既に入っている入力は消す
-            msvcrt.getwch()
+        flush_input()  # 既に入っている入力は消す
 
         logger.info("measurement has finished...")
         if self.macro.end is not None:
@@ -413,8 +470,19 @@ class MeasurementManager:
 
         self.end()
 
+    def reload_macro(self) -> None:
+        """測定を止めずにマクロの関数を読み込み直す. 失敗したら元の関数のまま測定を続ける"""
+        try:
+            reload_macro(self.macro)
+        except Exception as e:  # マクロを保存し損ねたなどどんなエラーでも測定は止めない
+            message = e.message if isinstance(e, MyException) else str(e)
+            logger.error(f"マクロを読み込み直せませんでした. 元のマクロのまま測定を続けます\n{type(e).__name__}: {message}")
+
     def end(self):
         """終了処理. コンソールからの終了と､グラフウィンドウを閉じたときの終了の2つを実行できるようにスレッドを用いる"""
+        if RUN_OPTIONS.HEADLESS:  # ヘッドレスモードでは入力を待たずに終了
+            self.plot_agency.close()
+            return
 
         def wait_enter():  # コンソール側の終了
             nonlocal endflag, windowclose  # nonlocalを使うとクロージャーになる
@@ -3,24 +3,43 @@ measurement_managerモジュールで利用するクラスの詰め合わせ
 """
 
 
-import msvcrt
 import os
+import queue
+import sys
 import threading
 import time
 from enum import Flag, auto
 from logging import getLogger
-from multiprocessing import Lock, Manager, Process, Value
+from multiprocessing import Lock, Manager, Pipe, Process, Value
 from pathlib import Path
 from typing import List, Optional, Union
 
-import plot
 from basedata import BaseData
+from console_input import read_line, wait_input
 from utility import MyException
 from variables import USER_VARIABLES
 
 logger = getLogger(f"SSR.{__name__}")
 
 
+def start_plot_window(share_list, isfinish, lock, info_receiver) -> None:
+    """プロット用のプロセスで実行される関数
+
+    matplotlibは読み込みに時間がかかるので, 測定側のプロセスでは読み込まずに
+    プロット用のプロセスの中でplot.pyを読み込む
+    読み込みが終わったらinfo_receiverからplot_infoが送られてくるまで待つ
+    (Noneが送られてきたらプロットせずに終了)
+    """
+    import plot
+
+    plot.plt.get_backend()  # バックエンドの初期化も先に済ませておく
+
+    plot_info = info_receiver.recv()
+    if plot_info is None:
+        return
+    plot.start_plot_window(share_list, isfinish, lock, plot_info)
+
+
 class MeasurementStep(Flag):
     """測定ステップ"""
 
@@ -53,6 +72,15 @@ class MeasurementState:
         return bool(self.current_step & MeasurementStep.MEASURING)
 
 
+def _is_datatable(data) -> bool:
+    """dataがDataTableかどうか
+
+    numpyを読み込まなくて済むように, datatable.pyが読み込まれていなければDataTableではないとする
+    """
+    datatable = sys.modules.get("datatable")
+    return datatable is not None and isinstance(data, datatable.DataTable)
+
+
 class FileManager:  # ファイルの管理
     """ファイルの作成・書き込みを行う
 
@@ -125,11 +153,16 @@ class FileManager:  # ファイルの管理
         Parameter
         args: Union[tuple, str]
             保存するデータ。主にbasedata.pyのBaseDataを継承したものを引数に取ることを想定
+            datatable.pyのDataTableを1つだけ渡した場合は全ての行を書き込む
         is_flush :bool
             Falseにすると書き込みが反映されない (測定を中断したときにデータが消える)
             そのかわりに早くなるかも？
         """
 
+        if len(args) == 1 and _is_datatable(args[0]):
+            self.write(args[0].to_text(delimiter), is_flush=is_flush)
+            return
+
         text = ""
 
         for data in args:
@@ -167,23 +200,27 @@ class FileManager:  # ファイルの管理
 class CommandReceiver:  # コマンドの入力を受け取るクラス
     """コマンドの入力を検知する
 
+    入力を受け取るスレッドは入力が来るまでconsole_input.wait_inputで待っていて,
+    入力が来たらすぐにキューに入れる
+
     Attributes
     ----------
 
-    __comand: Optional[str]
+    __commands: queue.Queue
         入力されたコマンド
         スレッド間で共有する
-        コマンド入力がないときはNone
 
-    __isfinish:bool
-        測定の終了
+    __measurement_state: MeasurementState
+        測定の状態
     """
 
-    __command: Optional[str] = None
+    WAIT_TIMEOUT = 0.5  # 測定が終わったかどうかを調べる間隔
+
     __measurement_state = None
 
     def __init__(self, measurement_state: MeasurementState) -> None:
         self.__measurement_state = measurement_state
+        self.__commands = queue.Queue()
 
     def initialize(self) -> None:
         """
@@ -194,25 +231,41 @@ class CommandReceiver:  # コマンドの入力を受け取るクラス
         cmthr.start()
 
     def __command_receive_thread(self) -> None:  # 終了コマンドの入力待ち, これは別スレッドで動かす
-        while True:
-            if (
-                msvcrt.kbhit() and self.__measurement_state.is_measuring()
-            ):  # 入力が入って初めてinputが動くように(inputが動くとその間ループを抜けられないので)
-                command = input()
-                if command != "":
-                    self.__command = command
-                    logger.info("command:%s", self.__command)
-                    while self.__command is not None:
-                        time.sleep(0.1)
-            elif self.__measurement_state.has_finished_measurement():
+        while not self.__measurement_state.has_finished_measurement():
+            if not wait_input(
+                self.WAIT_TIMEOUT
+            ):  # 入力が入って初めて読むように(読んでいる間はループを抜けられないので)
+                continue
+            if not self.__measurement_state.is_measuring():
+                time.sleep(0.1)
+                continue
+            try:
+                command = read_line()
+            except EOFError:  # 標準入力が閉じられた
                 break
-            time.sleep(0.1)
+            if command != "":
+                logger.info("command:%s", command)
+                self.__commands.put(command)
 
-    def get_command(self) -> str:
-        """受け取ったコマンドを返す. なければNoneを返す"""
-        command = self.__command
-        self.__command = None
-        return command
+    def put_command(self, command: str) -> None:
+        """コマンドを外から入れる"""
+        self.__commands.put(command)
+
+    def get_command(self, timeout: Optional[float] = 0) -> Optional[str]:
+        """受け取ったコマンドを返す. なければNoneを返す
+
+        Parameters
+        ----------
+
+        timeout: Optional[float]
+            コマンドが来るまで待つ時間[s]. Noneなら来るまで待つ
+        """
+        try:
+            if timeout == 0:
+                return self.__commands.get_nowait()
+            return self.__commands.get(timeout=timeout)
+        except queue.Empty:
+            return None
 
 
 class PlotAgency:
@@ -234,6 +287,9 @@ class PlotAgency:
 
     plot_process: Process
         plot.pyを実行しているプロセス
+
+    __info_sender: Connection
+        plot.pyを実行しているプロセスにplot_infoを送る
     """
 
     class PlotAgentError(MyException):
@@ -243,28 +299,68 @@ class PlotAgency:
     __isfinish: Value
     process_lock: Lock
     plot_process: Process
+    __info_sender = None
+    __manager = None
 
     def __init__(self) -> None:
+        self.plot_process = None
         self.set_plot_info()
 
-    def run_plot_window(self) -> None:  # グラフと終了コマンド待ち処理を走らせる
-        """SSRではマルチプロセスを用いて測定プロセスとは別のプロセスでグラフの描画を行う.
+    def prewarm(self) -> None:
+        """グラフ描画用のプロセスを先に立ち上げておく
 
+        プロセスの起動とmatplotlibの読み込みには時間がかかるので, マクロのstart関数と並行して行う.
         Pythonのマルチプロセスでは必要な値はプロセスの作成時に渡しておかなくてはならないので､(例外あり)
         ここではマルチプロセスの起動と必要な引数の受け渡しを行う.
+        plot_infoはstart関数で決まるので, あとからrun_plot_windowで送る
         """
+        if self.plot_process is not None:
+            return
 
-        self.share_list = Manager().list()  # プロセス間で共有できるリスト
+        self.__manager = Manager()
+        self.share_list = self.__manager.list()  # プロセス間で共有できるリスト
         self.__isfinish = Value("i", 0)  # 測定の終了を判断するためのint
         self.process_lock = Lock()  # 2つのプロセスで同時に同じデータを触らないようにする排他制御のキー
+        info_receiver, self.__info_sender = Pipe(duplex=False)
         # グラフ表示は別プロセスで実行する
         self.plot_process = Process(
-            target=plot.start_plot_window,
-            args=(self.share_list, self.__isfinish, self.process_lock, self.plot_info),
+            target=start_plot_window,
+            args=(self.share_list, self.__isfinish, self.process_lock, info_receiver),
         )
         self.plot_process.daemon = True  # プロセスのデーモン化
         self.plot_process.start()  # マルチプロセス実行
 
+    def run_plot_window(self) -> None:  # グラフと終了コマンド待ち処理を走らせる
+        """SSRではマルチプロセスを用いて測定プロセスとは別のプロセスでグラフの描画を行う.
+
+        prewarmで立ち上げておいたプロセスにplot_infoを送ってグラフを表示させる
+        """
+        self.prewarm()
+        self.__send_plot_info(self.plot_info)
+
+    def cancel(self) -> None:
+        """prewarmで立ち上げたプロセスをグラフを表示させずに終了させる
+
+        まだウィンドウは出していないので, matplotlibの読み込みの途中でもそのまま終了させる
+        """
+        if self.plot_process is None:
+            return
+        self.plot_process.terminate()
+        self.__manager.shutdown()
+        if self.__info_sender is not None:
+            self.__info_sender.close()
+            self.__info_sender = None
+        self.plot_process = None
+
+    def __send_plot_info(self, plot_info: Optional[dict]) -> bool:
+        """グラフ描画用のプロセスにplot_infoを送る. 既に送っていればFalse"""
+        if self.__info_sender is None:
+            return False
+        self.__info_sender.send(plot_info)
+        self.__info_sender.close()
+        self.__info_sender = None
+        return True
+
     def set_plot_info(
         self,
         line=False,
@@ -352,6 +448,30 @@ class PlotAgency:
             self.share_list.append(data)  # プロセス間で共有するリストにデータを追加
             self.process_lock.release()  # ロック解除
 
+    def plot_array(self, x, y, label="default") -> None:
+        """複数のデータをまとめてグラフ描画プロセスに渡す.
+
+        1点ずつplotするよりプロセス間のやりとりが少なくて済む
+
+        Parameter
+        ---------
+
+        x,y : 配列 (DataTableの列やnumpyの配列, リストなど)
+            プロットのx,y座標
+
+        label : string or float
+            プロットの識別ラベル.
+        """
+        if len(x) != len(y):
+            raise self.PlotAgentError("plot_arrayの引数に問題があります : xとyの長さが違います")
+        if self.is_plot_window_alive():
+            x = x.tolist() if hasattr(x, "tolist") else x
+            y = y.tolist() if hasattr(y, "tolist") else y
+            datas = [(xx, yy, label) for xx, yy in zip(x, y)]
+            self.process_lock.acquire()  #   ロックをかけて別プロセスからアクセスできないようにする
+            self.share_list.extend(datas)  # プロセス間で共有するリストにデータを追加
+            self.process_lock.release()  # ロック解除
+
     def stop_renew_plot_window(self) -> None:
         """プロットウィンドウの更新を停止"""
         self.__isfinish.value = 1
@@ -378,21 +498,24 @@ class PlotAgency:
         def __init__(self) -> None:
             """グラフを表示しないモード"""
 
-            def void(*args):
+            def void(*args, **kwargs):
                 """何も返さない関数"""
 
             def void_constant(value):
                 """定数を返す関数を返す関数"""
 
-                def void(*args):
+                def void(*args, **kwargs):
                     """定数を返す関数"""
                     return value
 
                 return void
 
+            self.prewarm = void
             self.run_plot_window = void
+            self.cancel = void
             self.set_plot_info = void
             self.plot = void
+            self.plot_array = void
             self.stop_renew_plot_window = void
             self.close = void
             self.is_plot_window_alive = void_constant(False)
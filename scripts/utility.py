@@ -1,20 +1,73 @@
 """その他諸々の便利関数"""
+import codecs
 import datetime
-import tkinter.filedialog as tkfd
+import functools
+import os
 from pathlib import Path
-from tkinter import Tk
 
-from chardet.universaldetector import UniversalDetector
+
+ENCODE_SAMPLE_SIZE = 64 * 1024  # 文字コードの判別に使う先頭(と末尾)のバイト数
 
 
 def get_encode_type(path: str) -> str:
-    """テキストファイルの文字コードを判別する. ほぼコピペ"""
-    detector = UniversalDetector()
+    """テキストファイルの文字コードを判別する
+
+    ファイルの先頭(大きいファイルは末尾も)だけを見て
+    utf-8 → SHIFT_JIS → chardet の順に判別する
+    結果はファイルのパスと更新日時, サイズごとに覚えておく
+    """
+    stat = os.stat(path)
+    return _get_encode_type(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=256)
+def _get_encode_type(path: str, mtime_ns: int, size: int) -> str:
+    tail = b""
     with open(path, mode="rb") as f:
-        for binary in f:
-            detector.feed(binary)
-            if detector.done:
-                break
+        sample = f.read(ENCODE_SAMPLE_SIZE)
+        if size > ENCODE_SAMPLE_SIZE and sample.isascii():
+            # 先頭が英数字だけのときは末尾に日本語が入っていないかも調べる
+            f.seek(max(size - ENCODE_SAMPLE_SIZE, ENCODE_SAMPLE_SIZE))
+            tail = f.read(ENCODE_SAMPLE_SIZE)
+    is_whole = len(sample) >= size
+
+    if sample.startswith(codecs.BOM_UTF8):
+        return "UTF-8-SIG"
+    # 日本語が入っていないコードはasciiもutf-8もSHIFT_JISも一緒なのでutf-8にする
+    if _can_decode(sample, "utf-8", is_whole) and _can_decode_tail(tail, "utf-8"):
+        return "utf-8"
+    if _can_decode(sample, "shift_jis", is_whole) and _can_decode_tail(tail, "shift_jis"):
+        return "SHIFT_JIS"
+    return _detect_encode_type(sample + tail)
+
+
+def _can_decode(sample: bytes, encoding: str, is_whole: bool) -> bool:
+    """sampleがencodingで正しくデコードできるかどうか
+
+    途中で切ったサンプルの最後の文字は途中で切れていてもよいことにする
+    """
+    decoder = codecs.getincrementaldecoder(encoding)("strict")
+    try:
+        decoder.decode(sample, final=is_whole)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _can_decode_tail(tail: bytes, encoding: str) -> bool:
+    """ファイルの末尾のサンプルtailがencodingで正しくデコードできるかどうか
+
+    tailは文字の途中から始まっているかもしれないので, 先頭の3バイトまでは飛ばしてもよいことにする
+    """
+    return tail == b"" or any(_can_decode(tail[skip:], encoding, True) for skip in range(4))
+
+
+def _detect_encode_type(sample: bytes) -> str:
+    """chardetで文字コードを判別する. ほぼコピペ"""
+    from chardet.universaldetector import UniversalDetector  # 使うときに読み込む
+
+    detector = UniversalDetector()
+    detector.feed(sample)
     detector.close()
     encode_type = detector.result["encoding"]
 
@@ -26,7 +79,6 @@ def get_encode_type(path: str) -> str:
                 encode_type = prober.charset_name
                 confidence = prober.get_confidence()
 
-    # 日本語が入っていないコードはasciiもutf-8もSHIFT_JISも一緒なので
     # asciiと判断されるがasciiに日本語はないのでutf-8にする
     if encode_type == "ascii":
         encode_type = "utf-8"
@@ -36,6 +88,10 @@ def get_encode_type(path: str) -> str:
 
 def ask_open_filename(filetypes=None, title=None, initialdir=None, initialfile=None):
     """ファイル選択ダイアログをつくってファイルを返す関数"""
+    # tkinterは読み込みに時間がかかるのでダイアログを出すときに読み込む
+    import tkinter.filedialog as tkfd
+    from tkinter import Tk
+
     tk = Tk()
 
     # ファイルダイアログでファイルを取得
@@ -56,6 +112,10 @@ def ask_save_filename(
     filetypes=None, title=None, initialdir=None, initialfile=None, defaultextension=None
 ):
     """ファイル選択ダイアログをつくってファイルを返す関数"""
+    # tkinterは読み込みに時間がかかるのでダイアログを出すときに読み込む
+    import tkinter.filedialog as tkfd
+    from tkinter import Tk
+
     tk = Tk()
 
     # ファイルダイアログでファイルを取得
@@ -73,6 +133,21 @@ def ask_save_filename(
     return Path(path).absolute()
 
 
+def ask_directory(title=None, initialdir=None):
+    """フォルダ選択ダイアログをつくってフォルダを返す関数"""
+    import tkinter.filedialog as tkfd
+    from tkinter import Tk
+
+    tk = Tk()
+
+    path = tkfd.askdirectory(title=title, initialdir=initialdir)
+
+    # これとtk=Tk()がないと謎のウィンドウが残って邪魔になる
+    tk.destroy()
+
+    return Path(path).absolute()
+
+
 def get_date_text() -> str:
     """
     今日の日時を返す
@@ -1,6 +1,7 @@
 """共有度の高い変数を置いておく"""
 from logging import getLogger
 from pathlib import Path
+from typing import Optional
 
 from utility import MyException
 
@@ -174,6 +175,32 @@ class SHARED_VARIABLES:
         cls.__SSR_HOMEDIR.value = value
 
 
+class RUN_OPTIONS:
+    """起動時の引数や設定ファイルで指定された実行時の設定
+
+    Attributes
+    ----------
+    HEADLESS: bool
+        ダイアログやコンソールの入力待ちを出さずに動かすかどうか
+    OUTPUT: Optional[Path]
+        データを保存するファイル
+        相対パスならデータ保存フォルダからのパスとみなす
+        マクロのset_fileでファイル名が指定されたときはそちらを使う
+    NO_PLOT: bool
+        プロット画面を出さないかどうか
+    """
+
+    HEADLESS: bool = False
+    OUTPUT: Optional[Path] = None
+    NO_PLOT: bool = False
+
+    @classmethod
+    def reset(cls) -> None:
+        cls.HEADLESS = False
+        cls.OUTPUT = None
+        cls.NO_PLOT = False
+
+
 def init(home: Path):
     """変数の初期化"""
     # SSRフォルダーのパス
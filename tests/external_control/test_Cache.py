@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from ExternalControl.Cache.Cache import (
+    QueryCache,
+    QueryRule,
+    WriteStateCache,
+    scpi_headers_overlap,
+    scpi_setting_key,
+    split_scpi_message,
+)
+
+
+def test_scpi_setting_key():
+    assert scpi_setting_key("FREQ 1000") == "FREQ"
+    assert scpi_setting_key(":freq 1000") == "FREQ"
+    assert scpi_setting_key("SENS:FUNC 'FRES'") == "SENS:FUNC"
+    assert scpi_setting_key("FREQ?") is None
+    assert scpi_setting_key("*CLS") is None
+    assert split_scpi_message("FREQ 1;:VOLT 2; ") == ["FREQ 1", ":VOLT 2"]
+
+
+def test_write_state_cache():
+    sent = []
+    cache = WriteStateCache(dependents={"FUNC": ("RANG",)})
+
+    assert cache.write(["FUNC VOLT", "RANG 10"], sent.extend)
+    assert not cache.write(["RANG 10"], sent.extend)
+    assert cache.write(["FUNC CURR", "RANG 10"], sent.extend)  # FUNCを変えるとRANGも変わる
+    assert cache.filter(["RANG 10", "INIT", "*RST", "RANG 10"]) == ["INIT", "*RST", "RANG 10"]
+    assert sent == ["FUNC VOLT", "RANG 10", "FUNC CURR", "RANG 10"]
+    assert (cache.sent, cache.skipped) == (4, 2)
+
+    def fail(commands):
+        raise OSError()
+
+    with pytest.raises(OSError):
+        cache.write(["RANG 1"], fail)
+    assert cache.write(["RANG 10"], sent.extend)  # 失敗したら機器の状態が分からないので送り直す
+
+
+def test_query_cache():
+    answers = iter(range(100))
+    cache = QueryCache(
+        {
+            "*IDN?": QueryRule.static(),
+            "VOLT?": QueryRule.until_write("VOLT"),
+            "STAT?": QueryRule.until_write(),
+            "TEMP?": QueryRule.for_seconds(0.05),
+        }
+    )
+
+    def query(command):
+        return cache.query(command, lambda: next(answers))
+
+    assert query("*IDN?") == query(":*idn?") == 0
+    assert query("VOLT?") == query("VOLT?") == 1
+    assert query("STAT?") == 2
+    assert query("TEMP?") == query("TEMP?") == 3
+    assert query("FETC?") == 4  # ルールのないクエリはいつも問い合わせる
+    assert query("FETC?") == 5
+    assert (cache.hits, cache.misses) == (3, 4)
+
+    cache.invalidate(["FREQ 1000"])  # VOLT?はVOLTを書き込むまで使い回す
+    assert query("VOLT?") == 1
+    assert query("STAT?") == 6
+    cache.invalidate([":VOLT 2", "VOLT?"])
+    assert query("VOLT?") == 7
+    time.sleep(0.06)
+    assert query("TEMP?") == 8
+
+    cache.invalidate(["*RST"])  # STATIC以外は捨てる
+    assert query("*IDN?") == 0
+    assert query("VOLT?") == 9
+    cache.reset()
+    assert query("*IDN?") == 10
+
+
+def test_scpi_headers_overlap():
+    assert scpi_headers_overlap("VOLTAGE", "VOLT")  # 長い形
+    assert scpi_headers_overlap("VOLT:LEV", "VOLT")  # 下の階層
+    assert scpi_headers_overlap("SOUR:VOLT", "VOLT")  # 省略できる上の階層
+    assert scpi_headers_overlap("SOURCE:VOLTAGE:LEVEL", "VOLT:LEV")
+    assert scpi_headers_overlap("OUTP", "OUTPUT1")
+    assert not scpi_headers_overlap("OUTP2", "OUTPUT1")
+    assert not scpi_headers_overlap("FREQ", "VOLT")
+    assert not scpi_headers_overlap("CURR", "VOLT")
+
+
+def test_query_cache_long_form():
+    answers = iter(range(100))
+    cache = QueryCache({"VOLT?": QueryRule.until_write("VOLT")})
+
+    def query():
+        return cache.query("VOLT?", lambda: next(answers))
+
+    assert query() == query() == 0
+    for command in ("VOLTage 2", "VOLT:LEV 2", "SOUR:VOLT 2", ":SOURce:VOLTage:LEVel 3"):
+        before = query()
+        cache.invalidate([command])
+        assert query() == before + 1, command
+    cache.invalidate(["FREQ 1000", "CURR 0.1"])
+    assert query() == 4
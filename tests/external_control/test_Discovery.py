@@ -0,0 +1,117 @@
+import json
+import time
+
+import pytest
+
+from ExternalControl.Discovery import Discovery
+from ExternalControl.Discovery.Discovery import (
+    CACHE_NAME,
+    DiscoveredInstrument,
+    DiscoveryError,
+    InstrumentDiscovery,
+)
+from ExternalControl.GPIB.GPIB import GPIBController
+from ExternalControl.LinkamT95.Controller import LinkamT95ManualController
+from ExternalControl.MAX303.MAX303Controller import MAX303Controller
+from ExternalControl.Simulation.Simulation import (
+    LinkamT95Simulator,
+    MAX303Simulator,
+    SimulatedDevice,
+    SimulatedSerial,
+    disable_simulation,
+    enable_simulation,
+    tmr_devices,
+)
+
+
+@pytest.fixture
+def simulation():
+    yield enable_simulation
+    disable_simulation()
+
+
+def test_scan(simulation):
+    simulation(
+        visa_devices=tmr_devices(latency=0.3),
+        serial_devices={
+            "COM20": LinkamT95Simulator(),
+            "COM21": MAX303Simulator(),
+            "COM22": SimulatedDevice(),  # 何も応答しない機器
+        },
+    )
+
+    start = time.perf_counter()
+    instruments = InstrumentDiscovery.scan(include_serial=False)
+    assert time.perf_counter() - start < 0.5  # 2つの機器に同時に問い合わせる
+    assert len(instruments) == 2
+
+    instruments = InstrumentDiscovery.scan()
+    assert DiscoveredInstrument("LinkamT95", "COM20", "Serial") in instruments
+    assert DiscoveredInstrument("MAX-303", "COM21", "Serial") in instruments
+    assert all(i.address != "COM22" for i in instruments)
+    assert InstrumentDiscovery.find("e4980a").address == "GPIB0::13::INSTR"
+    assert InstrumentDiscovery.find("MODEL 2000").address == "GPIB0::11::INSTR"
+
+    with pytest.raises(DiscoveryError):
+        InstrumentDiscovery.find("SIM")  # 複数見つかる
+    with pytest.raises(DiscoveryError):
+        InstrumentDiscovery.find("E4980A", interface="Serial")
+
+
+def test_connect_by_name(simulation):
+    max303 = MAX303Simulator()
+    simulation(
+        visa_devices=tmr_devices(),
+        serial_devices={"COM23": LinkamT95Simulator(), "COM24": max303},
+    )
+
+    LCR = GPIBController()
+    LCR.connect_by_name("E4980A")
+    LCR.write("FREQ 2000")
+    assert float(LCR.query("FREQ?")) == 2000
+
+    T95 = LinkamT95ManualController()
+    T95.connect_by_name()
+    assert T95._T95.T95serial._trace_address == "COM23"
+
+    controller = MAX303Controller()
+    controller.connect_by_name()
+    controller.shutter_open()
+    assert max303.shutter == 1
+
+
+def test_address_cache(simulation, tmp_path, monkeypatch):
+    linkam = LinkamT95Simulator()
+    simulation(serial_devices={"COM25": linkam})
+    monkeypatch.setattr(Discovery, "get_discovery_cache_path", lambda: tmp_path / CACHE_NAME)
+    InstrumentDiscovery.persistent = True
+
+    InstrumentDiscovery.scan()
+    records = json.loads((tmp_path / CACHE_NAME).read_text(encoding="utf-8"))["instruments"]
+    assert records == [{"identity": "LinkamT95", "address": "COM25", "interface": "Serial"}]
+
+    # 次の起動では保存した対応表を使い, 機器には問い合わせない
+    InstrumentDiscovery.clear()
+    linkam.commands.clear()
+    assert InstrumentDiscovery.find("LinkamT95").address == "COM25"
+    assert linkam.commands == []
+
+    # ポートが変わっていたら探し直して保存し直す
+    SimulatedSerial.ports = {"COM26": linkam}
+    InstrumentDiscovery.clear()
+    T95 = LinkamT95ManualController()
+    T95.connect_by_name()
+    assert T95._T95.T95serial._trace_address == "COM26"
+    records = json.loads((tmp_path / CACHE_NAME).read_text(encoding="utf-8"))["instruments"]
+    assert records[0]["address"] == "COM26"
+
+
+def test_connect_after_swap(simulation):
+    simulation(visa_devices=tmr_devices())
+
+    # 対応表を作ったあとに機器をつなぎ替えて, E4980Aのアドレスに別の機器がつながっている
+    InstrumentDiscovery._instruments = [DiscoveredInstrument("KEYSIGHT,E4980A", "GPIB0::11::INSTR", "VISA")]
+    LCR = GPIBController()
+    LCR.connect_by_name("E4980A")
+    assert LCR._trace_address == "GPIB0::13::INSTR"
+    assert InstrumentDiscovery.find("E4980A").address == "GPIB0::13::INSTR"
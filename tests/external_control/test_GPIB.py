@@ -0,0 +1,196 @@
+import numpy as np
+import pytest
+from pyvisa import util
+
+from ExternalControl.Cache.Cache import QueryRule
+from ExternalControl.GPIB.GPIB import GPIBController, GPIBError, PreparedSweep
+
+
+class DummyInstrument:
+    def __init__(self, answer=""):
+        self.messages = []
+        self.answer = answer
+
+    def write(self, message):
+        self.messages.append(message)
+
+    def query(self, message):
+        self.messages.append(message)
+        return self.answer
+
+
+class DummyBinaryInstrument:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def query_ascii_values(self, message, converter, separator, container):
+        return util.from_ascii_block(
+            self.raw.decode(), converter=converter, separator=separator, container=container
+        )
+
+    def query_binary_values(
+        self, message, datatype, is_big_endian, header_fmt, expect_termination, container
+    ):
+        assert header_fmt == "ieee"
+        return util.from_ieee_block(
+            self.raw, datatype=datatype, is_big_endian=is_big_endian, container=container
+        )
+
+
+def get_controller(answer=""):
+    controller = GPIBController()
+    controller._instrument = DummyInstrument(answer)
+    return controller
+
+
+def test_batch():
+    controller = get_controller("1.0,2.0;+1000\n")
+
+    controller.write_batch(["FREQ 1000", "*WAI", ":VOLT 1", "APER LONG"])
+    assert controller._instrument.messages[-1] == "FREQ 1000;*WAI;:VOLT 1;:APER LONG"
+
+    answers = controller.query_batch(["FETC?", "FREQ?"])
+    assert controller._instrument.messages[-1] == "FETC?;:FREQ?"
+    assert answers == ["1.0,2.0", "+1000"]
+
+    with pytest.raises(GPIBError):
+        controller.write_batch([])
+
+    with pytest.raises(GPIBError):
+        GPIBController().query_batch(["FETC?"])
+
+
+def test_prepared_sweep():
+    controller = get_controller("1.0,2.0,0\n")
+    sweep = PreparedSweep(
+        controller,
+        values=[1000, 2000],
+        set_command="FREQ {}",
+        fetch_command="FETC?",
+        settle_command="*WAI",
+    )
+    sweep.prepare()
+    assert controller._instrument.messages == []
+
+    assert sweep.measure(1) == ["1.0", "2.0", "0"]
+    assert controller._instrument.messages[-1] == "FREQ 2000;*WAI;:FETC?"
+
+    assert sweep.measure_all() == [["1.0", "2.0", "0"], ["1.0", "2.0", "0"]]
+    assert len(controller._instrument.messages) == 3
+
+
+def test_prepared_list_sweep():
+    controller = get_controller("1.0,2.0,0,3.0,4.0,0\n")
+    sweep = PreparedSweep(
+        controller,
+        values=[1000, 2000],
+        set_command="FREQ {}",
+        fetch_command="FETC?",
+        list_command="LIST:FREQ {}",
+        trigger_command="TRIG:IMM",
+    )
+    sweep.prepare()
+    assert controller._instrument.messages == ["LIST:FREQ 1000,2000"]
+
+    assert sweep.measure_all() == [["1.0", "2.0", "0"], ["3.0", "4.0", "0"]]
+    assert controller._instrument.messages[-1] == "TRIG:IMM;:FETC?"
+
+    controller._instrument.answer = "1.0,2.0,0\n"
+    with pytest.raises(GPIBError):
+        sweep.measure_all()
+
+
+def test_query_values():
+    controller = GPIBController()
+
+    controller._instrument = DummyBinaryInstrument(b"1.5,2.5,-3\n")
+    values = controller.query_ascii_values("TRAC?")
+    assert isinstance(values, np.ndarray)
+    assert values.tolist() == [1.5, 2.5, -3]
+
+    data = np.array([1.0, -2.0, 3.5], dtype=">f8")
+    controller._instrument = DummyBinaryInstrument(
+        util.to_ieee_block(data.tolist(), datatype="d", is_big_endian=True)
+    )
+    values = controller.query_binary_values("TRAC?", datatype="d", is_big_endian=True)
+    assert isinstance(values, np.ndarray)
+    assert values.tolist() == [1.0, -2.0, 3.5]
+
+    with pytest.raises(GPIBError):
+        GPIBController().query_binary_values("TRAC?")
+
+
+def test_write_cache():
+    controller = get_controller("+1.0E-12,+1.0E-02\n")
+    controller.enable_write_cache()
+    messages = controller._instrument.messages
+
+    assert controller.write("FREQ 1000")
+    assert not controller.write("FREQ 1000")
+    assert controller.write("FREQ 2000")
+    assert controller.write("*TRG")
+    assert controller.write("*TRG")  # 設定ではないコマンドはいつも送る
+    assert messages == ["FREQ 1000", "FREQ 2000", "*TRG", "*TRG"]
+
+    # 設定が変わらないコマンドは除いて送る
+    assert controller.write_batch(["FREQ 2000", "VOLT 1"])
+    assert messages[-1] == "VOLT 1"
+    assert not controller.write_batch(["FREQ 2000", "VOLT 1"])
+    controller.query_batch(["FREQ 2000", "*WAI", "FETC?"])
+    assert messages[-1] == "*WAI;:FETC?"
+
+    # *RSTや再接続で設定が変わったら送り直す
+    controller.write("*RST")
+    assert controller.write("FREQ 2000")
+    controller.reset_write_cache()
+    assert controller.write("FREQ 2000")
+
+    controller.enable_write_cache(False)
+    assert controller.write("FREQ 2000")
+    assert messages[-3:] == ["FREQ 2000", "FREQ 2000", "FREQ 2000"]
+
+
+def test_query_cache():
+    class LCRMeter(GPIBController):
+        query_cache_rules = {**GPIBController.query_cache_rules, "VOLT?": QueryRule.until_write("VOLT")}
+
+    controller = LCRMeter()
+    controller._instrument = DummyInstrument("+1.0\n")
+    messages = controller._instrument.messages
+
+    assert controller.query("*IDN?") == controller.query("*IDN?") == "+1.0"
+    assert controller.query("VOLT?") == controller.query("VOLT?") == "+1.0"
+    assert controller.query("VOLT?", remove_return=False) == "+1.0\n"
+    assert messages == ["*IDN?", "VOLT?"]
+    assert (controller.query_cache.hits, controller.query_cache.misses) == (3, 2)
+
+    controller.write("FREQ 1000")
+    controller.query("VOLT?")
+    controller.write_batch(["VOLT 2", "FREQ 2000"])
+    controller.query("VOLT?")
+    assert messages[2:] == ["FREQ 1000", "VOLT 2;:FREQ 2000", "VOLT?"]
+
+    # インスタンスごとのルール
+    controller.cache_query("FREQ?", QueryRule.until_write("FREQ"))
+    controller.query("FREQ?")
+    controller.query("FREQ?")
+    controller.cache_query("VOLT?", None)
+    controller.query("VOLT?")
+    assert messages[5:] == ["FREQ?", "VOLT?"]
+    assert "FREQ?" not in GPIBController().query_cache.rules
+
+
+def test_write_cache_with_query():
+    controller = get_controller("1\n")
+    controller.enable_write_cache()
+    messages = controller._instrument.messages
+
+    # クエリと一緒に送った設定やリセットも覚え直す
+    controller.write("FREQ 1000")
+    controller.query("FREQ 2000;*OPC?")
+    assert controller.write("FREQ 1000")
+    controller.query("*RST;*OPC?")
+    assert controller.write("FREQ 1000")
+    assert messages == ["FREQ 1000", "FREQ 2000;*OPC?", "FREQ 1000", "*RST;*OPC?", "FREQ 1000"]
+    controller.query("FREQ?")
+    assert not controller.write("FREQ 1000")
@@ -185,3 +185,92 @@ def test_auto_controller():
 
     with freezegun.freeze_time("2015-10-21 00:10:19"):
         assert controller._LinkamT95AutoController__update(measurementState) is False
+
+
+def test_auto_controller_events():
+    global dummy_has_reached_target_temperature
+
+    from ExternalControl.LinkamT95.Controller import LinkamT95Event
+
+    measurementState = MeasurementState()
+    measurementState.current_step = MeasurementStep.MEASURING
+    controller = LinkamT95AutoController()
+    controller._LinkamT95AutoController__controller = DummyController()
+    received = []
+    controller.subscribe(LinkamT95Event.REACHED_TARGET, received.append)
+
+    # DummyControllerの温度は100℃
+    controller.add_sequence(400, 0, 10, 10)  # 30分かかる
+    controller.add_sequence(101, 1, 60, 10)  # 1秒で着く
+    dummy_has_reached_target_temperature = False
+
+    assert controller._LinkamT95AutoController__update(measurementState) is True
+    assert controller.predict_arrival() == 1800
+    assert controller.get_poll_interval() == LinkamT95AutoController.POLL_INTERVAL_MAX
+    assert controller.get_events() == []
+
+    dummy_has_reached_target_temperature = True
+    assert controller._LinkamT95AutoController__update(measurementState) is True
+    assert controller._LinkamT95AutoController__update(measurementState) is True
+    assert OUTPUT == "101"
+
+    dummy_has_reached_target_temperature = False
+    assert controller._LinkamT95AutoController__update(measurementState) is True
+    assert controller.get_poll_interval() == 0.5
+
+    dummy_has_reached_target_temperature = True
+    assert controller._LinkamT95AutoController__update(measurementState) is True
+    # 保持中は保持時間が終わるまでの時間だけ待つ(最大でもPOLL_INTERVAL_MAX)
+    assert controller.get_poll_interval() == LinkamT95AutoController.POLL_INTERVAL_MAX
+
+    events = [e.event for e in controller.get_events()]
+    assert events == [
+        LinkamT95Event.REACHED_TARGET,
+        LinkamT95Event.HOLD_DONE,
+        LinkamT95Event.REACHED_TARGET,
+    ]
+    assert [r.sequence.temperature for r in received] == [400, 101]
+    assert controller.get_events() == []
+
+    import datetime
+
+    import freezegun
+
+    with freezegun.freeze_time(
+        datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=61)
+    ):
+        assert controller._LinkamT95AutoController__update(measurementState) is False
+    events = [e.event for e in controller.get_events()]
+    assert events == [LinkamT95Event.HOLD_DONE, LinkamT95Event.SEQUENCE_DONE]
+
+
+def test_auto_controller_restart_after_cancel(monkeypatch):
+    global dummy_has_reached_target_temperature
+
+    import time
+
+    from measurement_manager import MeasurementManager
+
+    # 中断した後にもう一度シーケンスを始められるか
+    measurementState = MeasurementState()
+    measurementState.current_step = MeasurementStep.MEASURING
+    monkeypatch.setattr(MeasurementManager, "get_measurement_state", lambda: measurementState)
+    controller = LinkamT95AutoController()
+    controller._LinkamT95AutoController__controller = DummyController()
+    dummy_has_reached_target_temperature = False
+
+    def wait_output(expected):
+        deadline = time.time() + 2
+        while OUTPUT != expected and time.time() < deadline:
+            time.sleep(0.01)
+        return OUTPUT == expected
+
+    controller.add_sequence(150, 10, 10, 10)
+    controller.start_sequence()
+    assert wait_output("150")
+    controller.cancel_sequence()
+
+    controller.add_sequence(250, 10, 10, 10)
+    controller.start_sequence()
+    assert wait_output("250")
+    controller.cancel_sequence()
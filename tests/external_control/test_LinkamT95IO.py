@@ -1,6 +1,14 @@
+import threading
+import time
+
 import pytest
 
-from ExternalControl.LinkamT95.IO import LinkamT95Error, LinkamT95IO
+from ExternalControl.LinkamT95.IO import LinkamT95Error, LinkamT95IO, LinkamT95SerialIO
+from ExternalControl.Simulation.Simulation import (
+    LinkamT95Simulator,
+    disable_simulation,
+    enable_simulation,
+)
 
 LINKAMT95IO_PATH = "ExternalControl.LinkamT95.IO.LinkamT95SerialIO"
 COMMAND = ""
@@ -101,3 +109,151 @@ def test_Linkam(monkeypatch):
     assert state == LinkamT95IO.State.Stopped
     assert T == -120
     assert lnp == 100
+
+
+def test_Linkam_shared_port():
+    linkam = LinkamT95Simulator(temperature=25, latency=0.02)
+    enable_simulation(serial_devices={"COM5": linkam})
+    try:
+        macro_side = LinkamT95IO()
+        macro_side.T95serial = LinkamT95SerialIO()
+        controller_side = LinkamT95IO()
+        controller_side.T95serial = LinkamT95SerialIO()
+        macro_side.connect("COM5")
+        controller_side.connect("COM5")  # 同じポートは開き直さない
+        assert macro_side.T95serial.ser is controller_side.T95serial.ser
+
+        time.sleep(0.1)  # connectのときのTコマンドの結果は使わない
+        linkam.commands.clear()
+        results = []
+
+        def read(target):
+            for _ in range(5):
+                results.append(target.read_status())
+
+        threads = [threading.Thread(target=read, args=(t,)) for t in [macro_side, controller_side] * 4]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # 返答が混ざらず, 同時に送ったTコマンドはまとめられる
+        assert len(results) == 40
+        assert all(r == (LinkamT95IO.State.Stopped, 25, 0) for r in results)
+        assert 0 < linkam.commands.count("T") < 40
+
+        # 書き込みの後は新しく状態を読む
+        controller_side.set_limit_temperature(100)
+        controller_side.set_rate(100)
+        controller_side.start()
+        linkam.commands.clear()
+        state, _, _ = macro_side.read_status()
+        assert state == LinkamT95IO.State.Heating
+        assert linkam.commands == ["T"]
+    finally:
+        disable_simulation()
+
+
+def test_Linkam_sampling():
+    linkam = LinkamT95Simulator(temperature=25, time_scale=60)
+    enable_simulation(serial_devices={"COM6": linkam})
+    try:
+        T95 = LinkamT95IO()
+        T95.T95serial = LinkamT95SerialIO()
+        T95.connect("COM6")
+        T95.set_limit_temperature(100)
+        T95.set_rate(60)  # 60℃/min (シミュレーションでは1秒で60℃)
+        T95.start()
+
+        sampler = T95.start_sampling(interval=0.02)
+        assert sampler.wait_next(timeout=1) is not None
+        time.sleep(0.3)
+
+        # get_statusは通信せずに最新の状態を返す
+        linkam.commands.clear()
+        state, temperature, _ = T95.get_status()
+        assert linkam.commands == []
+        assert state == LinkamT95IO.State.Heating
+        assert temperature == sampler.latest.temperature
+
+        history = sampler.history()
+        assert len(history) >= 5
+        assert all(a.timestamp < b.timestamp for a, b in zip(history, history[1:]))
+        # 履歴の温度変化の速さ(60℃/min × 60倍)
+        assert abs(sampler.get_rate() - 3600) < 500
+        middle = (history[0].timestamp + history[-1].timestamp) / 2
+        assert history[0].temperature < sampler.temperature_at(middle) < history[-1].temperature
+        assert sampler.temperature_at(history[-1].timestamp + 10) is None
+
+        T95.stop_sampling()
+        assert T95.sampler is None
+        time.sleep(0.1)
+        linkam.commands.clear()
+        T95.get_status()
+        assert linkam.commands == ["T"]
+    finally:
+        disable_simulation()
+
+
+def test_Linkam_write_cache():
+    linkam = LinkamT95Simulator()
+    enable_simulation(serial_devices={"COM7": linkam})
+    try:
+        T95 = LinkamT95IO()
+        T95.T95serial = LinkamT95SerialIO()
+        T95.connect("COM7")
+        T95.enable_write_cache()
+
+        # シーケンスの各ステップで同じ設定を送っても, 変わった設定だけが送られる
+        for limit in (100, 100, 50):
+            T95.set_limit_temperature(limit)
+            T95.set_rate(10)
+            T95.set_lnp_speed(50)
+            T95.start()
+        T95.set_lnp_speed(-1)
+        T95.set_lnp_speed(50)  # 窒素ガスのモードを変えたら速度も送り直す
+        T95.read_status()  # 書き込みが全て届くのを待つ
+        assert linkam.commands[1:] == [
+            "L11000", "R11000", "Pm0", "P?", "S",
+            "S",
+            "L1500", "S",
+            "Pa0",
+            "Pm0", "P?",
+            "T",
+        ]  # fmt: skip
+
+        # 接続し直したら全て送り直す
+        T95.connect("COM7")
+        linkam.commands.clear()
+        T95.set_rate(10)
+        T95.read_status()
+        assert linkam.commands == ["R11000", "T"]
+    finally:
+        disable_simulation()
+
+
+def test_Linkam_sampling_after_write():
+    linkam = LinkamT95Simulator(temperature=26)
+    enable_simulation(serial_devices={"COM8": linkam})
+    try:
+        T95 = LinkamT95IO()
+        T95.T95serial = LinkamT95SerialIO()
+        T95.connect("COM8")
+        sampler = T95.start_sampling(interval=10)  # 始めに読み取ったら次は10秒後
+        for _ in range(100):
+            if sampler.latest is not None:
+                break
+            time.sleep(0.01)
+        assert sampler.latest is not None
+        assert T95.get_status()[0] == LinkamT95IO.State.Stopped
+
+        # 書き込んだあとは書き込む前に読み取った状態を返さずに読み取り直す
+        T95.set_limit_temperature(33)
+        T95.set_rate(1)
+        T95.start()
+        linkam.commands.clear()
+        assert T95.get_status()[0] == LinkamT95IO.State.Heating
+        assert linkam.commands == ["T"]
+        T95.stop_sampling()
+    finally:
+        disable_simulation()
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from ExternalControl.Serial.Serial import SerialTimeoutError, SerialTransport, SerialTransportError
+from ExternalControl.Simulation.Simulation import SimulatedDevice, SimulatedSerial
+
+
+@pytest.fixture
+def device():
+    device = SimulatedDevice({r"A(\d)": lambda m: f"a{m.group(1)}", "W": "", "T": "t"}, latency=0.05)
+    SimulatedSerial.register("COM10", device)
+    yield device
+    SerialTransport.close_all()
+    SimulatedSerial.ports = {}
+
+
+def open_transport(**kwargs) -> SerialTransport:
+    return SerialTransport.open("COM10", lambda: SimulatedSerial(port="COM10"), **kwargs)
+
+
+def test_pipeline(device):
+    transport = open_transport()
+    assert open_transport() is transport  # 同じポートは開き直さない
+
+    # 前の応答を待たずに送るので, 5つの応答を待つ時間は1つ分とほぼ同じ
+    start = time.perf_counter()
+    futures = [transport.request(f"A{i}") for i in range(5)]
+    assert [f.result() for f in futures] == [[b"a0"], [b"a1"], [b"a2"], [b"a3"], [b"a4"]]
+    assert time.perf_counter() - start < 0.05 * 3
+
+    # 応答を待たない書き込みはすぐ返る
+    start = time.perf_counter()
+    transport.write("W")
+    assert time.perf_counter() - start < 0.05
+    assert transport.query("A9") == [b"a9"]
+    assert device.commands[-2:] == ["W", "A9"]
+
+
+def test_timeout(device):
+    transport = open_transport()
+
+    # 応答のないコマンドはそのコマンドのタイムアウトでエラーになる
+    start = time.perf_counter()
+    with pytest.raises(SerialTimeoutError):
+        transport.query("X", timeout=0.1)
+    assert 0.1 <= time.perf_counter() - start < 0.3
+    assert transport.query("A1") == [b"a1"]
+
+    transport.close()
+    with pytest.raises(SerialTransportError):
+        transport.request("A1")
+
+
+def test_coalesce(device):
+    transport = open_transport(coalesce=["T"])
+
+    futures = [transport.request("T") for _ in range(5)]
+    assert all(f is futures[0] for f in futures)
+    assert futures[0].result() == [b"t"]
+
+    time.sleep(0.1)
+    transport.write("W")  # 他のコマンドの後は新しく送る
+    assert transport.request("T") is not futures[0]
+    assert device.commands.count("T") == 2
+
+
+def test_late_response():
+    # 全てのコマンドに順番に応答するが, 応答が0.15秒遅れる機器
+    device = SimulatedDevice({r"(\w+)": lambda m: f"ans-{m.group(1)}"}, latency=0.15)
+    SimulatedSerial.register("COM11", device)
+    try:
+        transport = SerialTransport.open("COM11", lambda: SimulatedSerial(port="COM11"))
+        with pytest.raises(SerialTimeoutError):
+            transport.query("SLOW", timeout=0.1)
+
+        # 遅れて届いたSLOWの応答は次のコマンドの応答にしない
+        assert transport.query("A") == [b"ans-A"]
+        assert transport.query("B") == [b"ans-B"]
+    finally:
+        SerialTransport.close_all()
+        SimulatedSerial.ports = {}
+
+
+def test_late_response_after_grace(device):
+    transport = open_transport()
+    device.latency = 0.3
+    with pytest.raises(SerialTimeoutError):
+        transport.query("A1", timeout=0.1)  # 応答はtimeoutの2倍より遅れて届く
+
+    # timeoutの2倍より遅れて届いた応答も次のコマンドの応答にしない
+    time.sleep(0.25)
+    device.latency = 0.05
+    assert transport.query("A2") == [b"a2"]
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+from ExternalControl.GPIB.GPIB import GPIBController, GPIBError
+from ExternalControl.LinkamT95.IO import LinkamT95IO
+from ExternalControl.MAX303.MAX303Controller import MAX303Controller
+from ExternalControl.Simulation.Simulation import (
+    LinkamT95Simulator,
+    MAX303Simulator,
+    SimulatedDevice,
+    SimulatedSerial,
+    disable_simulation,
+    enable_simulation,
+    tmr_devices,
+)
+
+
+@pytest.fixture
+def simulation():
+    yield enable_simulation
+    disable_simulation()
+
+
+def test_visa(simulation):
+    simulation(visa_devices=tmr_devices(seed=0))
+
+    LCR = GPIBController()
+    LCR.connect(13)
+    Keithley = GPIBController()
+    Keithley.connect(11)
+
+    LCR.write("FREQ 1000")
+    assert float(LCR.query("FREQ?")) == 1000
+    assert len(LCR.query("FETC?").split(",")) == 3
+    assert 100 <= float(Keithley.query("FETCH?")) <= 110
+
+    answers = LCR.query_batch(["FREQ 2000", "FREQ?", "FETC?"])
+    assert float(answers[0]) == 2000
+    assert len(answers[1].split(",")) == 3
+    assert LCR.query_ascii_values("FETC?").shape == (3,)
+
+    with pytest.raises(GPIBError):
+        GPIBController().connect(1)
+
+
+def test_latency(simulation):
+    device = SimulatedDevice({r"\*IDN\?": "SIM", r"X\?": "1"}, latency=0.05)
+    simulation(visa_devices={"GPIB0::1::INSTR": device})
+    inst = GPIBController()
+    inst.connect(1)
+
+    start = time.perf_counter()
+    inst.query("X?")
+    assert time.perf_counter() - start >= 0.05
+    assert device.commands == ["*IDN?", "X?"]
+
+
+def test_serial_timeout(simulation):
+    SimulatedSerial.register("COM9", SimulatedDevice({"A": "ok"}))
+    ser = SimulatedSerial(port="COM9", timeout=0.05)
+
+    ser.write(b"A\rB\r")
+    assert ser.read_until(b"\r") == b"ok\r"
+    start = time.perf_counter()
+    assert ser.read_until(b"\r") == b""  # Bには応答がないのでタイムアウト
+    assert time.perf_counter() - start >= 0.05
+
+
+def test_linkam(simulation):
+    linkam = LinkamT95Simulator(temperature=25, time_scale=600)
+    simulation(serial_devices={"COM3": linkam})
+
+    T95 = LinkamT95IO()
+    T95.connect("COM3")
+    T95.set_limit_temperature(100)
+    T95.set_rate(100)
+    T95.set_lnp_speed(50)
+    T95.start()
+
+    state, temperature, pump_speed = T95.read_status()
+    assert state == LinkamT95IO.State.Heating
+    assert 25 <= temperature < 100
+    assert pump_speed == 50
+
+    time.sleep(0.2)
+    state, temperature, _ = T95.read_status()
+    assert state == LinkamT95IO.State.Holding_at_limit
+    assert temperature == 100
+
+
+def test_max303(simulation):
+    max303 = MAX303Simulator()
+    simulation(serial_devices={"COM4": max303})
+
+    controller = MAX303Controller()
+    controller.connect("COM4")
+    controller.shutter_open()
+    controller.lamp_on()
+
+    assert max303.shutter == 1
+    assert max303.lamp == 1
@@ -0,0 +1,174 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from ExternalControl.GPIB.GPIB import GPIBController
+from ExternalControl.LinkamT95.IO import LinkamT95Error, LinkamT95SerialIO
+from ExternalControl.Serial.Serial import SerialTransport
+from ExternalControl.Simulation.Simulation import SimulatedDevice, SimulatedSerial
+from ExternalControl.Trace.Trace import IOTracer, traced
+from ExternalControl.USB.USB import USBController
+
+
+class DummyInstrument:
+    def write(self, message):
+        pass
+
+    def query(self, message):
+        if message == "TIMEOUT?":
+            raise TimeoutError()
+        return "1.0,2.0\n"
+
+    def query_binary_values(self, message, **kwargs):
+        return np.zeros(4, dtype=np.float64)
+
+
+class DummySerialIO:
+    _trace_address = "COM3"
+
+    @traced(terminator=b"\r")
+    def write(self, command):
+        pass
+
+    @traced(terminator=b"\r")
+    def query(self, command):
+        self.write(command)
+        return b"abc\r" if command == "T" else b"ab"
+
+
+@pytest.fixture
+def tracer():
+    IOTracer.enable(capacity=4)
+    yield IOTracer
+    IOTracer.disable()
+
+
+def get_controller(address):
+    controller = GPIBController()
+    controller._instrument = DummyInstrument()
+    controller._trace_address = address
+    return controller
+
+
+def test_record(tracer):
+    controller = get_controller("GPIB0::13::INSTR")
+    controller.write("FREQ 1000")
+    controller.query("FETC?")
+    with pytest.raises(TimeoutError):
+        controller.query("TIMEOUT?")
+
+    records = tracer.get_records()
+    assert [r.command for r in records] == ["FREQ 1000", "FETC?", "TIMEOUT?"]
+    assert records[0].bytes_out == 9
+    assert records[1].bytes_in == 8  # 改行を含めて受信したバイト数
+    assert [r.timeout for r in records] == [False, False, True]
+    assert all(r.address == "GPIB0::13::INSTR" for r in records)
+
+
+def test_batch_and_binary(tracer):
+    controller = get_controller("GPIB0::14::INSTR")
+    controller.query_batch(["FREQ 1000", "FETC?"])
+    controller.query_binary_values("TRAC?", datatype="d")
+
+    # まとめて送ったコマンドは実際に送った1行として記録する
+    records = tracer.get_records()
+    assert [r.command for r in records] == ["FREQ 1000;:FETC?", "TRAC?"]
+    assert records[1].bytes_in == 32
+
+
+def test_serial(tracer):
+    io = DummySerialIO()
+    io.query("T")
+    io.query("X")
+
+    # query内のwriteは記録しない
+    records = tracer.get_records()
+    assert [r.command for r in records] == ["T", "X"]
+    assert [r.timeout for r in records] == [False, True]
+    assert tracer.summary()["COM3"]["count"] == 2
+    assert tracer.summary()["COM3"]["timeout"] == 1
+
+
+def test_ring_and_histogram(tracer):
+    controller = get_controller("GPIB0::11::INSTR")
+    for i in range(10):
+        controller.write(f"COMMAND{i}")
+
+    # 古いものから上書きされる
+    records = tracer.get_records()
+    assert [r.command for r in records] == [f"COMMAND{i}" for i in range(6, 10)]
+
+    # ヒストグラムは上書きされたものも含めて数える
+    assert sum(tracer.get_histogram("GPIB0::11::INSTR").values()) == 10
+    assert tracer.get_histogram("GPIB0::99::INSTR") == {}
+
+
+def test_disabled():
+    IOTracer.enable()
+    IOTracer.disable()
+    get_controller("GPIB0::13::INSTR").write("FREQ 1000")
+    assert IOTracer.get_records() == []
+
+
+def test_export_chrome_trace(tracer, tmp_path: Path):
+    get_controller("GPIB0::13::INSTR").write("FREQ 1000")
+    get_controller("GPIB0::11::INSTR").query("FETC?")
+
+    path = tmp_path / "trace.json"
+    tracer.export_chrome_trace(path)
+    events = json.loads(path.read_text(encoding="utf-8"))["traceEvents"]
+
+    names = {e["args"]["name"]: e["tid"] for e in events if e["ph"] == "M"}
+    assert set(names.keys()) == {"GPIB0::13::INSTR", "GPIB0::11::INSTR"}
+    calls = [e for e in events if e["ph"] == "X"]
+    assert [c["name"] for c in calls] == ["FREQ 1000", "FETC?"]
+    assert calls[1]["tid"] == names["GPIB0::11::INSTR"]
+
+
+def test_read_without_command(tracer):
+    class DummyReader:
+        def read(self):
+            return "1.0\n"
+
+    controller = USBController()
+    controller._instrument = DummyReader()
+    controller._trace_address = "USB0::1::INSTR"
+    assert controller.read() == "1.0\n"
+    IOTracer.disable()
+    assert controller.read() == "1.0\n"  # 記録しないときも引数なしで呼べる
+
+    records = tracer.get_records()
+    assert [(r.command, r.bytes_out, r.bytes_in) for r in records] == [("read()", 0, 4)]
+
+
+def test_command_table_is_bounded(tracer, monkeypatch):
+    monkeypatch.setattr(IOTracer, "MAX_COMMANDS", 4)
+    monkeypatch.setattr(IOTracer, "MAX_HEADERS", 2)
+    controller = get_controller("GPIB0::13::INSTR")
+    for i in range(4):
+        controller.write(f"FREQ {i}")
+    controller.write("FREQ 100")
+    controller.write("VOLT 1")
+    controller.write("APER LONG")
+
+    assert [r.command for r in tracer.get_records()] == ["FREQ 3", "FREQ …", "VOLT …", "…"]
+    assert len(IOTracer._commands) == 4 + 2 + 1
+
+
+def test_wrapped_serial_timeout(tracer):
+    SimulatedSerial.register("COM12", SimulatedDevice())  # 何も応答しない機器
+    try:
+        io = LinkamT95SerialIO()
+        io._transport = SerialTransport.open("COM12", lambda: SimulatedSerial(port="COM12"), timeout=0.1)
+        io._trace_address = "COM12"
+        with pytest.raises(LinkamT95Error):
+            io.query("T")
+
+        # LinkamT95Errorに包まれたタイムアウトもタイムアウトとして記録する
+        records = tracer.get_records()
+        assert [(r.command, r.timeout) for r in records] == [("T", True)]
+    finally:
+        SerialTransport.close_all()
+        SimulatedSerial.ports = {}
@@ -0,0 +1,75 @@
+import pytest
+
+from ExternalControl.GPIB.GPIB import GPIBController, GPIBError, get_instrument
+from ExternalControl.VISA.VISA import VISAResourcePool
+
+
+class DummyInstrument:
+    def __init__(self, address):
+        self.address = address
+        self.commands = []
+
+    def query(self, command):
+        self.commands.append(command)
+        if self.address == "GPIB0::1::INSTR":
+            raise Exception("no response")
+        return "DUMMY,0,0,0\n"
+
+    def write(self, command):
+        self.commands.append(command)
+
+    def close(self):
+        pass
+
+
+class DummyResourceManager:
+    def __init__(self):
+        self.opened = []
+
+    def open_resource(self, address):
+        self.opened.append(address)
+        return DummyInstrument(address)
+
+
+@pytest.fixture
+def resource_manager():
+    rm = DummyResourceManager()
+    VISAResourcePool.set_resource_manager(rm)
+    yield rm
+    VISAResourcePool.set_resource_manager(None)
+
+
+def test_share_resource(resource_manager):
+    a = GPIBController()
+    b = GPIBController()
+    a.connect(9)
+    b.connect("GPIB0::9::INSTR")
+    get_instrument(9)
+
+    # 同じアドレスは1回だけ開いて*IDN?も1回だけ送る
+    assert resource_manager.opened == ["GPIB0::9::INSTR"]
+    assert a._instrument is b._instrument
+    assert a._instrument.commands == ["*IDN?"]
+
+    GPIBController().connect(10)
+    assert resource_manager.opened == ["GPIB0::9::INSTR", "GPIB0::10::INSTR"]
+
+
+def test_no_response(resource_manager):
+    with pytest.raises(GPIBError):
+        GPIBController().connect(1)
+
+    # 応答しなかったリソースは保持しない
+    assert "GPIB0::1::INSTR" not in VISAResourcePool._resources
+
+    with pytest.raises(GPIBError):
+        GPIBController().connect(1)
+    assert resource_manager.opened == ["GPIB0::1::INSTR", "GPIB0::1::INSTR"]
+
+
+def test_close_resource(resource_manager):
+    GPIBController().connect(9)
+    VISAResourcePool.close_resource("GPIB0::9::INSTR")
+    GPIBController().connect(9)
+
+    assert resource_manager.opened == ["GPIB0::9::INSTR", "GPIB0::9::INSTR"]
@@ -102,3 +102,53 @@ def test_BaseData_6():
     with pytest.raises(BaseData.BaseDataError):
         data=Data(value1=1,value3=1)
     
+
+
+def test_BaseData_slots():
+    class Data(BaseData):
+        time: "[s]"
+        voltage: "[V]"
+        current: "[A]"
+
+    # 変数はクラスを定義した順に並ぶ
+    data = Data(current=3, time=1, voltage=2)
+    assert Data.__slots__ == ("time", "voltage", "current")
+    assert not hasattr(data, "__dict__")
+    assert tuple(data) == (1, 2, 3)
+    assert str(data) == "1,2,3"
+
+    # 変数が1つのとき
+    class Data(BaseData):
+        x: ""
+
+    assert tuple(Data(x=5)) == (5,)
+
+
+def test_BaseData_custom_init_iter():
+    # コンストラクタで値を入れなかった変数は飛ばす
+    class Data(BaseData):
+        x: "[mV]"
+        y: "[m]"
+
+        def __init__(self, y) -> None:
+            self.y = y
+
+    assert list(Data(3)) == [3]
+    with pytest.raises(BaseData.BaseDataError):
+        Data(3).z = 1
+
+
+def test_BaseData_reserved_names():
+    # コンストラクタの中で使う名前と同じ変数名も使える
+    class Data(BaseData):
+        args: ""
+        keywards: ""
+        self: ""
+        _MISSING: ""
+
+    data = Data(args=1, keywards=2, self=3, _MISSING=4)
+    assert tuple(data) == (1, 2, 3, 4)
+    with pytest.raises(BaseData.BaseDataError):
+        Data(args=1, keywards=2, self=3)
+    with pytest.raises(BaseData.BaseDataError):
+        Data(1, 2, 3, 4)
@@ -0,0 +1,192 @@
+import multiprocessing
+import shutil
+from pathlib import Path
+
+import pytest
+
+import batch
+from batch import BatchError, find_files
+from variables import init
+
+RECALC_MACRO = """
+from pathlib import Path
+
+def recalculate(filepath):
+    filepath = Path(filepath)
+    if "bad" in filepath.name:
+        raise ValueError("bad file")
+    output = filepath.with_name(filepath.stem + "_recalc.txt")
+    values = [float(v) * {factor} for v in filepath.read_text().split()]
+    output.write_text(" ".join(map(str, values)))
+    return output
+"""
+
+
+@pytest.fixture
+def data_dir(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / "data"
+    folder.mkdir()
+    for i in range(3):
+        (folder / f"run{i}.txt").write_text(f"{i} {i + 1}")
+    (folder / "bad.txt").write_text("0")
+    (folder / "_ignored.txt").write_text("0")
+    return folder
+
+
+def write_macro(tmp_path: Path, factor: int) -> Path:
+    path = tmp_path / "recalc_macro.py"
+    path.write_text(RECALC_MACRO.format(factor=factor))
+    return path
+
+
+def test_find_files(data_dir: Path):
+    names = [f.name for f in find_files(data_dir)]
+    assert names == ["bad.txt", "run0.txt", "run1.txt", "run2.txt"]
+    names = [f.name for f in find_files(str(data_dir / "run*.txt"))]
+    assert names == ["run0.txt", "run1.txt", "run2.txt"]
+
+    with pytest.raises(BatchError):
+        find_files(data_dir / "none*.txt")
+
+
+def test_recalculate(tmp_path: Path, data_dir: Path):
+    macro = write_macro(tmp_path, 2)
+
+    results = batch.recalculate(macro, data_dir, processes=2)
+    assert [r.path.name for r in results] == ["bad.txt", "run0.txt", "run1.txt", "run2.txt"]
+    assert [r.ok for r in results] == [False, True, True, True]
+    assert "bad file" in results[0].error
+    assert (data_dir / "run1_recalc.txt").read_text() == "2.0 4.0"
+
+    # 変わっていないファイルは飛ばす (出力ファイルも入力にしない)
+    results = batch.recalculate(macro, data_dir, processes=2)
+    assert [r.path.name for r in results] == ["bad.txt"]
+
+    # 入力ファイルが変わったらそのファイルだけ再計算
+    (data_dir / "run2.txt").write_text("10")
+    results = batch.recalculate(macro, data_dir, processes=1)
+    assert [r.path.name for r in results] == ["bad.txt", "run2.txt"]
+    assert (data_dir / "run2_recalc.txt").read_text() == "20.0"
+
+    # 出力ファイルが消えたら再計算
+    (data_dir / "run0_recalc.txt").unlink()
+    results = batch.recalculate(macro, data_dir, processes=1)
+    assert [r.path.name for r in results] == ["bad.txt", "run0.txt"]
+
+    # マクロが変わったら全て再計算
+    macro = write_macro(tmp_path, 3)
+    results = batch.recalculate(macro, data_dir, processes=2)
+    assert len(results) == 4
+    assert (data_dir / "run1_recalc.txt").read_text() == "3.0 6.0"
+
+    # forceなら全て再計算
+    results = batch.recalculate(macro, data_dir, processes=2, force=True)
+    assert len(results) == 4
+
+
+SPLIT_MACRO = """
+from pathlib import Path
+
+def split(filepath):
+    filepath = Path(filepath)
+    if "bad" in filepath.name:
+        raise ValueError("bad file")
+    folder = filepath.parent / filepath.stem
+    folder.mkdir()
+    for i, value in enumerate(filepath.read_text().split()):
+        (folder / f"{i}.txt").write_text(value)
+"""
+
+
+def test_split(tmp_path: Path, data_dir: Path):
+    macro = tmp_path / "split_macro.py"
+    macro.write_text(SPLIT_MACRO)
+
+    results, report_path = batch.split(macro, data_dir, processes=2)
+    assert [r.ok for r in results] == [False, True, True, True]
+    assert (data_dir / "run1" / "1.txt").read_text() == "2"
+
+    # レポートは次の分割の対象にならない名前で作られる
+    assert report_path.parent == data_dir
+    assert report_path.name.startswith("_split_report_")
+    report = report_path.read_text(encoding="utf-8")
+    assert "files: 4  succeeded: 3  failed: 1" in report
+    assert "ERROR\t" in report
+    assert "ValueError: bad file" in report
+
+    # 分割済みのファイル(フォルダがすでにある)はエラーになるが他のファイルは続ける
+    report_path = tmp_path / "report.txt"
+    (data_dir / "run3.txt").write_text("7 8")
+    results, _ = batch.split(macro, data_dir / "run*.txt", processes=2, report_path=report_path)
+    assert [r.ok for r in results] == [False, False, False, True]
+    assert (data_dir / "run3" / "0.txt").read_text() == "7"
+    assert "files: 4  succeeded: 1  failed: 3" in report_path.read_text(encoding="utf-8")
+
+
+SPAWN_MACRO = """
+from pathlib import Path
+
+from variables import SHARED_VARIABLES, USER_VARIABLES
+
+def recalculate(filepath):
+    output = Path(filepath).with_name("variables.txt")
+    output.write_text(f"{SHARED_VARIABLES.SSR_HOMEDIR}\\n{USER_VARIABLES.DATADIR}")
+    return output
+"""
+
+
+def test_run_batch_spawn(tmp_path: Path, data_dir: Path):
+    # spawnで起動したワーカーでもSSRの変数と定義ファイルが設定される
+    (tmp_path / "scripts").mkdir()
+    shutil.copy(Path(batch.__file__).parent / "log_config.json", tmp_path / "scripts")
+    init(tmp_path)
+    deffile = tmp_path / "define.def"
+    deffile.write_text("DATADIR=./data\nTMPDIR=./temp\n")
+    macro = tmp_path / "spawn_macro.py"
+    macro.write_text(SPAWN_MACRO)
+
+    results = batch.run_batch(
+        macro,
+        "recalculate",
+        [data_dir / "run0.txt"],
+        deffile=deffile,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    assert [r.ok for r in results] == [True], results[0].error
+    home, datadir = (data_dir / "variables.txt").read_text().splitlines()
+    assert Path(home) == tmp_path
+    assert Path(datadir) == data_dir
+
+
+CRASH_MACRO = """
+import os
+from pathlib import Path
+
+def recalculate(filepath):
+    filepath = Path(filepath)
+    if "crash" in filepath.name:
+        os._exit(1)  # ワーカープロセスが落ちる
+    output = filepath.with_name(filepath.stem + "_recalc.txt")
+    output.write_text("ok")
+    return output
+"""
+
+
+def test_recalculate_broken_pool(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / "data"
+    folder.mkdir()
+    for name in ("a.txt", "b_crash.txt", "c.txt"):
+        (folder / name).write_text("0")
+    macro = tmp_path / "crash_macro.py"
+    macro.write_text(CRASH_MACRO)
+
+    # ワーカープロセスが落ちても全体は止めずに, 残りのファイルを失敗として返す
+    results = batch.recalculate(macro, folder, processes=1)
+    assert [(r.path.name, r.ok) for r in results] == [("a.txt", True), ("b_crash.txt", False), ("c.txt", False)]
+    assert "BrokenProcessPool" in results[1].error
+
+    # 終わったファイルは記録されているので次は飛ばす
+    results = batch.recalculate(macro, folder, processes=1)
+    assert [r.path.name for r in results] == ["b_crash.txt", "c.txt"]
@@ -0,0 +1,64 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from console_input import PosixConsoleBackend
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="POSIXのみ")
+
+
+@pytest.fixture
+def pipe():
+    r, w = os.pipe()
+    reader = os.fdopen(r, "r")
+    writer = os.fdopen(w, "w")
+    yield reader, writer
+    reader.close()
+    if not writer.closed:
+        writer.close()
+
+
+def test_wait_input(pipe):
+    reader, writer = pipe
+    backend = PosixConsoleBackend(reader)
+
+    start = time.perf_counter()
+    assert not backend.wait_input(0.05)
+    assert time.perf_counter() - start >= 0.05
+
+    # 入力が来たらすぐに戻る
+    timer = threading.Timer(0.05, lambda: (writer.write("stop\n"), writer.flush()))
+    timer.start()
+    start = time.perf_counter()
+    assert backend.wait_input(5)
+    assert time.perf_counter() - start < 1
+    assert reader.readline() == "stop\n"
+
+
+def test_flush_pipe(pipe):
+    reader, writer = pipe
+    backend = PosixConsoleBackend(reader)
+    writer.write("command\n")
+    writer.flush()
+
+    # パイプから流し込んだ入力は捨てない
+    backend.flush()
+    assert reader.readline() == "command\n"
+
+
+def test_read_line(pipe):
+    reader, writer = pipe
+    backend = PosixConsoleBackend(reader)
+    writer.write("stop\nnext\n残りの入力\n")
+    writer.close()
+
+    # 改行より後は読まずに残す
+    assert backend.wait_input(1)
+    assert backend.read_line() == "stop"
+    assert backend.read_line() == "next"
+    assert reader.read() == "残りの入力\n"
+    with pytest.raises(EOFError):
+        backend.read_line()
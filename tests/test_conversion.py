@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from calibration import TMRCalibrationManager
+from conversion import CompiledConversion, ConversionChain, ConverterError, DataConverter
+
+
+def test_DataConverter_table():
+    converter = DataConverter()
+    converter.set_table([3, 1, 2], [30, 10, 20])
+    x, y = converter.table
+    assert list(x) == [1, 2, 3]
+    assert list(y) == [10, 20, 30]
+    assert converter.convert(4) == 40
+
+    # xに同じ値がある変換表もconvertには使える (ConversionChainには使えない)
+    converter.set_table([1, 2, 2, 3], [10, 20, 20, 30])
+    assert converter.convert(2.5) == 25
+    with pytest.raises(ConverterError):
+        ConversionChain().add(converter)
+
+
+def test_ConversionChain_tables():
+    r = np.linspace(20, 300, 15)
+    t = r**1.1  # 抵抗値→温度
+    stage_t = np.array([0, 50, 130, 400, 600])
+    stage_correction = np.array([1, 52, 129, 405, 590])  # 温度の補正
+
+    chain = ConversionChain().add_table(r, t).add_table(stage_t, stage_correction)
+    compiled = chain.compile()
+
+    x = np.linspace(15, 320, 1001)  # 範囲外も含む
+    inside = (20 <= x) & (x <= 300)
+    assert np.allclose(compiled.convert(x)[inside], chain(x)[inside], rtol=0, atol=1e-9)
+    assert compiled.increasing
+    assert isinstance(compiled.convert(100.0), float)
+
+
+def test_ConversionChain_function():
+    chain = ConversionChain().add_table([0, 10], [0, 10]).add_function(np.sqrt)
+    compiled = chain.compile(x_min=1, x_max=10, max_error=1e-4)
+
+    x = np.linspace(1, 10, 10001)
+    assert np.max(np.abs(compiled(x) - np.sqrt(x))) <= 1e-4
+    assert len(compiled) < 1000
+
+
+def test_ConversionChain_calibration(tmp_path: Path):
+    path = tmp_path / "calibration.txt"
+    path.write_text("T[K],R[Ohm]\n1,100\n4,200\n9,300\n16,400\n25,500\n")
+    calibration = TMRCalibrationManager()
+    calibration.set_own_calib_file(str(path))
+
+    compiled = ConversionChain().add_table([0, 1000], [0, 500]).add(calibration).compile()
+    assert compiled.convert(500) == calibration.calibration(250)
+    assert compiled.inverse().convert(6.5) == pytest.approx(500)
+
+
+def test_ConversionChain_error():
+    with pytest.raises(ConverterError):
+        ConversionChain().compile()
+    with pytest.raises(ConverterError):
+        ConversionChain().add_function(np.sqrt).compile()
+    with pytest.raises(ConverterError):  # 単調でない
+        ConversionChain().add_table([0, 1, 2], [0, 1, 0]).compile()
+    with pytest.raises(ConverterError):
+        CompiledConversion([0, 0, 1], [0, 1, 2])
@@ -0,0 +1,83 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from basedata import BaseData
+from datatable import DataTable, DataTableError
+from filesplitter import FileSplitter
+from measurement_manager_support import FileManager
+
+
+class Data(BaseData):
+    time: "[s]"
+    voltage: "[V]"
+    count: ""
+
+
+def test_append_and_grow():
+    table = DataTable(Data, capacity=2, dtypes={"count": "i8"})
+    for i in range(5):
+        table.append(Data(time=i * 0.5, voltage=i * 2.0, count=i))
+    table.append((10.0, 20.0, 30))
+
+    assert len(table) == 6
+    assert table.columns == ("time", "voltage", "count")
+    assert table.units == {"time": "[s]", "voltage": "[V]", "count": ""}
+    assert table.dtype.itemsize == 8 * 3
+    assert table["count"].dtype == np.int64
+    assert table["time"].tolist() == [0.0, 0.5, 1.0, 1.5, 2.0, 10.0]
+    assert table[1].tolist() == (0.5, 2.0, 1)
+    assert list(table)[-1] == (10.0, 20.0, 30)
+
+    table.clear()
+    assert len(table) == 0
+
+
+def test_zero_copy_column():
+    table = DataTable(Data)
+    table.extend(Data(time=i, voltage=i, count=i) for i in range(3))
+
+    column = table["voltage"]
+    assert np.shares_memory(column, table.array)
+    column[0] = 100
+    assert table[0].tolist() == (0.0, 100.0, 0.0)
+
+
+def test_error():
+    with pytest.raises(DataTableError):
+        DataTable(dict)
+    with pytest.raises(DataTableError):
+        DataTable(Data, dtypes={"current": "f8"})
+
+    table = DataTable(Data)
+    with pytest.raises(DataTableError):
+        table["current"]
+    with pytest.raises(DataTableError):
+        table.append(("a", "b", "c"))
+
+
+def test_save(tmp_path: Path):
+    table = DataTable(Data, dtypes={"count": "i8"})
+    table.append(Data(time=0.5, voltage=1.0, count=1))
+    table.append(Data(time=1.5, voltage=2.0, count=2))
+
+    path = tmp_path / "data.txt"
+    file = FileManager()
+    file.set_file(path)
+    file.save(table)
+    file.close()
+
+    assert path.read_text() == "0.5\t1.0\t1\n1.5\t2.0\t2\n"
+
+
+def test_split(tmp_path: Path):
+    table = DataTable(Data, dtypes={"count": "i8"})
+    for i in range(4):
+        table.append(Data(time=i, voltage=i * 2, count=i % 2))
+
+    FileSplitter.from_table(table, tmp_path).column_value_split(2).create("\t")
+
+    label = "0:time[s]\t1:voltage[V]\t2:count\n"
+    assert (tmp_path / "0.txt").read_text() == label + "0.0\t0.0\t0\n2.0\t4.0\t0\n"
+    assert (tmp_path / "1.txt").read_text() == label + "1.0\t2.0\t1\n3.0\t6.0\t1\n"
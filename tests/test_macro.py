@@ -1,6 +1,9 @@
 from pathlib import Path
+from types import SimpleNamespace
 
-from macro import get_macro, get_macropath
+import pytest
+from macro import MacroError, check_macro_grammar, get_macro, get_macropath, reload_macro
+from macro_grammar import RedefinitionError
 from variables import USER_VARIABLES, init
 
 
@@ -66,3 +69,167 @@ def update():
     assert macro.end is None
     assert macro.split is None
     assert macro.after is None
+
+
+def test_get_macro_cache(tmp_path: Path, monkeypatch):
+    init(tmp_path)
+    macro_path = tmp_path / "count.ssr"
+    macro_path.write_text(
+        """
+count = 0
+
+def update():
+    global count
+    count += 1
+"""
+    )
+
+    macro = get_macro(macro_path)
+    check_macro_grammar(macro)
+    cache_dir = tmp_path / "temp" / "macro_cache"
+    assert len(list(cache_dir.glob("*.code"))) == 1
+    assert len(list(cache_dir.glob("*.checked"))) == 1
+
+    # 中身が変わっていなければコンパイルも文法チェックもしない
+    def fail(*args, **kwargs):
+        raise AssertionError()
+
+    monkeypatch.setattr("builtins.compile", fail)
+    monkeypatch.setattr("macro.macro_grammer_check", fail)
+    macro = get_macro(macro_path)
+    check_macro_grammar(macro)
+    macro.update()
+    assert macro.count == 1
+    monkeypatch.undo()
+
+    # 中身が変われば読み込み直してチェックする
+    macro_path.write_text(
+        """
+count = 0
+
+def update():
+    count = 1
+"""
+    )
+    macro = get_macro(macro_path)
+    with pytest.raises(RedefinitionError):
+        check_macro_grammar(macro)
+    assert len(list(cache_dir.glob("*.code"))) == 2
+    assert len(list(cache_dir.glob("*.checked"))) == 1
+
+
+def test_reload_macro(tmp_path: Path):
+    init(tmp_path)
+    macro_path = tmp_path / "reload.ssr"
+    macro_path.write_text(
+        """
+class Instrument:
+    def read(self):
+        return 1
+
+instrument = Instrument()
+values = []
+
+def update():
+    values.append(instrument.read())
+"""
+    )
+    macro = get_macro(macro_path)
+    check_macro_grammar(macro)
+    instrument = macro.instrument
+    macro.update()
+
+    # 関数だけが入れ替わり, グローバル変数はそのまま
+    macro_path.write_text(
+        """
+class Instrument:
+    def read(self):
+        return 1
+
+instrument = Instrument()
+values = []
+
+def update():
+    values.append(instrument.read() * 10)
+
+def on_command(command):
+    values.append(command)
+"""
+    )
+    assert sorted(reload_macro(macro)) == ["on_command", "update"]
+    macro.update()
+    macro.on_command("x")
+    assert macro.instrument is instrument
+    assert macro.values == [1, 10, "x"]
+
+    # 文法チェックに引っかかったら元に戻す
+    update = macro.update
+    macro_path.write_text(
+        """
+values = []
+
+def update():
+    values = 1
+"""
+    )
+    with pytest.raises(RedefinitionError):
+        reload_macro(macro)
+    assert macro.update is update
+
+    # 引数の数が変わったら元に戻す
+    macro_path.write_text(
+        """
+def update(x):
+    pass
+"""
+    )
+    with pytest.raises(MacroError):
+        reload_macro(macro)
+    assert macro.update is update
+
+    macro_path.write_text("def update(:\n")
+    with pytest.raises(SyntaxError):
+        reload_macro(macro)
+    macro.update()
+    assert macro.values == [1, 10, "x", 10]
+
+
+def test_reload_macro_while_measuring(monkeypatch):
+    import measurement_manager
+
+    def broken_reload(target):
+        raise OSError("マクロファイルが消えている")
+
+    # どんなエラーでも測定は止めずに元のマクロのまま続ける
+    monkeypatch.setattr(measurement_manager, "reload_macro", broken_reload)
+    measurement_manager.MeasurementManager.reload_macro(SimpleNamespace(macro=None))
+
+
+def test_reload_macro_decorated(tmp_path: Path):
+    init(tmp_path)
+    macro_path = tmp_path / "decorated.ssr"
+    source = """
+import functools
+
+values = []
+
+def twice(func):
+    @functools.wraps(func)
+    def wrapper():
+        func()
+        func()
+    return wrapper
+
+@twice
+def update():
+    values.append({value})
+"""
+    macro_path.write_text(source.format(value=1))
+    macro = get_macro(macro_path)
+    macro.update()
+
+    # デコレーターのついた関数は入れ替えない (中身だけ入れ替えるとデコレーターが外れる)
+    macro_path.write_text(source.format(value=2))
+    assert reload_macro(macro) == ["twice"]
+    macro.update()
+    assert macro.values == [1, 1, 1, 1]
@@ -1,8 +1,14 @@
+import json
+import signal
+import sys
 from pathlib import Path
 
+import pytest
+
+from define import DefineFileError
 from log import setlog
-from MAIN import main
-from variables import init
+from MAIN import MainError, apply_args, main, parse_args, split_only
+from variables import RUN_OPTIONS, init
 
 
 def test_main_meas():
@@ -11,3 +17,112 @@ def test_main_meas():
     setlog()
 
     main()
+
+
+@pytest.fixture
+def run_options():
+    yield RUN_OPTIONS
+    RUN_OPTIONS.reset()
+
+
+def test_parse_args(tmp_path: Path):
+    config = tmp_path / "config.json"
+    config.write_text(
+        json.dumps(
+            {"mode": "MEAS", "def": "user.def", "output": "a.txt", "no_plot": True}
+        ),
+        encoding="utf-8",
+    )
+
+    args = parse_args(["--config", str(config), "--output", "b.txt", "--headless"])
+    assert args.mode == "MEAS"
+    assert args.deffile == Path("user.def")
+    assert args.macro is None
+    assert args.output == Path("b.txt")  # 引数の方が優先
+    assert args.no_plot is True
+    assert args.headless is True
+
+    args = parse_args(["SPLIT"])
+    assert args.mode == "SPLIT"
+    assert args.no_plot is False
+    assert args.headless is False
+
+    with pytest.raises(MainError):
+        parse_args(["--config", str(tmp_path / "none.json")])
+
+
+def test_main_headless(tmp_path: Path, monkeypatch, run_options):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "path", sys.path[:])
+    monkeypatch.setattr(signal, "signal", lambda *args: None)  # 強制終了時の処理は登録しない
+    init(tmp_path)
+
+    deffile = tmp_path / "user.def"
+    deffile.write_text("DATADIR=data\nTMPDIR=user_temp\n", encoding="utf-8")
+    (tmp_path / "data").mkdir()
+    (tmp_path / "user_temp").mkdir()
+    macrofile = tmp_path / "macro.py"
+    macrofile.write_text(
+        """
+from measurement_manager import save, set_plot_info
+count = [0]
+
+def start():
+    set_plot_info(line=True)
+
+def update():
+    count[0] += 1
+    save(count[0])
+    return count[0] < 3
+""",
+        encoding="utf-8",
+    )
+
+    apply_args(
+        parse_args(
+            ["MEAS", "--headless", "--no-plot", "--output", "result.txt"]
+            + ["--def", str(deffile), "--macro", str(macrofile)]
+        )
+    )
+    main(deffile, macrofile)
+
+    assert (tmp_path / "data" / "result.txt").read_text() == "1\n2\n3\n"
+
+
+def test_main_headless_without_deffile(tmp_path: Path, run_options):
+    init(tmp_path)
+    RUN_OPTIONS.HEADLESS = True
+
+    with pytest.raises(DefineFileError):
+        main()
+
+
+def test_split_only_relative_files(tmp_path: Path, monkeypatch, run_options):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "path", sys.path[:])
+    RUN_OPTIONS.HEADLESS = True
+    (tmp_path / "macros").mkdir()
+    macrofile = tmp_path / "macros" / "split_macro.py"
+    macrofile.write_text(
+        """
+from pathlib import Path
+
+def split(filepath):
+    Path(filepath).with_suffix(".done").write_text("ok")
+""",
+        encoding="utf-8",
+    )
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "run0.txt").write_text("0")
+
+    # --filesの相対パスはマクロのフォルダではなく起動した場所から
+    split_only(Path("macros/split_macro.py"), "data", processes=1)
+    assert (tmp_path / "data" / "run0.done").read_text() == "ok"
+
+
+def test_split_only_headless_without_macro(run_options, monkeypatch):
+    RUN_OPTIONS.HEADLESS = True
+    monkeypatch.setattr("MAIN.ask_open_filename", None)  # ダイアログは出さない
+
+    with pytest.raises(MainError):
+        split_only()
@@ -1,6 +1,19 @@
+import os
+import sys
+import time
 from pathlib import Path
 
-from measurement_manager_support import FileManager, PlotAgency
+import pytest
+
+import console_input
+from console_input import PosixConsoleBackend
+from measurement_manager_support import (
+    CommandReceiver,
+    FileManager,
+    MeasurementState,
+    MeasurementStep,
+    PlotAgency,
+)
 
 
 def test_FileManager(tmp_path: Path):
@@ -46,3 +59,68 @@ def test_PlotAgency():
     assert info["renew_interval"] == 2
     assert info["legend"] is True
     assert info["flowwidth"] == 3
+
+
+def test_PlotAgency_prewarm(monkeypatch):
+    monkeypatch.setenv("MPLBACKEND", "Agg")
+    plot = PlotAgency()
+    plot.prewarm()
+    process = plot.plot_process
+    assert process.is_alive()
+
+    # plot_infoを送るまではグラフを出さずに待っている
+    plot.set_plot_info(renew_interval=0.1)
+    plot.run_plot_window()
+    assert plot.plot_process is process
+    plot.plot(1, 2)
+    time.sleep(0.5)
+    assert plot.is_plot_window_alive()
+
+    plot.stop_renew_plot_window()
+    plot.close()
+    process.join(5)
+    assert not process.is_alive()
+
+
+def test_PlotAgency_cancel():
+    plot = PlotAgency()
+    plot.prewarm()
+    process = plot.plot_process
+
+    plot.cancel()
+    process.join(5)
+    assert not process.is_alive()
+    assert plot.plot_process is None
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIXのみ")
+def test_CommandReceiver(monkeypatch):
+    r, w = os.pipe()
+    reader = os.fdopen(r, "r")
+    writer = os.fdopen(w, "w")
+    monkeypatch.setattr(sys, "stdin", reader)
+    monkeypatch.setattr(console_input, "_backend", PosixConsoleBackend())
+
+    state = MeasurementState()
+    state.current_step = MeasurementStep.UPDATE
+    receiver = CommandReceiver(state)
+    receiver.initialize()
+    assert receiver.get_command() is None
+
+    writer.write("first\n\nsecond\n")
+    writer.flush()
+    assert receiver.get_command(timeout=5) == "first"
+    assert receiver.get_command(timeout=5) == "second"
+
+    state.current_step = MeasurementStep.FINISH_MEASURE
+    writer.close()  # 入力を受け取るスレッドはEOFで終わる
+    time.sleep(0.1)
+    reader.close()
+
+
+def test_PlotAgency_plot_array():
+    plot = PlotAgency()
+    with pytest.raises(PlotAgency.PlotAgentError):
+        plot.plot_array([1, 2], [1])
+
+    PlotAgency.NoPlotAgency().plot_array([1, 2], [3, 4], label="a")
@@ -0,0 +1,43 @@
+import subprocess
+import sys
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SCRIPTS_DIR = ROOT_DIR / "scripts"
+
+
+def load_startup_profile():
+    """benchmarks/startup_profile.pyを読み込む (benchmarksはパッケージではないのでファイルから読む)"""
+    spec = spec_from_file_location("startup_profile", ROOT_DIR / "benchmarks" / "startup_profile.py")
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# 起動時に読み込まれてはいけない重いモジュール (ベンチマークと同じものを使う)
+HEAVY_MODULES = load_startup_profile().HEAVY_MODULES
+
+
+def get_loaded_modules(module: str) -> set:
+    """別プロセスでmoduleをimportして, 読み込まれたモジュール名を返す"""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys; import {module}; print('\\n'.join(sys.modules))",
+        ],
+        cwd=SCRIPTS_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return {name.split(".")[0] for name in result.stdout.splitlines()}
+
+
+@pytest.mark.parametrize("module", ["MAIN", "measurement_manager"])
+def test_no_heavy_imports(module):
+    loaded = get_loaded_modules(module)
+    assert [m for m in HEAVY_MODULES if m in loaded] == []
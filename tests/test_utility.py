@@ -1,3 +1,4 @@
+import os
 from datetime import datetime
 from pathlib import Path
 from unittest.mock import MagicMock
@@ -28,3 +29,38 @@ def test_get_date_text(monkeypatch):
     monkeypatch.setattr("datetime.datetime", datetime_mock)
 
     assert get_date_text() == "210401-120000"
+
+
+def test_get_encode_type_large_file(tmp_path: Path):
+    # 先頭は英数字だけで末尾に日本語があるファイル
+    path = tmp_path / "data.txt"
+    body = "1.0\t2.0\t3.0\n" * 20000
+    path.write_text(body + "終了\n", encoding="sjis")
+    assert get_encode_type(path) == "SHIFT_JIS"
+
+    # サンプルの境界でutf-8の文字が切れていても大丈夫
+    path = tmp_path / "utf8.txt"
+    path.write_text("あ" * 100000, encoding="utf-8")
+    assert get_encode_type(path) == "utf-8"
+
+    # 先頭64KiBは英数字だけで, 末尾のサンプル(最後の64KiB)がutf-8の文字の途中から始まる
+    path = tmp_path / "utf8_tail.txt"
+    path.write_text("a" * (64 * 1024) + "あ" * 42000, encoding="utf-8")
+    assert (path.stat().st_size - 2 * 64 * 1024) % 3 != 0
+    assert get_encode_type(path) == "utf-8"
+
+
+def test_get_encode_type_cache(tmp_path: Path, monkeypatch):
+    path = tmp_path / "data.txt"
+    path.write_text("utf-8ファイル", encoding="utf-8")
+    assert get_encode_type(path) == "utf-8"
+
+    # 内容が変わらなければファイルを読まない
+    monkeypatch.setattr("builtins.open", None)
+    assert get_encode_type(path) == "utf-8"
+    monkeypatch.undo()
+
+    # 書き換えたら判別し直す
+    path.write_text("sjisファイル", encoding="sjis")
+    os.utime(path, ns=(0, 0))
+    assert get_encode_type(path) == "SHIFT_JIS"